@@ -0,0 +1,144 @@
+import argparse
+import os
+import sys
+from db import Database
+import checkpoints
+import export
+import importer
+import queries
+
+# Command-line entry point for jobs that run without a display. Nothing here
+# imports Qt, so it starts quickly on servers.
+#
+#   python -m aims report transactions --from 2024-04-01 --to 2025-03-31 --branch North -o tx.csv
+#   python -m aims import acquisitions procurement.csv
+#   python -m aims import items items.csv
+#   python -m aims import master-data setup.json
+#   AIMS_TOKEN=<secret> python -m aims serve --host 0.0.0.0
+
+# import kinds that go through importer.upsert_master_data; master-data is a
+# JSON object with a list per kind
+MASTER_DATA_KINDS = {'categories': 'categories', 'sub-categories': 'sub_categories', 'branches': 'branches',
+                     'items': 'items', 'master-data': None}
+
+def iso_date(value):
+    # Dates are compared as text, so only the zero-padded form will do:
+    # 2024-1-5 would sort after 2024-10-01
+    try:
+        return importer.iso_date("date", value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a YYYY-MM-DD date, got {value!r}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="aims", description="Assets and Inventory Management System")
+    parser.add_argument("--db", default="assets_inventory.db", help="database file (default: assets_inventory.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="write a report as CSV or JSON Lines")
+    report.add_argument("name", choices=sorted(queries.REPORTS))
+    report.add_argument("-o", "--output", help="output file (default: stdout); .csv.gz is compressed")
+    report.add_argument("-f", "--format", choices=["csv", "jsonl", "csv.gz"], help="output format (default: from the file name, else csv)")
+    report.add_argument("--from", dest="date_from", type=iso_date, metavar="DATE", help="first date to include (YYYY-MM-DD)")
+    report.add_argument("--to", dest="date_to", type=iso_date, metavar="DATE", help="last date to include (YYYY-MM-DD)")
+    report.add_argument("--branch", help="only rows for this branch name")
+    report.add_argument("--as-of", type=iso_date, metavar="DATE", help="balances at the end of this date (dashboard, branch-balance)")
+    load = commands.add_parser("import", help="import rows from a CSV or JSON file")
+    load.add_argument("kind", choices=["acquisitions"] + sorted(MASTER_DATA_KINDS))
+    load.add_argument("file")
+    load.add_argument("--errors", metavar="FILE", help="where to write rejected acquisitions (default: <file>.errors.csv)")
+    load.add_argument("--chunk-size", type=int, default=5000, help="rows per transaction (default: 5000)")
+    serve = commands.add_parser("serve", help="serve the database to AIMS clients over HTTP/JSON")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1; 0.0.0.0 for the whole network, which needs AIMS_TOKEN set)")
+    serve.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    serve.add_argument("--readers", type=int, default=4, help="read connections in the pool (default: 4)")
+    return parser
+
+def run_serve(args):
+    import server  # asyncio and the HTTP code only load for serve
+    print(f"Serving {args.db} on http://{args.host}:{args.port}/ (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        server.serve(args.db, args.host, args.port, args.readers, os.environ.get("AIMS_TOKEN"))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"aims: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+def run_report(args):
+    db = Database(args.db)
+    if args.as_of and not queries.REPORTS[args.name].get('as_of'):
+        print(f"aims: The {args.name} report has no as-of view.", file=sys.stderr)
+        return 2
+    try:
+        as_of_params = checkpoints.as_of_params(db, args.as_of) if args.as_of else None
+        query, params = queries.report_query(args.name, args.date_from, args.date_to, args.branch, as_of_params)
+    except ValueError as e:
+        print(f"aims: {e}", file=sys.stderr)
+        return 2
+    headers = queries.REPORTS[args.name]['headers']
+    if args.output:
+        count = export.export_query(db, query, headers, args.output, params, fmt=args.format)
+        print(f"Exported {count} rows to {args.output}.", file=sys.stderr)
+        return 0
+    fmt = args.format or "csv"
+    if fmt == "csv.gz":
+        print("aims: csv.gz output needs --output", file=sys.stderr)
+        return 2
+    try:
+        export.write_chunks(sys.stdout, headers, export.stream_query(db, query, params), fmt)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Reader went away (e.g. piped into head); stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
+
+def run_master_data_import(args):
+    db = Database(args.db)
+    try:
+        records = importer.read_master_data(args.file, MASTER_DATA_KINDS[args.kind])
+        counts, problems = importer.upsert_master_data(db, records)
+    except (OSError, ValueError) as e:
+        print(f"aims: {e}", file=sys.stderr)
+        return 2
+    for kind, number, reason in problems[:20]:
+        print(f"{kind} record {number}: {reason}", file=sys.stderr)
+    if len(problems) > 20:
+        print(f"... and {len(problems) - 20} more rejected records", file=sys.stderr)
+    for kind, kind_counts in counts.items():
+        print(f"{kind}: {kind_counts['inserted']} inserted, {kind_counts['updated']} updated, {kind_counts['rejected']} rejected.", file=sys.stderr)
+    return 1 if problems else 0
+
+def run_import(args):
+    if args.kind in MASTER_DATA_KINDS:
+        return run_master_data_import(args)
+    db = Database(args.db)
+    errors = args.errors or importer.error_filename(args.file)
+    try:
+        imported, rejected = importer.import_acquisitions(db, args.file, errors, args.chunk_size)
+    except (OSError, ValueError) as e:
+        print(f"aims: {e}", file=sys.stderr)
+        return 2
+    print(f"Imported {imported} rows." + (f" {rejected} rows rejected, see {errors}." if rejected else ""), file=sys.stderr)
+    return 1 if rejected else 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Master data can go into a new deployment's database; Database.connect()
+    # creates the file. Everything else needs an existing one.
+    creates = args.command == "import" and args.kind in MASTER_DATA_KINDS
+    if not creates and not os.path.exists(args.db):
+        print(f"aims: database not found: {args.db}", file=sys.stderr)
+        return 2
+    try:
+        if args.command == "report":
+            return run_report(args)
+        if args.command == "import":
+            return run_import(args)
+        if args.command == "serve":
+            return run_serve(args)
+    finally:
+        Database.close_all()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
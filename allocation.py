@@ -0,0 +1,221 @@
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional
+import queries
+import refdata
+
+class AllocationError(ValueError):
+    pass
+
+class VoucherError(AllocationError):
+    # problems: (line index, message) for every line that failed validation
+    def __init__(self, problems):
+        super().__init__(f"{len(problems)} voucher lines cannot be issued.")
+        self.problems = problems
+
+class DisposalError(AllocationError):
+    # problems: (line index, message) for every line that failed validation
+    def __init__(self, problems):
+        super().__init__(f"{len(problems)} disposal lines cannot be disposed of.")
+        self.problems = problems
+
+@dataclass
+class BatchAllocation:
+    batch_id: int
+    quantity: int
+    cost: float = 0.0
+
+@dataclass
+class VoucherLine:
+    item_id: int
+    acquisition_year: Optional[str]
+    branch_id: int
+    quantity: int
+    allocations: List[BatchAllocation] = field(default_factory=list)
+
+@dataclass
+class DisposalLine:
+    item_id: int
+    acquisition_year: Optional[str]
+    quantity: int
+    allocations: List[BatchAllocation] = field(default_factory=list)
+
+def store_branch_id(db):
+    store_id = refdata.get(db).store_id
+    if store_id is None:
+        raise AllocationError("Store branch not found.")
+    return store_id
+
+def plan_fifo(db, item_id, branch_id, acquisition_year, quantity) -> List[BatchAllocation]:
+    rows = db.fetch_all(queries.FIFO_SPLIT, {'item_id': item_id, 'branch_id': branch_id, 'year': acquisition_year, 'quantity': quantity})
+    allocations = [BatchAllocation(batch_id, take, cost) for batch_id, cost, take in rows]
+    allocated = sum(a.quantity for a in allocations)
+    if allocated < quantity:
+        raise AllocationError(f"Quantity exceeds available ({allocated}).")
+    return allocations
+
+def store_batches(db, store_id, item_ids):
+    # [batch_id, balance, cost] of the items' Store batches with stock left,
+    # oldest first, keyed by (item_id, acquisition_year); one query for all
+    available = {}
+    items = json.dumps(sorted(set(item_ids)))
+    for batch_id, item_id, year, balance, cost in db.fetch_all(queries.STORE_BATCHES, {'items': items, 'branch_id': store_id}):
+        available.setdefault((item_id, year), []).append([batch_id, balance, cost])
+    return available
+
+def take_fifo(batches, quantity) -> List[BatchAllocation]:
+    # Takes quantity off the front of a store_batches() list, which the caller
+    # has checked holds enough; later takes see what earlier ones used up.
+    allocations = []
+    while quantity:
+        batch = batches[0]
+        take = min(batch[1], quantity)
+        allocations.append(BatchAllocation(batch[0], take, batch[2]))
+        batch[1] -= take
+        quantity -= take
+        if not batch[1]:
+            batches.pop(0)
+    return allocations
+
+def issue_return(db, transaction_type, item_id, branch_id, acquisition_year, quantity, transaction_date,
+                 authority_ref="", remarks="", dry_run=False) -> List[BatchAllocation]:
+    # Issue moves stock Store -> branch, Return moves it branch -> Store. Every
+    # source batch gets an asset_transactions row and the destination gets a
+    # derived asset_batches row carrying the same cost and acquisition year,
+    # linked back to it through source_batch_id.
+    store_id = store_branch_id(db)
+    if branch_id == store_id:
+        raise AllocationError("Cannot issue to Store." if transaction_type == "Issue" else "Cannot return from Store.")
+    if transaction_type == "Issue":
+        source_branch_id, dest_branch_id = store_id, branch_id
+    elif transaction_type == "Return":
+        source_branch_id, dest_branch_id = branch_id, store_id
+    else:
+        raise AllocationError(f"Unknown transaction type: {transaction_type}")
+    if quantity <= 0:
+        raise AllocationError("Quantity must be positive.")
+
+    if dry_run:
+        return plan_fifo(db, item_id, source_branch_id, acquisition_year, quantity)
+    remote = db.remote()
+    if remote is not None:
+        reply = remote.call("POST", "/issue-return", {
+            'transaction_type': transaction_type, 'item_id': item_id, 'branch_id': branch_id, 'acquisition_year': acquisition_year,
+            'quantity': quantity, 'transaction_date': transaction_date, 'authority_ref': authority_ref, 'remarks': remarks})
+        return [BatchAllocation(**a) for a in reply['allocations']]
+    with db.transaction():
+        allocations = plan_fifo(db, item_id, source_branch_id, acquisition_year, quantity)
+        dest_branch_name = refdata.get(db).branch_names[dest_branch_id]
+        source = f"Issued to {dest_branch_name}" if transaction_type == "Issue" else f"Returned to {dest_branch_name}"
+        db.execute_many("""INSERT INTO asset_transactions (batch_id, transaction_type, from_branch_id, to_branch_id, transaction_date, quantity, authority_ref, remarks)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                        [(a.batch_id, transaction_type, source_branch_id, dest_branch_id, transaction_date, a.quantity, authority_ref, remarks)
+                         for a in allocations])
+        db.execute_many("""INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, source, quantity, cost, authority_ref, remarks, acquisition_year, source_batch_id)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        [(item_id, dest_branch_id, transaction_date, transaction_type, source, a.quantity, a.cost, authority_ref, remarks, acquisition_year, a.batch_id)
+                         for a in allocations])
+    return allocations
+
+def plan_voucher(db, lines) -> List[VoucherLine]:
+    # Splits every line of a bulk voucher across the Store batches of its
+    # item and year from one read of the Store stock, in line order, so each
+    # line sees what the lines before it took. Raises VoucherError listing
+    # every line that cannot be issued. Fills in and returns the lines'
+    # allocations.
+    store_id = store_branch_id(db)
+    branch_names = refdata.get(db).branch_names
+    available = store_batches(db, store_id, [line.item_id for line in lines])
+    problems = []
+    for index, line in enumerate(lines):
+        line.allocations = []
+        if line.branch_id == store_id:
+            problems.append((index, "Cannot issue to Store."))
+            continue
+        if line.branch_id not in branch_names:
+            problems.append((index, "Unknown branch."))
+            continue
+        if line.quantity <= 0:
+            problems.append((index, "Quantity must be positive."))
+            continue
+        batches = available.get((line.item_id, line.acquisition_year), [])
+        left = sum(batch[1] for batch in batches)
+        if line.quantity > left:
+            problems.append((index, f"Quantity exceeds available ({left})."))
+            continue
+        line.allocations = take_fifo(batches, line.quantity)
+    if problems:
+        raise VoucherError(problems)
+    return lines
+
+def issue_voucher(db, lines, transaction_date, authority_ref="", remarks="", dry_run=False) -> List[VoucherLine]:
+    # Issues every line of a bulk voucher from Store in one transaction,
+    # planned again against the current stock; nothing is posted if any line
+    # fails. A dry run only plans, without taking the write lock.
+    if dry_run:
+        return plan_voucher(db, lines)
+    remote = db.remote()
+    if remote is not None:
+        reply = remote.call("POST", "/vouchers", {
+            'lines': [{'item_id': line.item_id, 'acquisition_year': line.acquisition_year, 'branch_id': line.branch_id,
+                       'quantity': line.quantity} for line in lines],
+            'transaction_date': transaction_date, 'authority_ref': authority_ref, 'remarks': remarks})
+        for line, posted in zip(lines, reply['lines']):
+            line.allocations = [BatchAllocation(**a) for a in posted['allocations']]
+        return lines
+    with db.transaction():
+        plan_voucher(db, lines)
+        store_id = store_branch_id(db)
+        branch_names = refdata.get(db).branch_names
+        source = {branch_id: f"Issued to {name}" for branch_id, name in branch_names.items()}
+        db.execute_many("""INSERT INTO asset_transactions (batch_id, transaction_type, from_branch_id, to_branch_id, transaction_date, quantity, authority_ref, remarks)
+                           VALUES (?, 'Issue', ?, ?, ?, ?, ?, ?)""",
+                        [(a.batch_id, store_id, line.branch_id, transaction_date, a.quantity, authority_ref, remarks)
+                         for line in lines for a in line.allocations])
+        db.execute_many("""INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, source, quantity, cost, authority_ref, remarks, acquisition_year, source_batch_id)
+                           VALUES (?, ?, ?, 'Issue', ?, ?, ?, ?, ?, ?, ?)""",
+                        [(line.item_id, line.branch_id, transaction_date, source[line.branch_id], a.quantity, a.cost, authority_ref, remarks, line.acquisition_year, a.batch_id)
+                         for line in lines for a in line.allocations])
+    return lines
+
+def plan_disposal(db, lines) -> List[DisposalLine]:
+    # Splits every line across the Store batches of its item and year, oldest
+    # first, from one read of the Store stock. Raises DisposalError listing
+    # every line that cannot be disposed of. Fills in and returns the lines'
+    # allocations.
+    available = store_batches(db, store_branch_id(db), [line.item_id for line in lines])
+    problems = []
+    for index, line in enumerate(lines):
+        line.allocations = []
+        if line.quantity <= 0:
+            problems.append((index, "Quantity must be positive."))
+            continue
+        batches = available.get((line.item_id, line.acquisition_year), [])
+        left = sum(batch[1] for batch in batches)
+        if line.quantity > left:
+            problems.append((index, f"Quantity exceeds available ({left})."))
+            continue
+        line.allocations = take_fifo(batches, line.quantity)
+    if problems:
+        raise DisposalError(problems)
+    return lines
+
+def dispose(db, lines, disposal_date, disposal_method, authority_ref="", remarks="") -> List[DisposalLine]:
+    # Plans the lines again against the current stock and writes every
+    # asset_disposal row in one transaction; nothing is written if any line
+    # fails.
+    remote = db.remote()
+    if remote is not None:
+        reply = remote.call("POST", "/disposals", {
+            'lines': [{'item_id': line.item_id, 'acquisition_year': line.acquisition_year, 'quantity': line.quantity} for line in lines],
+            'disposal_date': disposal_date, 'disposal_method': disposal_method, 'authority_ref': authority_ref, 'remarks': remarks})
+        for line, posted in zip(lines, reply['lines']):
+            line.allocations = [BatchAllocation(**a) for a in posted['allocations']]
+        return lines
+    with db.transaction():
+        plan_disposal(db, lines)
+        db.execute_many("""INSERT INTO asset_disposal (batch_id, disposal_date, quantity, disposal_method, authority_ref, remarks)
+                           VALUES (?, ?, ?, ?, ?, ?)""",
+                        [(a.batch_id, disposal_date, a.quantity, disposal_method, authority_ref, remarks)
+                         for line in lines for a in line.allocations])
+    return lines
@@ -0,0 +1,69 @@
+import sys
+from db import Database, BATCH_BALANCES_SQL
+import queries
+
+BATCH_BALANCE_COLUMNS = "batch_id, item_id, branch_id, acquisition_year, quantity, issued, disposed, balance"
+
+# item x branch x year balances straight from the ledger in one grouped pass:
+# acquisitions count in, movements and disposals count out against the batch
+# they were taken from. Used to check queries.BALANCES.
+LEDGER_BALANCES_SQL = """
+    SELECT item_id, branch_id, acquisition_year, SUM(quantity) as balance
+    FROM (
+        SELECT item_id, branch_id, acquisition_year, quantity FROM asset_batches
+        UNION ALL
+        SELECT ab.item_id, ab.branch_id, ab.acquisition_year, -at.quantity
+        FROM asset_transactions at JOIN asset_batches ab ON at.batch_id = ab.batch_id
+        WHERE at.transaction_type IN ('Issue', 'Transfer', 'Return')
+        UNION ALL
+        SELECT ab.item_id, ab.branch_id, ab.acquisition_year, -ad.quantity
+        FROM asset_disposal ad JOIN asset_batches ab ON ad.batch_id = ab.batch_id
+    )
+    GROUP BY item_id, branch_id, acquisition_year
+"""
+
+def rebuild_batch_balances(db):
+    # Recompute every batch balance from the ledger; returns the row count.
+    with db.transaction():
+        db.execute_query("DELETE FROM batch_balances")
+        db.execute_query(f"INSERT INTO batch_balances ({BATCH_BALANCE_COLUMNS}) " + BATCH_BALANCES_SQL)
+        return db.fetch_one("SELECT COUNT(*) FROM batch_balances")[0]
+
+def verify_batch_balances(db):
+    # Batch ids whose stored balance row disagrees with the ledger (or is
+    # missing / left over).
+    rows = db.fetch_all(f"""
+        SELECT batch_id FROM ({BATCH_BALANCES_SQL} EXCEPT SELECT {BATCH_BALANCE_COLUMNS} FROM batch_balances)
+        UNION
+        SELECT batch_id FROM (SELECT {BATCH_BALANCE_COLUMNS} FROM batch_balances EXCEPT {BATCH_BALANCES_SQL})
+        ORDER BY batch_id
+    """)
+    return [batch_id for (batch_id,) in rows]
+
+def verify_balances(db):
+    # (item_id, branch_id, acquisition_year) keys where the balance engine
+    # disagrees with a recomputation from the ledger.
+    rows = db.fetch_all(f"""
+        SELECT item_id, branch_id, acquisition_year FROM ({LEDGER_BALANCES_SQL} EXCEPT {queries.BALANCES})
+        UNION
+        SELECT item_id, branch_id, acquisition_year FROM ({queries.BALANCES} EXCEPT {LEDGER_BALANCES_SQL})
+    """)
+    return [tuple(row) for row in rows]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "verify"):
+        print("Usage: python balances.py rebuild|verify [database]")
+        sys.exit(2)
+    db = Database(sys.argv[2]) if len(sys.argv) > 2 else Database()
+    if sys.argv[1] == "rebuild":
+        print(f"Rebuilt balances for {rebuild_batch_balances(db)} batches.")
+    else:
+        mismatched = verify_batch_balances(db)
+        if mismatched:
+            print(f"{len(mismatched)} batch balances differ from the ledger: {mismatched}")
+            sys.exit(1)
+        mismatched = verify_balances(db)
+        if mismatched:
+            print(f"{len(mismatched)} item/branch/year balances differ from the ledger: {mismatched}")
+            sys.exit(1)
+        print("Batch balances match the ledger.")
@@ -0,0 +1,206 @@
+import os
+import sys
+import tempfile
+import time
+from db import Database
+import balances
+import compaction
+import queries
+
+# Timings on synthetic ledgers. Each run seeds a fresh database file with
+# about N ledger rows (one batch per ten rows, eight movements and one
+# disposal per batch) and reports the best of three runs per query.
+#
+#   python benchmark.py balances [rows ...]
+#   python benchmark.py valuation [rows ...]
+#   python benchmark.py compaction [rows ...]
+#   python benchmark.py paging [rows ...]
+
+# Branch x item balance the way the Branch-wise Balance report used to work it
+# out: three correlated subqueries per asset_batches row.
+CORRELATED_BRANCH_BALANCE = """
+    SELECT b.branch_name, i.item_name,
+           SUM(ab.quantity
+               - (SELECT COALESCE(SUM(at.quantity), 0) FROM asset_transactions at WHERE at.batch_id = ab.batch_id AND at.transaction_type IN ('Issue', 'Transfer'))
+               - (SELECT COALESCE(SUM(at.quantity), 0) FROM asset_transactions at WHERE at.batch_id = ab.batch_id AND at.transaction_type = 'Return')
+               - (SELECT COALESCE(SUM(ad.quantity), 0) FROM asset_disposal ad WHERE ad.batch_id = ab.batch_id)) as total_balance
+    FROM asset_batches ab
+    JOIN branches b ON ab.branch_id = b.branch_id
+    JOIN items i ON ab.item_id = i.item_id
+    GROUP BY b.branch_id, b.branch_name, i.item_id, i.item_name
+    HAVING total_balance > 0
+"""
+
+def seed_ledger(db, rows, items=200, branches=20, years=10, derived=False):
+    batches = max(rows // 10, 1)
+    with db.transaction():
+        db.execute_many("INSERT INTO branches (branch_name) VALUES (?)", [("Store",)] + [(f"Branch {n}",) for n in range(1, branches)])
+        db.execute_query("INSERT INTO categories (category_name) VALUES ('Bench')")
+        db.execute_query("INSERT INTO sub_categories (category_id, subcategory_name) VALUES (1, 'Bench')")
+        db.execute_many("INSERT INTO items (item_name, category_id, subcategory_id) VALUES (?, 1, 1)", [(f"Item {n}",) for n in range(items)])
+        db.execute_query(f"""
+            WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < {batches - 1})
+            INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year)
+            SELECT n % {items} + 1, n % {branches} + 1, '2020-01-01', 'Purchase', 100, 5.0 + n % 7, CAST(2015 + n % {years} AS TEXT) FROM seq
+        """)
+        db.execute_query(f"""
+            WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < {batches * 8 - 1})
+            INSERT INTO asset_transactions (batch_id, transaction_type, from_branch_id, to_branch_id, transaction_date, quantity)
+            SELECT n % {batches} + 1, CASE WHEN n % 4 = 3 THEN 'Return' ELSE 'Issue' END, 1, 2, '2021-01-01', 1 FROM seq
+        """)
+        db.execute_query(f"""
+            WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < {batches - 1})
+            INSERT INTO asset_disposal (batch_id, disposal_date, quantity, disposal_method)
+            SELECT n + 1, '2022-01-01', 1, 'Condemnation' FROM seq
+        """)
+        if derived:
+            # The batches issue_return would have split off: one per movement,
+            # and a second generation from returning one unit of every other one.
+            db.execute_query("""
+                INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year, source_batch_id)
+                SELECT ab.item_id, at.to_branch_id, at.transaction_date, at.transaction_type, at.quantity, ab.cost, ab.acquisition_year, ab.batch_id
+                FROM asset_transactions at JOIN asset_batches ab ON at.batch_id = ab.batch_id
+            """)
+            db.execute_query(f"""
+                INSERT INTO asset_transactions (batch_id, transaction_type, from_branch_id, to_branch_id, transaction_date, quantity)
+                SELECT batch_id, 'Return', branch_id, 1, '2023-01-01', 1 FROM asset_batches WHERE batch_id > {batches} AND batch_id % 2 = 0
+            """)
+            db.execute_query("""
+                INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year, source_batch_id)
+                SELECT ab.item_id, at.to_branch_id, at.transaction_date, at.transaction_type, at.quantity, ab.cost, ab.acquisition_year, ab.batch_id
+                FROM asset_transactions at JOIN asset_batches ab ON at.batch_id = ab.batch_id
+                WHERE at.transaction_date = '2023-01-01'
+            """)
+
+def time_query(db, query, params=(), repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = db.fetch_all(query, params)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def per_batch_valuation(db):
+    # Valuation the slow way, for comparison: each batch with stock left
+    # walks its source_batch_id chain with one lookup per step.
+    totals = {}
+    for batch_id, item_id, branch_id, year, balance in db.fetch_all(
+            "SELECT batch_id, item_id, branch_id, acquisition_year, balance FROM batch_balances WHERE balance != 0"):
+        source_id, cost = db.fetch_one("SELECT source_batch_id, cost FROM asset_batches WHERE batch_id = ?", (batch_id,))
+        while source_id is not None:
+            source = db.fetch_one("SELECT source_batch_id, cost FROM asset_batches WHERE batch_id = ?", (source_id,))
+            if source is None:
+                break
+            source_id = source[0]
+            cost = source[1] if source[1] is not None else cost
+        quantity, value = totals.get((item_id, branch_id, year), (0, 0.0))
+        totals[(item_id, branch_id, year)] = (quantity + balance, value + balance * (cost or 0))
+    return totals
+
+def temporary_database():
+    directory = tempfile.mkdtemp()
+    return Database(os.path.join(directory, "bench.db"))
+
+def remove_database(db):
+    db.close()
+    os.remove(db.db_name)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db.db_name + suffix):
+            os.remove(db.db_name + suffix)
+    os.rmdir(os.path.dirname(db.db_name))
+
+def bench_balances(sizes):
+    columns = [
+        ("correlated", CORRELATED_BRANCH_BALANCE),
+        ("ledger pass", balances.LEDGER_BALANCES_SQL),
+        ("engine", queries.BALANCES),
+        ("branch report", queries.BRANCH_BALANCE),
+        ("dashboard", queries.STOCK_REGISTER),
+    ]
+    print(f"{'rows':>10}" + "".join(f"{name:>15}" for name, _ in columns))
+    for rows in sizes:
+        db = temporary_database()
+        seed_ledger(db, rows)
+        timings = {}
+        results = {}
+        for name, query in columns:
+            timings[name], results[name] = time_query(db, query)
+        print(f"{rows:>10}" + "".join(f"{timings[name] * 1000:>13.1f}ms" for name, _ in columns))
+        if sorted(results["correlated"]) != sorted(results["branch report"]):
+            print("  branch report disagrees with the correlated query")
+        if balances.verify_balances(db):
+            print("  balance engine disagrees with the ledger")
+        remove_database(db)
+
+def bench_valuation(sizes):
+    columns = ["per batch", "valuation", "by item", "by category"]
+    print(f"{'rows':>10}{'batches':>10}" + "".join(f"{name:>15}" for name in columns))
+    for rows in sizes:
+        db = temporary_database()
+        seed_ledger(db, rows, derived=True)
+        timings = {}
+        start = time.perf_counter()
+        expected = per_batch_valuation(db)
+        timings["per batch"] = time.perf_counter() - start
+        timings["valuation"], result = time_query(db, queries.VALUATION_BALANCES)
+        timings["by item"], _ = time_query(db, queries.VALUATION)
+        timings["by category"], _ = time_query(db, queries.CATEGORY_VALUATION)
+        batches = db.fetch_one("SELECT COUNT(*) FROM asset_batches")[0]
+        print(f"{rows:>10}{batches:>10}" + "".join(f"{timings[name] * 1000:>13.1f}ms" for name in columns))
+        valued = {(item_id, branch_id, year): (quantity, value) for item_id, branch_id, year, quantity, value in result}
+        if valued.keys() != expected.keys() or any(valued[key][0] != expected[key][0] or abs(valued[key][1] - expected[key][1]) > 1e-6
+                                                   for key in expected):
+            print("  valuation disagrees with the per-batch walk")
+        remove_database(db)
+
+def bench_compaction(sizes):
+    names = [name for name, _ in compaction.TIMED_QUERIES]
+    print(f"{'rows':>10}{'batches':>10}{'removed':>10}{'compact':>12}" + "".join(f"{name + ' before':>18}{'after':>10}" for name in names))
+    for rows in sizes:
+        db = temporary_database()
+        seed_ledger(db, rows, derived=True)
+        batches = db.fetch_one("SELECT COUNT(*) FROM asset_batches")[0]
+        expected = sorted(db.fetch_all(queries.VALUATION_BALANCES))
+        before = compaction.time_queries(db)
+        start = time.perf_counter()
+        _, removed = compaction.compact_batches(db)
+        elapsed = time.perf_counter() - start
+        after = compaction.time_queries(db)
+        print(f"{rows:>10}{batches:>10}{removed:>10}{elapsed:>11.1f}s" + "".join(f"{before[name] * 1000:>16.1f}ms{after[name] * 1000:>8.1f}ms" for name in names))
+        if sorted(db.fetch_all(queries.VALUATION_BALANCES)) != expected or balances.verify_balances(db):
+            print("  compacted ledger disagrees with the original")
+        remove_database(db)
+
+# The reports the GUI pages through (queries.keyset_page) and their keys
+PAGED_REPORTS = [
+    ("dashboard", queries.DASHBOARD, queries.DASHBOARD_KEYS),
+    ("stock register", queries.SUMMARY, queries.REPORTS['stock-register']['keys']),
+    ("branch balance", queries.BRANCH_BALANCE, queries.REPORTS['branch-balance']['keys']),
+    ("valuation", queries.VALUATION, queries.REPORTS['valuation']['keys']),
+    ("by category", queries.CATEGORY_VALUATION, queries.REPORTS['category-valuation']['keys']),
+]
+
+def bench_paging(sizes, page_size=500):
+    # One keyset page against the whole report: the first page, and the page
+    # after the middle row as a view scrolled halfway down reads it
+    print(f"{'rows':>10}{'report':>16}{'report rows':>13}{'full':>12}{'first page':>12}{'mid page':>12}")
+    for rows in sizes:
+        db = temporary_database()
+        seed_ledger(db, rows, items=2000)
+        for name, query, keys in PAGED_REPORTS:
+            full, result = time_query(db, query)
+            first, _ = time_query(db, *queries.keyset_page(query, (), keys, None, page_size))
+            ordered = db.fetch_all(*queries.keyset_page(query, (), keys))
+            middle = ordered[len(ordered) // 2][-len(keys):] if ordered else None
+            mid, _ = time_query(db, *queries.keyset_page(query, (), keys, middle, page_size))
+            print(f"{rows:>10}{name:>16}{len(result):>13}" + "".join(f"{timing * 1000:>10.1f}ms" for timing in (full, first, mid)))
+        remove_database(db)
+
+if __name__ == "__main__":
+    benches = {"balances": bench_balances, "valuation": bench_valuation, "compaction": bench_compaction, "paging": bench_paging}
+    if len(sys.argv) < 2 or sys.argv[1] not in benches:
+        print("Usage: python benchmark.py balances|valuation|compaction|paging [rows ...]")
+        sys.exit(2)
+    sizes = [int(arg) for arg in sys.argv[2:]] or [10000, 100000, 1000000]
+    benches[sys.argv[1]](sizes)
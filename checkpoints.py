@@ -0,0 +1,91 @@
+import sys
+from datetime import date
+from db import Database
+import queries
+
+# Month-end balance checkpoints behind the "as of" reports. A checkpoint for
+# month M holds every non-zero item x branch x year balance at the end of M
+# and is built from the checkpoint for M-1 plus the movements dated in M, so
+# an as-of query only replays the ledger after the nearest checkpoint.
+
+def next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+def previous_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year - (number == 1):04d}-{(number - 2) % 12 + 1:02d}"
+
+def first_ledger_month(db):
+    first = db.fetch_one("""
+        SELECT MIN(first_date) FROM (
+            SELECT MIN(acquisition_date) as first_date FROM asset_batches
+            UNION ALL SELECT MIN(transaction_date) FROM asset_transactions
+            UNION ALL SELECT MIN(disposal_date) FROM asset_disposal
+        )
+    """)[0]
+    return first[:7] if first else None
+
+def build_checkpoints(db, through_month):
+    # Builds the missing checkpoints up to through_month ('YYYY-MM'), each from
+    # the one before; returns how many months were built.
+    built = 0
+    with db.transaction():
+        last = db.fetch_one("SELECT MAX(month) FROM checkpoint_months")[0]
+        month = next_month(last) if last else first_ledger_month(db)
+        while month and month <= through_month:
+            db.execute_query(f"""
+                INSERT INTO balance_checkpoints (month, item_id, branch_id, acquisition_year, balance)
+                SELECT :checkpoint, item_id, branch_id, acquisition_year, balance
+                FROM ({queries.AS_OF_BALANCES})
+                WHERE balance != 0
+            """, {'checkpoint': month, 'month': last or '', 'start': month + "-01" if last else '', 'as_of': month + "-31"})
+            db.execute_query("INSERT INTO checkpoint_months (month) VALUES (?)", (month,))
+            last = month
+            month = next_month(month)
+            built += 1
+    return built
+
+def rebuild_checkpoints(db, through_month=None):
+    with db.transaction():
+        db.execute_query("DELETE FROM balance_checkpoints")
+        db.execute_query("DELETE FROM checkpoint_months")
+        return build_checkpoints(db, through_month or previous_month(date.today().isoformat()[:7]))
+
+def as_of_params(db, as_of):
+    # Parameters for queries.AS_OF_BALANCES (and the reports built on it) at
+    # the end of day as_of ('YYYY-MM-DD'), building missing checkpoints first.
+    # The current month is never checkpointed: every new write would drop it.
+    remote = db.remote()
+    if remote is not None:
+        return remote.call("POST", "/as-of", {'as_of': as_of})
+    through_month = min(previous_month(as_of[:7]), previous_month(date.today().isoformat()[:7]))
+    build_checkpoints(db, through_month)
+    month = db.fetch_one("SELECT MAX(month) FROM checkpoint_months WHERE month <= ?", (through_month,))[0]
+    return {'month': month or '', 'start': next_month(month) + "-01" if month else '', 'as_of': as_of}
+
+def verify_as_of(db, as_of):
+    # Keys whose checkpointed as-of balance differs from a full ledger replay
+    replay = {'month': '', 'start': '', 'as_of': as_of}
+    params = as_of_params(db, as_of)
+    checkpointed = set(db.fetch_all(f"SELECT * FROM ({queries.AS_OF_BALANCES}) WHERE balance != 0", params))
+    replayed = set(db.fetch_all(f"SELECT * FROM ({queries.AS_OF_BALANCES}) WHERE balance != 0", replay))
+    return sorted({row[:3] for row in checkpointed ^ replayed}, key=str)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("build", "rebuild", "verify"):
+        print("Usage: python checkpoints.py build|rebuild|verify [YYYY-MM-DD] [database]")
+        sys.exit(2)
+    args = sys.argv[2:]
+    as_of = args.pop(0) if args and args[0][:4].isdigit() else date.today().isoformat()
+    db = Database(args[0]) if args else Database()
+    if sys.argv[1] == "build":
+        print(f"Built {build_checkpoints(db, previous_month(as_of[:7]))} monthly checkpoints.")
+    elif sys.argv[1] == "rebuild":
+        print(f"Rebuilt {rebuild_checkpoints(db, previous_month(as_of[:7]))} monthly checkpoints.")
+    else:
+        mismatched = verify_as_of(db, as_of)
+        if mismatched:
+            print(f"{len(mismatched)} balances as of {as_of} differ from the ledger: {mismatched}")
+            sys.exit(1)
+        print(f"Balances as of {as_of} match the ledger.")
@@ -0,0 +1,168 @@
+import http.client
+import json
+import os
+import sqlite3
+import time
+from urllib.parse import urlsplit
+import allocation
+
+# Client side of server.py. RemoteConnection stands in for the sqlite3
+# connection Database.connect() hands out when Database.server_url is set
+# (the GUI's client mode, python main.py --server URL), so dialogs, reports
+# and workers read unchanged against the server: every SELECT goes to
+# /query, and its rows come back a page at a time as the cursor is read.
+# Writes are not SQL here; allocation, checkpoints, importer and masterdata
+# send them to the server's named operations through call(). Like
+# Database's own connections, each one belongs to a single thread.
+#
+# The server's token is taken from the AIMS_TOKEN environment variable.
+
+# Kept below the server's keep-alive timeout so a request is never sent on a
+# socket the server may already have closed
+IDLE_RECONNECT = 60
+
+# Rows per /query reply
+PAGE_SIZE = 500
+
+# Error types the server names in its replies
+ERRORS = {error.__name__: error for error in (allocation.AllocationError, allocation.VoucherError, allocation.DisposalError,
+                                              ValueError, LookupError)}
+
+class RemoteCursor:
+    # Rows of one /query; while the server holds more (a cursor id) the next
+    # page is fetched once the buffered rows are used up.
+    def __init__(self, connection, reply):
+        self.connection = connection
+        self.rows = [tuple(row) for row in reply['rows']]
+        self.position = 0
+        self.cursor = reply.get('cursor')
+
+    def _buffered(self):
+        if self.position >= len(self.rows) and self.cursor is not None:
+            reply = self.connection.call("POST", f"/query/{self.cursor}", {'size': self.connection.page_size})
+            self.rows, self.position, self.cursor = [tuple(row) for row in reply['rows']], 0, reply.get('cursor')
+        return len(self.rows) - self.position
+
+    def fetchone(self):
+        if not self._buffered():
+            return None
+        self.position += 1
+        return self.rows[self.position - 1]
+
+    def fetchmany(self, size=1):
+        rows = []
+        while len(rows) < size and self._buffered():
+            taken = self.rows[self.position:self.position + size - len(rows)]
+            self.position += len(taken)
+            rows.extend(taken)
+        return rows
+
+    def fetchall(self):
+        rows = []
+        while self._buffered():
+            rows.extend(self.rows[self.position:])
+            self.position = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        while self._buffered():
+            self.position += 1
+            yield self.rows[self.position - 1]
+
+    def close(self):
+        # Lets the server drop the rest of the result straight away
+        self.rows, self.position = [], 0
+        if self.cursor is not None:
+            cursor, self.cursor = self.cursor, None
+            try:
+                self.connection.call("DELETE", f"/query/{cursor}")
+            except sqlite3.Error:
+                pass
+
+class RemoteConnection:
+    def __init__(self, url, token=None, timeout=60, page_size=PAGE_SIZE):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 8765
+        self.token = token if token is not None else os.environ.get("AIMS_TOKEN")
+        self.timeout = timeout
+        self.page_size = page_size
+        self.http = None
+        self.last_used = 0
+        self.closed = False
+
+    @property
+    def total_changes(self):
+        if self.closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return 0
+
+    def call(self, method, path, body=None):
+        # One request to the server, e.g. a named operation; returns its reply
+        if self.closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        if self.http is None or time.monotonic() - self.last_used > IDLE_RECONNECT:
+            if self.http is not None:
+                self.http.close()
+            self.http = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            self.http.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = self.http.getresponse()
+            reply = json.loads(response.read() or b"{}")
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            self.http.close()
+            self.http = None
+            raise sqlite3.OperationalError(f"AIMS server {self.host}:{self.port} unreachable: {e}")
+        self.last_used = time.monotonic()
+        if response.status >= 400:
+            raise self.error(response.status, reply)
+        return reply
+
+    @staticmethod
+    def error(status, reply):
+        # The exception the server raised, as far as it can be rebuilt here
+        message, name = reply.get('error', f"HTTP {status}"), reply.get('type', '')
+        if 'problems' in reply and name in ERRORS:
+            return ERRORS[name]([tuple(problem) for problem in reply['problems']])
+        if name in ERRORS:
+            return ERRORS[name](message)
+        error = getattr(sqlite3, name, None)
+        if isinstance(error, type) and issubclass(error, sqlite3.Error):
+            return error(message)
+        if status == 400:
+            return ValueError(message)
+        if status == 404:
+            return LookupError(message)
+        if status == 409:
+            return sqlite3.IntegrityError(message)
+        return sqlite3.OperationalError(message)
+
+    def execute(self, sql, params=()):
+        # The server runs only single read-only SELECTs
+        reply = self.call("POST", "/query", {'sql': sql, 'params': self._params(params), 'size': self.page_size})
+        return RemoteCursor(self, reply)
+
+    def executemany(self, sql, seq_of_params):
+        raise sqlite3.NotSupportedError("Writes go through the AIMS server's operations, not SQL.")
+
+    def data_version(self):
+        return self.call("GET", "/data-version")['data_version']
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        if self.http is not None:
+            self.http.close()
+        self.closed = True
+
+    @staticmethod
+    def _params(params):
+        return params if isinstance(params, dict) else list(params)
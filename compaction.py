@@ -0,0 +1,107 @@
+import json
+import sys
+import time
+from datetime import date
+from db import Database
+import queries
+
+# Merges the tiny derived batches that Issue/Return pile up. Batches are
+# equivalent when they were split off the same source batch on the same day
+# by the same kind of movement into the same branch, with the same item, year
+# and cost: merged, balances, valuation and as-of replays stay exactly the
+# same. The oldest batch of each group absorbs the others' quantities and
+# their transactions, disposals and derived batches are pointed at it; the
+# removed batches are recorded in compacted_batches. Groups are merged a few
+# hundred per transaction so the GUI can keep writing in between.
+#
+#   python compaction.py [database]
+
+EQUIVALENT_BATCHES = """
+    SELECT json_group_array(batch_id)
+    FROM (SELECT * FROM asset_batches WHERE source_batch_id IS NOT NULL ORDER BY batch_id)
+    GROUP BY item_id, branch_id, acquisition_year, acquisition_method, acquisition_date, source_batch_id, cost
+    HAVING COUNT(*) > 1
+"""
+
+# Balance queries timed before and after compacting
+TIMED_QUERIES = (("balances", queries.BALANCES), ("valuation", queries.VALUATION_BALANCES))
+
+def equivalent_groups(db):
+    # Batch ids of each group of equivalent batches, oldest first
+    return [sorted(json.loads(members)) for (members,) in db.fetch_all(EQUIVALENT_BATCHES)]
+
+def merge_groups(db, groups, compacted_on):
+    # Merges each group into its first batch in one transaction; members
+    # already gone (e.g. merged by another run) are skipped. Returns how many
+    # batches were removed.
+    with db.transaction():
+        db.execute_query("CREATE TEMP TABLE IF NOT EXISTS compaction_map (batch_id INTEGER PRIMARY KEY, merged_into INTEGER NOT NULL)")
+        db.execute_query("CREATE INDEX IF NOT EXISTS temp.idx_compaction_merged ON compaction_map (merged_into, batch_id)")
+        db.execute_query("DELETE FROM compaction_map")
+        db.execute_many("""INSERT INTO compaction_map (batch_id, merged_into)
+                           SELECT ?, ? WHERE EXISTS (SELECT 1 FROM asset_batches WHERE batch_id = ?)
+                                         AND EXISTS (SELECT 1 FROM asset_batches WHERE batch_id = ?)""",
+                        [(batch_id, group[0], batch_id, group[0]) for group in groups for batch_id in group[1:]])
+        db.execute_query("""
+            INSERT INTO compacted_batches (batch_id, merged_into, source_batch_id, quantity, source, authority_ref, remarks, compacted_on)
+            SELECT ab.batch_id, m.merged_into, ab.source_batch_id, ab.quantity, ab.source, ab.authority_ref, ab.remarks, ?
+            FROM compaction_map m CROSS JOIN asset_batches ab ON ab.batch_id = m.batch_id
+        """, (compacted_on,))
+        # Every statement is driven from the map so only the touched rows are
+        # visited, through the batch_id indexes of the ledger tables. Batches
+        # merged by earlier passes follow their survivor into this one.
+        db.execute_query("""
+            UPDATE asset_batches SET quantity = quantity + (
+                SELECT SUM(ab.quantity) FROM compaction_map m CROSS JOIN asset_batches ab ON ab.batch_id = m.batch_id
+                WHERE m.merged_into = asset_batches.batch_id)
+            WHERE batch_id IN (SELECT merged_into FROM compaction_map)
+        """)
+        for table, column in (("asset_transactions", "batch_id"), ("asset_disposal", "batch_id"), ("asset_batches", "source_batch_id"),
+                              ("compacted_batches", "merged_into")):
+            db.execute_query(f"""
+                UPDATE {table} SET {column} = (SELECT merged_into FROM compaction_map m WHERE m.batch_id = {table}.{column})
+                WHERE {column} IN (SELECT batch_id FROM compaction_map)
+            """)
+        removed = db.fetch_one("SELECT COUNT(*) FROM compaction_map")[0]
+        db.execute_query("DELETE FROM asset_batches WHERE batch_id IN (SELECT batch_id FROM compaction_map)")
+        db.execute_query("DELETE FROM compaction_map")
+    return removed
+
+def compact_batches(db, groups_per_transaction=200, progress=None):
+    # Returns (groups merged, batches removed). Merging a generation can make
+    # the batches derived from it equivalent, so passes repeat until none are.
+    compacted_on = date.today().isoformat()
+    merged = removed = 0
+    groups = equivalent_groups(db)
+    while groups:
+        for start in range(0, len(groups), groups_per_transaction):
+            removed += merge_groups(db, groups[start:start + groups_per_transaction], compacted_on)
+            if progress:
+                progress(merged + min(start + groups_per_transaction, len(groups)))
+        merged += len(groups)
+        groups = equivalent_groups(db)
+    return merged, removed
+
+def time_queries(db, repeat=3):
+    timings = {}
+    for name, query in TIMED_QUERIES:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            db.fetch_all(query)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    return timings
+
+if __name__ == "__main__":
+    db = Database(sys.argv[1]) if len(sys.argv) > 1 else Database()
+    batches = db.fetch_one("SELECT COUNT(*) FROM asset_batches")[0]
+    before = time_queries(db)
+    groups, removed = compact_batches(db, progress=lambda done: print(f"\rMerged {done} groups", end="", file=sys.stderr))
+    if groups:
+        print(file=sys.stderr)
+    after = time_queries(db)
+    print(f"Removed {removed} of {batches} batches in {groups} groups.")
+    for name, _ in TIMED_QUERIES:
+        print(f"{name}: {before[name] * 1000:.1f} ms -> {after[name] * 1000:.1f} ms ({before[name] / max(after[name], 1e-9):.1f}x)")
@@ -1,174 +1,543 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
-class Database:
-    def __init__(self, db_name='assets_inventory.db'):
-        self.db_name = db_name
-        self.connection = None
-        self.cursor = None
-        self.create_tables()
+def _create_base_schema(cursor):
+    # Categories table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_name TEXT NOT NULL UNIQUE,
+            remarks TEXT
+        )
+    ''')
 
-    def connect(self):
-        self.connection = sqlite3.connect(self.db_name)
-        self.cursor = self.connection.cursor()
+    # Sub-Categories table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sub_categories (
+            subcategory_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER NOT NULL,
+            subcategory_name TEXT NOT NULL,
+            remarks TEXT,
+            FOREIGN KEY (category_id) REFERENCES categories (category_id)
+        )
+    ''')
 
-    def disconnect(self):
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
+    # Branches table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS branches (
+            branch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            branch_name TEXT NOT NULL UNIQUE,
+            address TEXT,
+            remarks TEXT
+        )
+    ''')
 
-    def create_tables(self):
-        self.connect()
-        try:
-            # Categories table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS categories (
-                    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category_name TEXT NOT NULL UNIQUE,
-                    remarks TEXT
-                )
-            ''')
+    # Items table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_name TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            subcategory_id INTEGER NOT NULL,
+            specification TEXT,
+            govt_property_code TEXT UNIQUE,
+            remarks TEXT,
+            FOREIGN KEY (category_id) REFERENCES categories (category_id),
+            FOREIGN KEY (subcategory_id) REFERENCES sub_categories (subcategory_id)
+        )
+    ''')
 
-            # Sub-Categories table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sub_categories (
-                    subcategory_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category_id INTEGER NOT NULL,
-                    subcategory_name TEXT NOT NULL,
-                    remarks TEXT,
-                    FOREIGN KEY (category_id) REFERENCES categories (category_id)
-                )
-            ''')
+    # Asset Batches table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS asset_batches (
+            batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            branch_id INTEGER NOT NULL,
+            acquisition_date DATE NOT NULL,
+            acquisition_method TEXT NOT NULL,
+            source TEXT,
+            quantity INTEGER NOT NULL,
+            cost REAL,
+            authority_ref TEXT,
+            remarks TEXT,
+            acquisition_year TEXT,
+            FOREIGN KEY (item_id) REFERENCES items (item_id),
+            FOREIGN KEY (branch_id) REFERENCES branches (branch_id)
+        )
+    ''')
 
-            # Branches table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS branches (
-                    branch_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    branch_name TEXT NOT NULL UNIQUE,
-                    address TEXT,
-                    remarks TEXT
-                )
-            ''')
+    # Asset Transactions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS asset_transactions (
+            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id INTEGER NOT NULL,
+            transaction_type TEXT NOT NULL,
+            from_branch_id INTEGER,
+            to_branch_id INTEGER,
+            transaction_date DATE NOT NULL,
+            quantity INTEGER NOT NULL,
+            authority_ref TEXT,
+            remarks TEXT,
+            FOREIGN KEY (batch_id) REFERENCES asset_batches (batch_id),
+            FOREIGN KEY (from_branch_id) REFERENCES branches (branch_id),
+            FOREIGN KEY (to_branch_id) REFERENCES branches (branch_id)
+        )
+    ''')
 
-            # Items table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS items (
-                    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    item_name TEXT NOT NULL,
-                    category_id INTEGER NOT NULL,
-                    subcategory_id INTEGER NOT NULL,
-                    specification TEXT,
-                    govt_property_code TEXT UNIQUE,
-                    remarks TEXT,
-                    FOREIGN KEY (category_id) REFERENCES categories (category_id),
-                    FOREIGN KEY (subcategory_id) REFERENCES sub_categories (subcategory_id)
-                )
-            ''')
+    # Disposal table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS asset_disposal (
+            disposal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id INTEGER NOT NULL,
+            disposal_date DATE NOT NULL,
+            quantity INTEGER NOT NULL,
+            disposal_method TEXT NOT NULL,
+            authority_ref TEXT,
+            remarks TEXT,
+            FOREIGN KEY (batch_id) REFERENCES asset_batches (batch_id)
+        )
+    ''')
 
-            # Asset Batches table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS asset_batches (
-                    batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    item_id INTEGER NOT NULL,
-                    branch_id INTEGER NOT NULL,
-                    acquisition_date DATE NOT NULL,
-                    acquisition_method TEXT NOT NULL,
-                    source TEXT,
-                    quantity INTEGER NOT NULL,
-                    cost REAL,
-                    authority_ref TEXT,
-                    remarks TEXT,
-                    acquisition_year TEXT,
-                    FOREIGN KEY (item_id) REFERENCES items (item_id),
-                    FOREIGN KEY (branch_id) REFERENCES branches (branch_id)
-                )
-            ''')
+    # Users table (optional)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+    ''')
 
-            # Asset Transactions table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS asset_transactions (
-                    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    batch_id INTEGER NOT NULL,
-                    transaction_type TEXT NOT NULL,
-                    from_branch_id INTEGER,
-                    to_branch_id INTEGER,
-                    transaction_date DATE NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    authority_ref TEXT,
-                    remarks TEXT,
-                    FOREIGN KEY (batch_id) REFERENCES asset_batches (batch_id),
-                    FOREIGN KEY (from_branch_id) REFERENCES branches (branch_id),
-                    FOREIGN KEY (to_branch_id) REFERENCES branches (branch_id)
-                )
-            ''')
+def _drop_item_unit(cursor):
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(items)")]
+    if 'unit' in columns:
+        cursor.execute("ALTER TABLE items DROP COLUMN unit")
+
+def _create_ledger_indexes(cursor):
+    # Covering indexes for the per-batch balance aggregates
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_batch ON asset_transactions (batch_id, transaction_type, quantity)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_disposal_batch ON asset_disposal (batch_id, quantity)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batches_item_branch_year ON asset_batches (item_id, branch_id, acquisition_year, quantity)")
+    # Date ordering for the history reports
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON asset_transactions (transaction_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_disposal_date ON asset_disposal (disposal_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batches_date ON asset_batches (acquisition_date)")
 
-            # Disposal table
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS asset_disposal (
-                    disposal_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    batch_id INTEGER NOT NULL,
-                    disposal_date DATE NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    disposal_method TEXT NOT NULL,
-                    authority_ref TEXT,
-                    remarks TEXT,
-                    FOREIGN KEY (batch_id) REFERENCES asset_batches (batch_id)
-                )
+def _create_history_indexes(cursor):
+    # Filtered, date-ordered pages of the history reports
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_type_date ON asset_transactions (transaction_type, transaction_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_from_date ON asset_transactions (from_branch_id, transaction_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_to_date ON asset_transactions (to_branch_id, transaction_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batches_method_date ON asset_batches (acquisition_method, acquisition_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batches_branch_date ON asset_batches (branch_id, acquisition_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batches_item_date ON asset_batches (item_id, acquisition_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_disposal_method_date ON asset_disposal (disposal_method, disposal_date)")
+
+def _create_balance_checkpoints(cursor):
+    # Month-end item x branch x year balances for as-of queries (checkpoints.py).
+    # checkpoint_months lists the months built. A ledger write dated in or
+    # before a built month drops that month and every later one; they are
+    # rebuilt from the previous checkpoint by the next as-of query.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_checkpoints (
+            month TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            branch_id INTEGER NOT NULL,
+            acquisition_year TEXT,
+            balance INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkpoints_month ON balance_checkpoints (month, item_id, branch_id, acquisition_year, balance)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS checkpoint_months (month TEXT PRIMARY KEY)")
+    for name, table, column in (("batches", "asset_batches", "acquisition_date"),
+                                ("transactions", "asset_transactions", "transaction_date"),
+                                ("disposal", "asset_disposal", "disposal_date")):
+        for event, month in (("insert", f"substr(NEW.{column}, 1, 7)"),
+                             ("delete", f"substr(OLD.{column}, 1, 7)"),
+                             ("update", f"min(substr(OLD.{column}, 1, 7), substr(NEW.{column}, 1, 7))")):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{name}_{event}_checkpoints AFTER {event.upper()} ON {table}
+                BEGIN
+                    DELETE FROM checkpoint_months WHERE month >= {month};
+                    DELETE FROM balance_checkpoints WHERE month >= {month};
+                END
             ''')
 
-            # Users table (optional)
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    role TEXT NOT NULL
-                )
+def _add_batch_lineage(cursor):
+    # The batch each derived Issue/Return batch was split from, so valuation
+    # can follow a unit back to the acquisition that set its cost. Existing
+    # derived batches are paired with their transactions: both were written
+    # in the same order for the same item, branch, date, quantity and year.
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(asset_batches)")]
+    if 'source_batch_id' not in columns:
+        cursor.execute("ALTER TABLE asset_batches ADD COLUMN source_batch_id INTEGER REFERENCES asset_batches(batch_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batches_source ON asset_batches (source_batch_id, batch_id, cost)")
+    cursor.execute('''
+        WITH moves AS (
+            SELECT at.batch_id, at.transaction_type, at.to_branch_id, at.transaction_date, at.quantity, src.item_id, src.acquisition_year,
+                   ROW_NUMBER() OVER (PARTITION BY at.transaction_type, at.to_branch_id, at.transaction_date, at.quantity, src.item_id, src.acquisition_year
+                                      ORDER BY at.transaction_id) as n
+            FROM asset_transactions at JOIN asset_batches src ON at.batch_id = src.batch_id
+            WHERE at.transaction_type IN ('Issue', 'Return')
+        ), derived AS (
+            SELECT batch_id, acquisition_method, branch_id, acquisition_date, quantity, item_id, acquisition_year,
+                   ROW_NUMBER() OVER (PARTITION BY acquisition_method, branch_id, acquisition_date, quantity, item_id, acquisition_year
+                                      ORDER BY batch_id) as n
+            FROM asset_batches
+            WHERE acquisition_method IN ('Issue', 'Return') AND source_batch_id IS NULL
+        )
+        UPDATE asset_batches SET source_batch_id = moves.batch_id
+        FROM derived JOIN moves
+          ON moves.transaction_type = derived.acquisition_method AND moves.to_branch_id = derived.branch_id
+         AND moves.transaction_date = derived.acquisition_date AND moves.quantity = derived.quantity
+         AND moves.item_id = derived.item_id AND moves.acquisition_year IS derived.acquisition_year AND moves.n = derived.n
+        WHERE asset_batches.batch_id = derived.batch_id
+    ''')
+
+def _create_item_search(cursor):
+    # Full-text index over the item name, specification and property code for
+    # the type-ahead item pickers (queries.ITEM_SEARCH). It indexes the items
+    # table in place (external content) and the triggers keep it in step.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            item_name, specification, govt_property_code,
+            content='items', content_rowid='item_id', prefix='1 2 3 4'
+        )
+    ''')
+    cursor.execute("INSERT INTO items_fts (items_fts) VALUES ('rebuild')")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_items_insert_search AFTER INSERT ON items
+        BEGIN
+            INSERT INTO items_fts (rowid, item_name, specification, govt_property_code)
+            VALUES (NEW.item_id, NEW.item_name, NEW.specification, NEW.govt_property_code);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_items_delete_search AFTER DELETE ON items
+        BEGIN
+            INSERT INTO items_fts (items_fts, rowid, item_name, specification, govt_property_code)
+            VALUES ('delete', OLD.item_id, OLD.item_name, OLD.specification, OLD.govt_property_code);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_items_update_search AFTER UPDATE ON items
+        BEGIN
+            INSERT INTO items_fts (items_fts, rowid, item_name, specification, govt_property_code)
+            VALUES ('delete', OLD.item_id, OLD.item_name, OLD.specification, OLD.govt_property_code);
+            INSERT INTO items_fts (rowid, item_name, specification, govt_property_code)
+            VALUES (NEW.item_id, NEW.item_name, NEW.specification, NEW.govt_property_code);
+        END
+    ''')
+
+def _create_master_data_version(cursor):
+    # Counter bumped by every write to the small master tables, so the
+    # reference-data registry (refdata.py) can tell with one row read whether
+    # its copy is still current, whichever process or connection wrote.
+    cursor.execute("CREATE TABLE IF NOT EXISTS master_data_version (version INTEGER NOT NULL)")
+    if not cursor.execute("SELECT 1 FROM master_data_version").fetchone():
+        cursor.execute("INSERT INTO master_data_version (version) VALUES (0)")
+    for table in ("categories", "sub_categories", "branches"):
+        for event in ("insert", "update", "delete"):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event}_version AFTER {event.upper()} ON {table}
+                BEGIN
+                    UPDATE master_data_version SET version = version + 1;
+                END
             ''')
 
-            self.connection.commit()
-            # Migration: drop unit column if exists
+def _create_batch_compaction(cursor):
+    # Derived batches merged away by compaction.py: each row keeps the removed
+    # batch's own details and the batch its stock and ledger rows moved to.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compacted_batches (
+            batch_id INTEGER PRIMARY KEY,
+            merged_into INTEGER NOT NULL REFERENCES asset_batches(batch_id),
+            source_batch_id INTEGER,
+            quantity INTEGER NOT NULL,
+            source TEXT,
+            authority_ref TEXT,
+            remarks TEXT,
+            compacted_on DATE NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_compacted_merged ON compacted_batches (merged_into)")
+
+def _index_balances_by_branch(cursor):
+    # One branch's stock (the Store stock behind disposals) without walking
+    # every branch's balances
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_balances_branch_item_year ON batch_balances (branch_id, item_id, acquisition_year, balance)")
+
+# Per-batch balances recomputed from the ledger; used to seed batch_balances
+# and by balances.verify_batch_balances().
+BATCH_BALANCES_SQL = """
+    SELECT ab.batch_id, ab.item_id, ab.branch_id, ab.acquisition_year, ab.quantity,
+           COALESCE(it.issued, 0), COALESCE(ds.disposed, 0),
+           ab.quantity - COALESCE(it.issued, 0) - COALESCE(ds.disposed, 0)
+    FROM asset_batches ab
+    LEFT JOIN (SELECT batch_id, SUM(quantity) as issued FROM asset_transactions WHERE transaction_type IN ('Issue', 'Transfer', 'Return') GROUP BY batch_id) it ON ab.batch_id = it.batch_id
+    LEFT JOIN (SELECT batch_id, SUM(quantity) as disposed FROM asset_disposal GROUP BY batch_id) ds ON ab.batch_id = ds.batch_id
+"""
+
+def _create_batch_balances(cursor):
+    # Running balance per batch, kept current by the triggers below so that
+    # availability checks never re-aggregate the ledger.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_balances (
+            batch_id INTEGER PRIMARY KEY,
+            item_id INTEGER NOT NULL,
+            branch_id INTEGER NOT NULL,
+            acquisition_year TEXT,
+            quantity INTEGER NOT NULL,
+            issued INTEGER NOT NULL DEFAULT 0,
+            disposed INTEGER NOT NULL DEFAULT 0,
+            balance INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_balances_item_branch_year ON batch_balances (item_id, branch_id, acquisition_year, balance)")
+    cursor.execute("DELETE FROM batch_balances")
+    cursor.execute("INSERT INTO batch_balances (batch_id, item_id, branch_id, acquisition_year, quantity, issued, disposed, balance) " + BATCH_BALANCES_SQL)
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_batches_insert_balance AFTER INSERT ON asset_batches
+        BEGIN
+            INSERT INTO batch_balances (batch_id, item_id, branch_id, acquisition_year, quantity, issued, disposed, balance)
+            VALUES (NEW.batch_id, NEW.item_id, NEW.branch_id, NEW.acquisition_year, NEW.quantity, 0, 0, NEW.quantity);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_batches_update_balance AFTER UPDATE ON asset_batches
+        BEGIN
+            UPDATE batch_balances
+            SET batch_id = NEW.batch_id, item_id = NEW.item_id, branch_id = NEW.branch_id,
+                acquisition_year = NEW.acquisition_year, quantity = NEW.quantity,
+                balance = NEW.quantity - issued - disposed
+            WHERE batch_id = OLD.batch_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_batches_delete_balance AFTER DELETE ON asset_batches
+        BEGIN
+            DELETE FROM batch_balances WHERE batch_id = OLD.batch_id;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_insert_balance AFTER INSERT ON asset_transactions
+        WHEN NEW.transaction_type IN ('Issue', 'Transfer', 'Return')
+        BEGIN
+            UPDATE batch_balances SET issued = issued + NEW.quantity, balance = balance - NEW.quantity
+            WHERE batch_id = NEW.batch_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_delete_balance AFTER DELETE ON asset_transactions
+        WHEN OLD.transaction_type IN ('Issue', 'Transfer', 'Return')
+        BEGIN
+            UPDATE batch_balances SET issued = issued - OLD.quantity, balance = balance + OLD.quantity
+            WHERE batch_id = OLD.batch_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_update_balance AFTER UPDATE ON asset_transactions
+        BEGIN
+            UPDATE batch_balances SET issued = issued - OLD.quantity, balance = balance + OLD.quantity
+            WHERE batch_id = OLD.batch_id AND OLD.transaction_type IN ('Issue', 'Transfer', 'Return');
+            UPDATE batch_balances SET issued = issued + NEW.quantity, balance = balance - NEW.quantity
+            WHERE batch_id = NEW.batch_id AND NEW.transaction_type IN ('Issue', 'Transfer', 'Return');
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_disposal_insert_balance AFTER INSERT ON asset_disposal
+        BEGIN
+            UPDATE batch_balances SET disposed = disposed + NEW.quantity, balance = balance - NEW.quantity
+            WHERE batch_id = NEW.batch_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_disposal_delete_balance AFTER DELETE ON asset_disposal
+        BEGIN
+            UPDATE batch_balances SET disposed = disposed - OLD.quantity, balance = balance + OLD.quantity
+            WHERE batch_id = OLD.batch_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_disposal_update_balance AFTER UPDATE ON asset_disposal
+        BEGIN
+            UPDATE batch_balances SET disposed = disposed - OLD.quantity, balance = balance + OLD.quantity
+            WHERE batch_id = OLD.batch_id;
+            UPDATE batch_balances SET disposed = disposed + NEW.quantity, balance = balance - NEW.quantity
+            WHERE batch_id = NEW.batch_id;
+        END
+    ''')
+
+# Schema migrations, applied in order; PRAGMA user_version holds how many
+# have been applied to a database file. Append new steps, never reorder.
+MIGRATIONS = [
+    _create_base_schema,
+    _drop_item_unit,
+    _create_ledger_indexes,
+    _create_batch_balances,
+    _create_history_indexes,
+    _create_balance_checkpoints,
+    _add_batch_lineage,
+    _create_item_search,
+    _create_master_data_version,
+    _create_batch_compaction,
+    _index_balances_by_branch,
+]
+
+class Database:
+    # One connection per (thread, database file), shared by every Database
+    # instance so dialogs can keep creating Database() cheaply.
+    _local = threading.local()
+    _lock = threading.Lock()
+    _open_connections = []
+    _write_counts = {}
+    # Set for the GUI's client mode: connections then talk to server.py there
+    # instead of opening the file (see client.py). They only read; writes go
+    # through the server's named operations (remote()).
+    server_url = None
+
+    def __init__(self, db_name='assets_inventory.db'):
+        self.db_name = db_name
+
+    @property
+    def connection(self):
+        return self.connect()
+
+    def connect(self):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(self.db_name)
+        if connection is not None:
             try:
-                self.cursor.execute("ALTER TABLE items DROP COLUMN unit")
-                self.connection.commit()
-            except sqlite3.OperationalError:
-                pass  # column already dropped or not supported
-        except Exception as e:
-            print(f"Error creating tables: {e}")
-        finally:
-            self.disconnect()
+                connection.total_changes
+            except sqlite3.ProgrammingError:
+                connection = None  # closed by close()/close_all() from another thread
+        if connection is None:
+            if Database.server_url:
+                import client
+                connection = client.RemoteConnection(Database.server_url)
+            else:
+                connection = sqlite3.connect(self.db_name, timeout=10, check_same_thread=False)
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.execute("PRAGMA synchronous = NORMAL")
+                connection.execute("PRAGMA cache_size = -16000")  # 16 MB page cache
+                connection.execute("PRAGMA temp_store = MEMORY")
+                self.migrate(connection)
+            connections[self.db_name] = connection
+            with self._lock:
+                self._open_connections.append((self.db_name, connection))
+        return connection
 
-    def execute_query(self, query, params=()):
-        self.connect()
+    def disconnect(self):
+        # Connections are long-lived; only the thread's own connection is dropped.
+        connections = getattr(self._local, 'connections', None)
+        if connections and self.db_name in connections:
+            connection = connections.pop(self.db_name)
+            with self._lock:
+                self._open_connections[:] = [(name, conn) for name, conn in self._open_connections if conn is not connection]
+            connection.close()
+
+    def close(self):
+        # Close every connection opened on this database file, from any thread.
+        with self._lock:
+            closing = [conn for name, conn in self._open_connections if name == self.db_name]
+            self._open_connections[:] = [(name, conn) for name, conn in self._open_connections if name != self.db_name]
+        for connection in closing:
+            connection.close()
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            closing = [conn for name, conn in cls._open_connections]
+            cls._open_connections.clear()
+        for connection in closing:
+            connection.close()
+
+    def migrate(self, connection):
+        # Cheap when the file is current: a single PRAGMA read per new connection.
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
+        connection.execute("BEGIN IMMEDIATE")
         try:
-            self.cursor.execute(query, params)
-            self.connection.commit()
-            return self.cursor.lastrowid
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            cursor = connection.cursor()
+            for number in range(version, len(MIGRATIONS)):
+                MIGRATIONS[number](cursor)
+            connection.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+            connection.commit()
         except Exception as e:
-            print(f"Error executing query: {e}")
-            return None
-        finally:
-            self.disconnect()
+            connection.rollback()
+            print(f"Error migrating database: {e}")
+            raise
 
-    def fetch_all(self, query, params=()):
-        self.connect()
+    def remote(self):
+        # The server connection in client mode, whose call() runs a named
+        # operation there; None when working on the file itself
+        return self.connect() if Database.server_url else None
+
+    def _count_write(self):
+        with self._lock:
+            self._write_counts[self.db_name] = self._write_counts.get(self.db_name, 0) + 1
+
+    def data_version(self):
+        # Cheap token that changes whenever the data may have changed: the
+        # write counter moves on every commit made through Database in this
+        # process, PRAGMA data_version on commits from other processes. The
+        # pragma is per connection, so tokens are only comparable on the
+        # thread that took them. In client mode the server keeps the token.
+        remote = self.remote()
+        if remote is not None:
+            return remote.data_version()
+        data_version = self.connect().execute("PRAGMA data_version").fetchone()[0]
+        return (self._write_counts.get(self.db_name, 0), threading.get_ident(), data_version)
+
+    def in_transaction(self):
+        return getattr(self._local, 'depths', {}).get(self.db_name, 0) > 0
+
+    @contextmanager
+    def transaction(self):
+        # Unit of work: everything executed on this thread's connection inside
+        # the block commits once at the end, or rolls back if anything raises.
+        # Nested blocks join the outermost transaction.
+        connection = self.connect()
+        depths = getattr(self._local, 'depths', None)
+        if depths is None:
+            depths = self._local.depths = {}
+        depth = depths.get(self.db_name, 0)
+        if depth == 0:
+            connection.execute("BEGIN IMMEDIATE")
+        depths[self.db_name] = depth + 1
         try:
-            self.cursor.execute(query, params)
-            return self.cursor.fetchall()
-        except Exception as e:
-            print(f"Error fetching data: {e}")
-            return []
-        finally:
-            self.disconnect()
+            yield self
+        except BaseException:
+            depths[self.db_name] = depth
+            if depth == 0:
+                connection.rollback()
+            raise
+        depths[self.db_name] = depth
+        if depth == 0:
+            connection.commit()
+            self._count_write()
+
+    def execute_query(self, query, params=()):
+        # Single write; returns lastrowid and raises on error. Commits unless
+        # inside transaction().
+        with self.transaction():
+            return self.connect().execute(query, params).lastrowid
+
+    def execute_many(self, query, seq_of_params):
+        # Bulk write; raises on error. Commits unless inside transaction().
+        with self.transaction():
+            return self.connect().executemany(query, seq_of_params).rowcount
+
+    def fetch_all(self, query, params=()):
+        return self.connect().execute(query, params).fetchall()
 
     def fetch_one(self, query, params=()):
-        self.connect()
-        try:
-            self.cursor.execute(query, params)
-            return self.cursor.fetchone()
-        except Exception as e:
-            print(f"Error fetching data: {e}")
-            return None
-        finally:
-            self.disconnect()
\ No newline at end of file
+        return self.connect().execute(query, params).fetchone()
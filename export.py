@@ -0,0 +1,65 @@
+import csv
+import gzip
+import json
+import os
+
+# Streams query results to CSV, gzip-compressed CSV or JSON Lines straight
+# from the SQLite cursor, one chunk at a time, so memory use does not grow
+# with the number of rows exported.
+
+class ExportCancelled(Exception):
+    pass
+
+def export_format(filename):
+    lowered = filename.lower()
+    if lowered.endswith('.gz'):
+        return 'csv.gz'
+    if lowered.endswith('.jsonl'):
+        return 'jsonl'
+    return 'csv'
+
+def open_output(filename, fmt):
+    if fmt == 'csv.gz':
+        return gzip.open(filename, 'wt', newline='', encoding='utf-8')
+    return open(filename, 'w', newline='', encoding='utf-8')
+
+def stream_query(db, query, params=(), chunk_size=1000):
+    cursor = db.connect().execute(query, params)
+    try:
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        cursor.close()
+
+def write_chunks(out, headers, chunks, fmt='csv', progress=None, is_cancelled=None):
+    # Returns the number of rows written. progress(rows_so_far) is called after
+    # every chunk; is_cancelled() is checked before each one. Columns past the
+    # headers (keys some report queries carry) are left out.
+    count = 0
+    width = len(headers)
+    if fmt == 'jsonl':
+        write_chunk = lambda chunk: out.writelines(json.dumps(dict(zip(headers, row)), default=str) + "\n" for row in chunk)
+    else:
+        writer = csv.writer(out)
+        writer.writerow(headers)
+        write_chunk = lambda chunk: writer.writerows(["" if value is None else value for value in row[:width]] for row in chunk)
+    for chunk in chunks:
+        if is_cancelled and is_cancelled():
+            raise ExportCancelled()
+        write_chunk(chunk)
+        count += len(chunk)
+        if progress:
+            progress(count)
+    return count
+
+def export_query(db, query, headers, filename, params=(), fmt=None, chunk_size=1000, progress=None, is_cancelled=None):
+    fmt = fmt or export_format(filename)
+    try:
+        with open_output(filename, fmt) as out:
+            return write_chunks(out, headers, stream_query(db, query, params, chunk_size), fmt, progress, is_cancelled)
+    except ExportCancelled:
+        os.remove(filename)
+        raise
@@ -1,15 +1,27 @@
+import json
 import sys
-from PySide6.QtWidgets import QApplication, QMainWindow, QStatusBar, QWidget, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem, QHBoxLayout, QPushButton
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QMainWindow, QMessageBox, QStatusBar, QWidget, QVBoxLayout, QLabel, QTableView, QHBoxLayout, QPushButton, QCheckBox, QDateEdit
+from PySide6.QtCore import Qt, QDate
 from db import Database
+import masterdata
+import queries
+import refdata
+from gui_table_model import QueryTableModel
+from gui_workers import start_export, start_import, start_master_data_import, fetch_as_of_params, fetch_in_background
+from report_cache import report_cache
 
 class MainWindow(QMainWindow):
+    PATCH_LIMIT = 200
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Assets and Inventory Management System (AIMS)")
         self.setGeometry(100, 100, 800, 500)
 
         self.db = Database()
+        self.as_of_worker = None
+        self.patch_worker = None
+        self.patch_keys = set()
         self.ensure_store_branch()
         self.create_menu()
         self.create_status_bar()
@@ -24,20 +36,26 @@ class MainWindow(QMainWindow):
         master_menu.addAction("Sub-Categories", self.open_subcategories)
         master_menu.addAction("Branches", self.open_branches)
         master_menu.addAction("Items", self.open_items)
+        master_menu.addAction("Import Master Data...", self.import_master_data)
 
         # Transactions Menu
         trans_menu = menubar.addMenu("Transactions")
         trans_menu.addAction("Acquisition", self.open_acquisition)
+        trans_menu.addAction("Import Acquisitions...", self.import_acquisitions)
         trans_menu.addAction("Issue/Return", self.open_issue_transfer)
+        trans_menu.addAction("Bulk Issue Voucher", self.open_issue_voucher)
         trans_menu.addAction("Disposal", self.open_disposal)
 
         # Reports Menu
         reports_menu = menubar.addMenu("Reports")
         reports_menu.addAction("Summary", self.open_stock_register)
         reports_menu.addAction("Branch-wise Balance", self.open_branch_balance)
+        reports_menu.addAction("Inventory Valuation", self.open_valuation)
+        reports_menu.addAction("Valuation by Category", self.open_category_valuation)
         reports_menu.addAction("Disposal Report", self.open_disposal_report)
         reports_menu.addAction("Acquisition History", self.open_acquisition_history)
         reports_menu.addAction("Transaction History", self.open_transaction_history)
+        reports_menu.addAction("Pivot", self.open_pivot)
 
         # Help Menu
         help_menu = menubar.addMenu("Help")
@@ -49,56 +67,81 @@ class MainWindow(QMainWindow):
         self.status_bar.showMessage("Ready")
 
     def ensure_store_branch(self):
-        store = self.db.fetch_one("SELECT branch_id FROM branches WHERE branch_name = 'Store'")
-        if not store:
-            self.db.execute_query("INSERT INTO branches (branch_name, address, remarks) VALUES ('Store', 'Central Store', 'Default central branch for acquisitions and disposals')")
+        if refdata.get(self.db).store_id is None:
+            masterdata.create(self.db, 'branches', {'branch_name': refdata.STORE, 'address': 'Central Store',
+                                                     'remarks': 'Default central branch for acquisitions and disposals'})
+
+    def as_of(self):
+        return self.as_of_edit.date().toString("yyyy-MM-dd") if self.as_of_check.isChecked() else None
 
     def load_stock_register(self):
-        db = Database()
-        data = db.fetch_all("""
-            SELECT c.category_name, sc.subcategory_name, i.item_name, b.branch_name, batch_bal.acquisition_year, SUM(batch_bal.balance) as total_balance
-            FROM (
-                SELECT ab.batch_id, ab.item_id, ab.branch_id, ab.acquisition_year,
-                       ab.quantity - COALESCE(issued, 0) - COALESCE(disposed, 0) as balance
-                FROM asset_batches ab
-                LEFT JOIN (SELECT batch_id, SUM(quantity) as issued FROM asset_transactions WHERE transaction_type IN ('Issue', 'Transfer', 'Return') GROUP BY batch_id) it ON ab.batch_id = it.batch_id
-                LEFT JOIN (SELECT batch_id, SUM(quantity) as disposed FROM asset_disposal GROUP BY batch_id) ds ON ab.batch_id = ds.batch_id
-            ) batch_bal
-            JOIN items i ON batch_bal.item_id = i.item_id
-            JOIN categories c ON i.category_id = c.category_id
-            JOIN sub_categories sc ON i.subcategory_id = sc.subcategory_id
-            JOIN branches b ON batch_bal.branch_id = b.branch_id
-            GROUP BY c.category_name, sc.subcategory_name, i.item_name, b.branch_name, batch_bal.acquisition_year
-            HAVING total_balance > 0
-            ORDER BY c.category_name, sc.subcategory_name, i.item_name, b.branch_name, batch_bal.acquisition_year
-        """)
-        self.stock_table.setRowCount(len(data))
-        self.stock_table.setColumnCount(6)
-        self.stock_table.setHorizontalHeaderLabels(["Category", "Sub-Category", "Item", "Branch", "Acquisition Year", "Balance"])
-        for row, (cat, sub, it, br, ay, bal) in enumerate(data):
-            self.stock_table.setItem(row, 0, QTableWidgetItem(cat))
-            self.stock_table.setItem(row, 1, QTableWidgetItem(sub))
-            self.stock_table.setItem(row, 2, QTableWidgetItem(it))
-            self.stock_table.setItem(row, 3, QTableWidgetItem(br))
-            self.stock_table.setItem(row, 4, QTableWidgetItem(ay or ""))
-            self.stock_table.setItem(row, 5, QTableWidgetItem(str(bal)))
+        as_of = self.as_of()
+        self.as_of_worker = None
+        self.cancel_patch()
+        if as_of is None:
+            self.stock_model.set_query(self.db, queries.DASHBOARD, (), queries.DASHBOARD_KEYS)
+            return
+        # Balances on a past date come from the nearest monthly checkpoint
+        self.stock_model.cancel()
+        self.status_bar.showMessage("Loading...")
+        worker = fetch_as_of_params(self.db, as_of, lambda params: self.show_as_of(worker, params),
+                                    lambda message: self.status_bar.showMessage(f"Failed to load stock register: {message}"))
+        self.as_of_worker = worker
+
+    def show_as_of(self, worker, params):
+        if worker is self.as_of_worker:
+            self.as_of_worker = None
+            self.stock_model.set_query(self.db, queries.DASHBOARD_AS_OF, params, queries.DASHBOARD_KEYS)
+
+    def apply_stock_change(self, change):
+        # Re-query only the dashboard rows a transaction touched, in one query
+        # off the GUI thread; a change arriving while one is being fetched is
+        # folded into it. While a page is loading a patch could clash with it,
+        # so fall back to a full reload then, as for an as-of view, which a
+        # back-dated write may have changed anywhere, and for a bulk voucher
+        # touching more rows than a reload would cost.
+        keys = self.patch_keys | change.keys if self.patch_worker is not None else set(change.keys)
+        self.cancel_patch()
+        if self.stock_model.is_loading() or self.as_of() is not None or len(keys) > self.PATCH_LIMIT:
+            self.load_stock_register()
+            return
+        query, params = queries.keyset_page(queries.DASHBOARD_ROWS, {'keys': json.dumps([list(key) for key in keys])},
+                                            queries.DASHBOARD_KEYS)
+        worker = fetch_in_background(self.db, query, params, lambda rows: self.patch_stock(worker, rows),
+                                     lambda message: worker is self.patch_worker and self.load_stock_register())
+        self.patch_worker, self.patch_keys = worker, keys
+
+    def patch_stock(self, worker, rows):
+        if worker is not self.patch_worker:
+            return
+        keys = self.patch_keys
+        self.cancel_patch()
+        if self.stock_model.is_loading():
+            self.load_stock_register()
+            return
+        self.stock_model.patch_rows(lambda row: (row[6], row[7], row[4]), keys, rows)
+
+    def cancel_patch(self):
+        if self.patch_worker is not None:
+            self.patch_worker.cancel()
+        self.patch_worker, self.patch_keys = None, set()
+
+    def closeEvent(self, event):
+        self.stock_model.cancel()
+        self.cancel_patch()
+        super().closeEvent(event)
 
     def export_stock_csv(self):
-        import csv
-        from PySide6.QtWidgets import QFileDialog, QMessageBox
-        filename, _ = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv)")
-        if filename:
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                headers = ["Category", "Sub-Category", "Item", "Branch", "Acquisition Year", "Balance"]
-                writer.writerow(headers)
-                for row in range(self.stock_table.rowCount()):
-                    row_data = []
-                    for col in range(self.stock_table.columnCount()):
-                        item = self.stock_table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    writer.writerow(row_data)
-            QMessageBox.information(self, "Export", "Stock data exported to CSV successfully.")
+        as_of = self.as_of()
+        if as_of is None:
+            self.export_worker = start_export(self, self.db, queries.STOCK_REGISTER, self.stock_model.headers)
+            return
+        # Any missing checkpoints are built off the GUI thread before the file is asked for
+        self.export_worker = fetch_as_of_params(self.db, as_of, self.export_stock_as_of,
+                                                lambda message: QMessageBox.critical(self, "Export", f"Export failed: {message}"))
+
+    def export_stock_as_of(self, params):
+        self.export_worker = start_export(self, self.db, queries.STOCK_REGISTER_AS_OF, self.stock_model.headers, params)
 
     def set_central_widget(self):
         central_widget = QWidget()
@@ -110,14 +153,26 @@ class MainWindow(QMainWindow):
         label.setStyleSheet("font-weight: bold; font-size: 14px;")
         header_layout.addWidget(label)
 
-        export_btn = QPushButton("Export to CSV")
+        self.as_of_check = QCheckBox("As of")
+        self.as_of_check.toggled.connect(self.load_stock_register)
+        header_layout.addWidget(self.as_of_check)
+        self.as_of_edit = QDateEdit(QDate.currentDate())
+        self.as_of_edit.setCalendarPopup(True)
+        self.as_of_edit.dateChanged.connect(lambda: self.as_of_check.isChecked() and self.load_stock_register())
+        header_layout.addWidget(self.as_of_edit)
+
+        export_btn = QPushButton("Export...")
         export_btn.clicked.connect(self.export_stock_csv)
         header_layout.addWidget(export_btn)
 
         layout.addLayout(header_layout)
 
-        self.stock_table = QTableWidget()
-        self.stock_table.setStyleSheet("QTableWidget { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
+        self.stock_model = QueryTableModel(queries.REPORTS['dashboard']['headers'], self, cache=report_cache)
+        self.stock_table = QTableView()
+        self.stock_table.setModel(self.stock_model)
+        self.stock_model.loading_changed.connect(lambda loading: self.status_bar.showMessage("Loading..." if loading else "Ready"))
+        self.stock_model.failed.connect(lambda message: self.status_bar.showMessage(f"Failed to load stock register: {message}"))
+        self.stock_table.setStyleSheet("QTableView { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
         layout.addWidget(self.stock_table)
 
         central_widget.setLayout(layout)
@@ -147,20 +202,32 @@ class MainWindow(QMainWindow):
     def open_acquisition(self):
         from gui_acquisition import AcquisitionDialog
         dialog = AcquisitionDialog(self)
+        dialog.stock_changed.connect(self.apply_stock_change)
         dialog.exec()
-        self.load_stock_register()
+
+    def import_master_data(self):
+        self.import_worker = start_master_data_import(self, self.db, self.load_stock_register)
+
+    def import_acquisitions(self):
+        self.import_worker = start_import(self, self.db, self.load_stock_register)
 
     def open_issue_transfer(self):
         from gui_issue_transfer import IssueTransferDialog
         dialog = IssueTransferDialog(self)
+        dialog.stock_changed.connect(self.apply_stock_change)
+        dialog.exec()
+
+    def open_issue_voucher(self):
+        from gui_issue_voucher import IssueVoucherDialog
+        dialog = IssueVoucherDialog(self)
+        dialog.stock_changed.connect(self.apply_stock_change)
         dialog.exec()
-        self.load_stock_register()
 
     def open_disposal(self):
         from gui_disposal import DisposalDialog
         dialog = DisposalDialog(self)
+        dialog.stock_changed.connect(self.apply_stock_change)
         dialog.exec()
-        self.load_stock_register()
 
     def open_stock_register(self):
         from gui_reports import StockRegisterDialog
@@ -172,6 +239,16 @@ class MainWindow(QMainWindow):
         dialog = BranchBalanceDialog(self)
         dialog.exec()
 
+    def open_valuation(self):
+        from gui_reports import ValuationDialog
+        dialog = ValuationDialog(self)
+        dialog.exec()
+
+    def open_category_valuation(self):
+        from gui_reports import CategoryValuationDialog
+        dialog = CategoryValuationDialog(self)
+        dialog.exec()
+
     def open_disposal_report(self):
         from gui_reports import DisposalReportDialog
         dialog = DisposalReportDialog(self)
@@ -187,6 +264,11 @@ class MainWindow(QMainWindow):
         dialog = TransactionHistoryDialog(self)
         dialog.exec()
 
+    def open_pivot(self):
+        from gui_pivot import PivotDialog
+        dialog = PivotDialog(self)
+        dialog.exec()
+
     def show_about(self):
         from PySide6.QtWidgets import QMessageBox
         about_text = """
@@ -207,7 +289,5 @@ class MainWindow(QMainWindow):
         QMessageBox.about(self, "Help", about_text)
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    from main import main
+    sys.exit(main())
\ No newline at end of file
@@ -1,9 +1,15 @@
+import sqlite3
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QFormLayout, QLineEdit, QComboBox, QDateEdit, QSpinBox, QDoubleSpinBox, QDialogButtonBox, QMessageBox
-from PySide6.QtCore import QDate
+from PySide6.QtCore import QDate, Signal
 from db import Database
-from models import AssetBatch
+import importer
+import refdata
+from models import AssetBatch, StockChange
+from gui_item_search import ItemSearchEdit
 
 class AcquisitionDialog(QDialog):
+    stock_changed = Signal(object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Asset Acquisition")
@@ -16,16 +22,13 @@ class AcquisitionDialog(QDialog):
 
         form_layout = QFormLayout()
 
-        self.item_combo = QComboBox()
-        items = self.db.fetch_all("SELECT item_id, item_name FROM items")
-        for it in items:
-            self.item_combo.addItem(it[1], it[0])
-        form_layout.addRow("Item*:", self.item_combo)
+        self.item_edit = ItemSearchEdit(self, self.db)
+        form_layout.addRow("Item*:", self.item_edit)
 
         self.branch_combo = QComboBox()
-        branches = self.db.fetch_all("SELECT branch_id, branch_name FROM branches WHERE branch_name = 'Store'")
-        for br in branches:
-            self.branch_combo.addItem(br[1], br[0])
+        refs = refdata.get(self.db)
+        if refs.store_id is not None:
+            self.branch_combo.addItem(refdata.STORE, refs.store_id)
         self.branch_combo.setEnabled(False)  # Disable selection, force Store
         form_layout.addRow("Branch*:", self.branch_combo)
 
@@ -67,7 +70,7 @@ class AcquisitionDialog(QDialog):
 
     def save(self):
         batch = AssetBatch(
-            item_id=self.item_combo.currentData(),
+            item_id=self.item_edit.item_id(),
             branch_id=self.branch_combo.currentData(),
             acquisition_date=self.date_edit.date().toString("yyyy-MM-dd"),
             acquisition_method=self.method_edit.text(),
@@ -81,9 +84,13 @@ class AcquisitionDialog(QDialog):
         if not batch.item_id or not batch.branch_id or not batch.acquisition_method or not batch.acquisition_year:
             QMessageBox.warning(self, "Warning", "Please fill required fields.")
             return
-        query = """INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, source, quantity, cost, authority_ref, remarks, acquisition_year)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
-        self.db.execute_query(query, (batch.item_id, batch.branch_id, batch.acquisition_date, batch.acquisition_method,
-                                      batch.source, batch.quantity, batch.cost, batch.authority_ref, batch.remarks, batch.acquisition_year))
+        try:
+            importer.add_acquisitions(self.db, [(batch.item_id, batch.branch_id, batch.acquisition_date, batch.acquisition_method,
+                                                 batch.source, batch.quantity, batch.cost, batch.authority_ref, batch.remarks,
+                                                 batch.acquisition_year)])
+        except (sqlite3.Error, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Asset batch could not be saved: {e}")
+            return
+        self.stock_changed.emit(StockChange({(batch.item_id, batch.branch_id, batch.acquisition_year)}))
         QMessageBox.information(self, "Success", "Asset batch added successfully.")
         self.accept()
\ No newline at end of file
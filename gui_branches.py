@@ -1,6 +1,9 @@
+import sqlite3
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton, QLineEdit, QLabel, QMessageBox, QInputDialog, QComboBox, QFormLayout, QDialogButtonBox
 from PySide6.QtCore import Qt
 from db import Database
+import masterdata
+import refdata
 from models import Branch
 
 class BranchesDialog(QDialog):
@@ -40,16 +43,18 @@ class BranchesDialog(QDialog):
 
     def load_branches(self):
         self.list_widget.clear()
-        branches = self.db.fetch_all("SELECT branch_id, branch_name FROM branches")
-        for br in branches:
+        for br in refdata.get(self.db).branches:
             self.list_widget.addItem(f"{br[0]}: {br[1]}")
 
     def add_branch(self):
         dialog = BranchEditDialog(self)
         if dialog.exec() == QDialog.Accepted:
             br = dialog.get_branch()
-            query = "INSERT INTO branches (branch_name, address, remarks) VALUES (?, ?, ?)"
-            self.db.execute_query(query, (br.branch_name, br.address, br.remarks))
+            try:
+                masterdata.create(self.db, 'branches', {'branch_name': br.branch_name, 'address': br.address, 'remarks': br.remarks})
+            except (sqlite3.Error, ValueError) as e:
+                QMessageBox.critical(self, "Error", f"Branch could not be saved: {e}")
+                return
             self.load_branches()
 
     def edit_branch(self):
@@ -63,8 +68,11 @@ class BranchesDialog(QDialog):
             dialog = BranchEditDialog(self, br_data)
             if dialog.exec() == QDialog.Accepted:
                 br = dialog.get_branch()
-                query = "UPDATE branches SET branch_name = ?, address = ?, remarks = ? WHERE branch_id = ?"
-                self.db.execute_query(query, (br.branch_name, br.address, br.remarks, br_id))
+                try:
+                    masterdata.update(self.db, 'branches', br_id, {'branch_name': br.branch_name, 'address': br.address, 'remarks': br.remarks})
+                except (sqlite3.Error, LookupError, ValueError) as e:
+                    QMessageBox.critical(self, "Error", f"Branch could not be saved: {e}")
+                    return
                 self.load_branches()
 
     def delete_branch(self):
@@ -73,8 +81,7 @@ class BranchesDialog(QDialog):
             QMessageBox.warning(self, "Warning", "Please select a branch to delete.")
             return
         br_id = int(current_item.text().split(":")[0])
-        br_name = self.db.fetch_one("SELECT branch_name FROM branches WHERE branch_id = ?", (br_id,))[0]
-        if br_name == "Store":
+        if br_id == refdata.get(self.db).store_id:
             QMessageBox.warning(self, "Warning", "Cannot delete the Store branch.")
             return
         reply = QMessageBox.question(self, "Delete", "Are you sure you want to delete this branch?", QMessageBox.Yes | QMessageBox.No)
@@ -85,7 +92,11 @@ class BranchesDialog(QDialog):
             if count_batches > 0 or count_trans > 0:
                 QMessageBox.warning(self, "Warning", "Cannot delete branch that has associated assets or transactions.")
                 return
-            self.db.execute_query("DELETE FROM branches WHERE branch_id = ?", (br_id,))
+            try:
+                masterdata.delete(self.db, 'branches', br_id)
+            except (sqlite3.Error, LookupError) as e:
+                QMessageBox.critical(self, "Error", f"Branch could not be deleted: {e}")
+                return
             self.load_branches()
 
 class BranchEditDialog(QDialog):
@@ -1,6 +1,9 @@
+import sqlite3
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton, QLineEdit, QLabel, QMessageBox, QInputDialog, QFormLayout, QDialogButtonBox
 from PySide6.QtCore import Qt
 from db import Database
+import masterdata
+import refdata
 from models import Category
 
 class CategoriesDialog(QDialog):
@@ -40,16 +43,18 @@ class CategoriesDialog(QDialog):
 
     def load_categories(self):
         self.list_widget.clear()
-        categories = self.db.fetch_all("SELECT category_id, category_name FROM categories")
-        for cat in categories:
+        for cat in refdata.get(self.db).categories:
             self.list_widget.addItem(f"{cat[0]}: {cat[1]}")
 
     def add_category(self):
         dialog = CategoryEditDialog(self)
         if dialog.exec() == QDialog.Accepted:
             cat = dialog.get_category()
-            query = "INSERT INTO categories (category_name, remarks) VALUES (?, ?)"
-            self.db.execute_query(query, (cat.category_name, cat.remarks))
+            try:
+                masterdata.create(self.db, 'categories', {'category_name': cat.category_name, 'remarks': cat.remarks})
+            except (sqlite3.Error, ValueError) as e:
+                QMessageBox.critical(self, "Error", f"Category could not be saved: {e}")
+                return
             self.load_categories()
 
     def edit_category(self):
@@ -63,8 +68,11 @@ class CategoriesDialog(QDialog):
             dialog = CategoryEditDialog(self, cat_data)
             if dialog.exec() == QDialog.Accepted:
                 cat = dialog.get_category()
-                query = "UPDATE categories SET category_name = ?, remarks = ? WHERE category_id = ?"
-                self.db.execute_query(query, (cat.category_name, cat.remarks, cat_id))
+                try:
+                    masterdata.update(self.db, 'categories', cat_id, {'category_name': cat.category_name, 'remarks': cat.remarks})
+                except (sqlite3.Error, LookupError, ValueError) as e:
+                    QMessageBox.critical(self, "Error", f"Category could not be saved: {e}")
+                    return
                 self.load_categories()
 
     def delete_category(self):
@@ -76,11 +84,14 @@ class CategoriesDialog(QDialog):
         reply = QMessageBox.question(self, "Delete", "Are you sure you want to delete this category?", QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
             # Check if used in subcategories
-            count = self.db.fetch_one("SELECT COUNT(*) FROM sub_categories WHERE category_id = ?", (cat_id,))[0]
-            if count > 0:
+            if refdata.get(self.db).subcategories(cat_id):
                 QMessageBox.warning(self, "Warning", "Cannot delete category that has subcategories.")
                 return
-            self.db.execute_query("DELETE FROM categories WHERE category_id = ?", (cat_id,))
+            try:
+                masterdata.delete(self.db, 'categories', cat_id)
+            except (sqlite3.Error, LookupError) as e:
+                QMessageBox.critical(self, "Error", f"Category could not be deleted: {e}")
+                return
             self.load_categories()
 
 class CategoryEditDialog(QDialog):
@@ -1,14 +1,22 @@
+import sqlite3
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QFormLayout, QLineEdit, QComboBox, QDateEdit, QSpinBox, QDialogButtonBox, QMessageBox, QTableWidget, QTableWidgetItem, QHBoxLayout, QPushButton, QHeaderView, QListWidget, QLabel
-from PySide6.QtCore import QDate
+from PySide6.QtCore import QDate, Signal
 from db import Database
-from models import AssetDisposal
+import queries
+import refdata
+import allocation
+from gui_workers import fetch_in_background
+from models import StockChange
 
 class DisposalDialog(QDialog):
+    stock_changed = Signal(object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Asset Disposal")
         self.setGeometry(200, 200, 800, 600)
         self.db = Database()
+        self.load_worker = None
         self.init_ui()
         self.load_batches()
 
@@ -22,9 +30,11 @@ class DisposalDialog(QDialog):
         layout.addWidget(self.table)
 
         button_layout = QHBoxLayout()
-        dispose_btn = QPushButton("Dispose Selected")
-        dispose_btn.clicked.connect(self.dispose_selected)
-        button_layout.addWidget(dispose_btn)
+        self.status_label = QLabel("")
+        button_layout.addWidget(self.status_label)
+        self.dispose_btn = QPushButton("Dispose Selected")
+        self.dispose_btn.clicked.connect(self.dispose_selected)
+        button_layout.addWidget(self.dispose_btn)
 
         close_btn = QPushButton("Close")
         close_btn.clicked.connect(self.accept)
@@ -34,33 +44,43 @@ class DisposalDialog(QDialog):
 
         self.setLayout(layout)
 
-    def get_available_quantity(self, batch_id):
-        result = self.db.fetch_one("""
-            SELECT ab.quantity - COALESCE(issued, 0) + COALESCE(returned, 0) - COALESCE(disposed, 0)
-            FROM asset_batches ab
-            LEFT JOIN (SELECT batch_id, SUM(quantity) as issued FROM asset_transactions WHERE transaction_type IN ('Issue', 'Transfer') GROUP BY batch_id) it ON ab.batch_id = it.batch_id
-            LEFT JOIN (SELECT batch_id, SUM(quantity) as returned FROM asset_transactions WHERE transaction_type = 'Return' GROUP BY batch_id) rt ON ab.batch_id = rt.batch_id
-            LEFT JOIN (SELECT batch_id, SUM(quantity) as disposed FROM asset_disposal GROUP BY batch_id) ds ON ab.batch_id = ds.batch_id
-            WHERE ab.batch_id = ?
-        """, (batch_id,))
-        return result[0] if result else 0
+    def done(self, result):
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+            self.load_worker = None
+        super().done(result)
 
     def load_batches(self):
-        data = self.db.fetch_all("""
-            SELECT i.item_name, ab.acquisition_year, SUM(ab.quantity - COALESCE(issued, 0) + COALESCE(returned, 0) - COALESCE(disposed, 0)) as available
-            FROM asset_batches ab
-            JOIN items i ON ab.item_id = i.item_id
-            JOIN branches b ON ab.branch_id = b.branch_id
-            LEFT JOIN (SELECT batch_id, SUM(quantity) as issued FROM asset_transactions WHERE transaction_type IN ('Issue', 'Transfer') GROUP BY batch_id) it ON ab.batch_id = it.batch_id
-            LEFT JOIN (SELECT batch_id, SUM(quantity) as returned FROM asset_transactions WHERE transaction_type = 'Return' GROUP BY batch_id) rt ON ab.batch_id = rt.batch_id
-            LEFT JOIN (SELECT batch_id, SUM(quantity) as disposed FROM asset_disposal GROUP BY batch_id) ds ON ab.batch_id = ds.batch_id
-            WHERE b.branch_name = 'Store' AND (ab.quantity - COALESCE(issued, 0) + COALESCE(returned, 0) - COALESCE(disposed, 0)) > 0
-            GROUP BY i.item_id, i.item_name, ab.acquisition_year
-            ORDER BY i.item_name, ab.acquisition_year
-        """)
+        # The store stock query runs in the background; the table is filled
+        # when it finishes and disposing is disabled until then.
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+        self.table.setRowCount(0)
+        self.dispose_edits = []
+        self.stock = []
+        self.status_label.setText("Loading...")
+        self.dispose_btn.setEnabled(False)
+        worker = fetch_in_background(self.db, queries.DISPOSAL_STORE_STOCK, (),
+                                     lambda data: self.show_batches(worker, data),
+                                     lambda message: self.load_failed(worker, message))
+        self.load_worker = worker
+
+    def load_failed(self, worker, message):
+        if worker is self.load_worker:
+            self.load_worker = None
+            self.status_label.setText("Failed")
+            QMessageBox.critical(self, "Error", f"Failed to load stock: {message}")
+
+    def show_batches(self, worker, data):
+        if worker is not self.load_worker:
+            return
+        self.load_worker = None
+        self.status_label.setText("")
+        self.dispose_btn.setEnabled(True)
         self.table.setRowCount(len(data))
         self.dispose_edits = []
-        for row, (item, year, avail) in enumerate(data):
+        self.stock = data
+        for row, (item_id, item, year, avail) in enumerate(data):
             self.table.setItem(row, 0, QTableWidgetItem(item))
             self.table.setItem(row, 1, QTableWidgetItem(year or ""))
             self.table.setItem(row, 2, QTableWidgetItem(str(avail)))
@@ -70,83 +90,84 @@ class DisposalDialog(QDialog):
             self.dispose_edits.append(edit)
 
     def dispose_selected(self):
-        # Collect items to dispose
-        to_dispose = []
-        for row in range(self.table.rowCount()):
+        # Collect lines to dispose, keyed by item_id and year
+        lines = []
+        item_names = {}
+        for row, (item_id, item, year, avail) in enumerate(self.stock):
             qty_text = self.dispose_edits[row].text()
             try:
                 qty = int(qty_text)
             except ValueError:
                 continue
             if qty > 0:
-                item = self.table.item(row, 0).text()
-                year = self.table.item(row, 1).text()
-                avail = int(self.table.item(row, 2).text())
                 if qty > avail:
-                    QMessageBox.warning(self, "Warning", f"Quantity to dispose ({qty}) exceeds available ({avail}) for {item} {year}.")
+                    QMessageBox.warning(self, "Warning", f"Quantity to dispose ({qty}) exceeds available ({avail}) for {item} {year or ''}.")
                     return
-                to_dispose.append((item, year, qty))
+                lines.append(allocation.DisposalLine(item_id, year, qty))
+                item_names[item_id] = item
 
-        if not to_dispose:
+        if not lines:
             QMessageBox.information(self, "Info", "No disposals to perform.")
             return
 
-        # Open confirmation dialog
-        dialog = DisposalConfirmDialog(to_dispose, self)
+        # Plan the batches up front so the confirmation can preview them
+        try:
+            allocation.plan_disposal(self.db, lines)
+        except allocation.DisposalError as e:
+            details = "\n".join(f"{item_names[lines[index].item_id]} {lines[index].acquisition_year or ''}: {message}"
+                                 for index, message in e.problems)
+            QMessageBox.warning(self, "Warning", f"{e}\n{details}")
+            self.load_batches()
+            return
+        except allocation.AllocationError as e:
+            QMessageBox.warning(self, "Warning", str(e))
+            return
+
+        dialog = DisposalConfirmDialog(lines, item_names, self)
         if dialog.exec() == QDialog.Accepted:
             details = dialog.get_details()
-            for item, year, qty in to_dispose:
-                # Get item_id
-                item_id = self.db.fetch_one("SELECT item_id FROM items WHERE item_name = ?", (item,))[0]
-                # Get batches for this item, year, Store
-                batches = self.db.fetch_all("""
-                    SELECT ab.batch_id
-                    FROM asset_batches ab
-                    JOIN branches b ON ab.branch_id = b.branch_id
-                    LEFT JOIN (SELECT batch_id, SUM(quantity) as issued FROM asset_transactions WHERE transaction_type IN ('Issue', 'Transfer', 'Return') GROUP BY batch_id) it ON ab.batch_id = it.batch_id
-                    LEFT JOIN (SELECT batch_id, SUM(quantity) as disposed FROM asset_disposal GROUP BY batch_id) ds ON ab.batch_id = ds.batch_id
-                    WHERE ab.item_id = ? AND (ab.acquisition_year = ? OR ab.acquisition_year IS NULL) AND b.branch_name = 'Store' AND (ab.quantity - COALESCE(it.issued, 0) - COALESCE(ds.disposed, 0)) > 0
-                    ORDER BY ab.batch_id
-                """, (item_id, year))
-                remaining = qty
-                for (batch_id,) in batches:
-                    if remaining <= 0:
-                        break
-                    avail = self.get_available_quantity(batch_id)
-                    to_disp = min(remaining, avail)
-                    disp = AssetDisposal(
-                        batch_id=batch_id,
-                        disposal_date=details['date'],
-                        quantity=to_disp,
-                        disposal_method=details['method'],
-                        authority_ref=details['authority'],
-                        remarks=details['remarks']
-                    )
-                    query = """INSERT INTO asset_disposal (batch_id, disposal_date, quantity, disposal_method, authority_ref, remarks)
-                               VALUES (?, ?, ?, ?, ?, ?)"""
-                    self.db.execute_query(query, (disp.batch_id, disp.disposal_date, disp.quantity, disp.disposal_method,
-                                                  disp.authority_ref, disp.remarks))
-                    remaining -= to_disp
+            try:
+                allocation.dispose(self.db, lines, details['date'], details['method'], details['authority'], details['remarks'])
+            except allocation.AllocationError as e:
+                QMessageBox.warning(self, "Warning", f"Stock changed since the preview; nothing was disposed of. {e}")
+                self.load_batches()
+                return
+            except sqlite3.Error as e:
+                QMessageBox.critical(self, "Error", f"Disposals could not be saved: {e}")
+                return
+            store_id = refdata.get(self.db).store_id
+            self.stock_changed.emit(StockChange({(line.item_id, store_id, line.acquisition_year) for line in lines}))
             QMessageBox.information(self, "Success", "Disposals completed.")
             self.load_batches()
 
 class DisposalConfirmDialog(QDialog):
-    def __init__(self, to_dispose, parent=None):
+    # Previews the planned disposal batch by batch before anything is written
+    def __init__(self, lines, item_names, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Confirm Disposal")
-        self.to_dispose = to_dispose
+        self.setGeometry(250, 250, 700, 500)
+        self.lines = lines
+        self.item_names = item_names
         self.init_ui()
 
     def init_ui(self):
         layout = QVBoxLayout()
 
-        # Show list of items to dispose
-        label = QLabel("Items to Dispose:")
+        # Show the batches each line will be taken from
+        allocations = [(line, a) for line in self.lines for a in line.allocations]
+        units = sum(line.quantity for line in self.lines)
+        label = QLabel(f"Items to Dispose: {len(self.lines)} lines, {units} units from {len(allocations)} batches")
         layout.addWidget(label)
-        list_widget = QListWidget()
-        for item, year, qty in self.to_dispose:
-            list_widget.addItem(f"{year}: {item} - Qty {qty}")
-        layout.addWidget(list_widget)
+        preview = QTableWidget(len(allocations), 5)
+        preview.setHorizontalHeaderLabels(["Item", "Acquisition Year", "Batch", "Quantity", "Cost"])
+        preview.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        preview.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row, (line, a) in enumerate(allocations):
+            values = [self.item_names.get(line.item_id, ""), line.acquisition_year or "", str(a.batch_id), str(a.quantity),
+                      f"{a.cost:.2f}" if a.cost is not None else ""]
+            for column, value in enumerate(values):
+                preview.setItem(row, column, QTableWidgetItem(value))
+        layout.addWidget(preview)
 
         form_layout = QFormLayout()
 
@@ -0,0 +1,205 @@
+import json
+import sqlite3
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QFormLayout, QLineEdit, QComboBox, QDateEdit, QSpinBox, QMessageBox, QTableWidget, QTableWidgetItem, QHBoxLayout, QPushButton, QHeaderView, QListWidget, QListWidgetItem, QLabel
+from PySide6.QtGui import QColor
+from PySide6.QtCore import Qt, QDate, Signal
+from db import Database
+from models import StockChange
+from gui_item_search import ItemSearchEdit
+import queries
+import refdata
+import allocation
+
+class IssueVoucherDialog(QDialog):
+    # Bulk issue voucher: lines of item x year x branch x quantity are built
+    # up in a grid, validated together against Store stock and posted in one
+    # transaction under a single authority reference.
+    stock_changed = Signal(object)
+    QUANTITY_COLUMN = 3
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Bulk Issue Voucher")
+        self.setGeometry(200, 200, 1000, 700)
+        self.db = Database()
+        self.lines = []
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        form_layout = QFormLayout()
+        self.date_edit = QDateEdit()
+        self.date_edit.setDate(QDate.currentDate())
+        form_layout.addRow("Transaction Date:", self.date_edit)
+        self.auth_edit = QLineEdit()
+        form_layout.addRow("Authority Ref*:", self.auth_edit)
+        self.remarks_edit = QLineEdit()
+        form_layout.addRow("Remarks:", self.remarks_edit)
+        layout.addLayout(form_layout)
+
+        # Line builder: one item and year to any number of branches
+        builder_layout = QHBoxLayout()
+        pick_layout = QFormLayout()
+        self.item_edit = ItemSearchEdit(self, self.db)
+        self.item_edit.item_changed.connect(self.update_years)
+        pick_layout.addRow("Item:", self.item_edit)
+        self.year_combo = QComboBox()
+        pick_layout.addRow("Acquisition Year:", self.year_combo)
+        self.qty_spin = QSpinBox()
+        self.qty_spin.setRange(1, 1000000)
+        pick_layout.addRow("Quantity per Branch:", self.qty_spin)
+        add_btn = QPushButton("Add Lines")
+        add_btn.clicked.connect(self.add_lines)
+        pick_layout.addRow(add_btn)
+        builder_layout.addLayout(pick_layout)
+
+        branch_layout = QVBoxLayout()
+        self.branch_list = QListWidget()
+        for branch_id, name in refdata.get(self.db).branches_except_store():
+            entry = QListWidgetItem(name)
+            entry.setData(Qt.UserRole, branch_id)
+            entry.setCheckState(Qt.Unchecked)
+            self.branch_list.addItem(entry)
+        branch_layout.addWidget(self.branch_list)
+        check_layout = QHBoxLayout()
+        all_btn = QPushButton("All Branches")
+        all_btn.clicked.connect(lambda: self.check_branches(Qt.Checked))
+        none_btn = QPushButton("None")
+        none_btn.clicked.connect(lambda: self.check_branches(Qt.Unchecked))
+        check_layout.addWidget(all_btn)
+        check_layout.addWidget(none_btn)
+        branch_layout.addLayout(check_layout)
+        builder_layout.addLayout(branch_layout)
+        layout.addLayout(builder_layout)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(5)
+        self.table.setHorizontalHeaderLabels(["Item", "Acquisition Year", "Branch", "Quantity", "Status"])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.itemChanged.connect(self.quantity_edited)
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        self.status_label = QLabel("")
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+        remove_btn = QPushButton("Remove Selected")
+        remove_btn.clicked.connect(self.remove_selected)
+        button_layout.addWidget(remove_btn)
+        validate_btn = QPushButton("Validate")
+        validate_btn.clicked.connect(self.validate)
+        button_layout.addWidget(validate_btn)
+        post_btn = QPushButton("Post Voucher")
+        post_btn.clicked.connect(self.post)
+        button_layout.addWidget(post_btn)
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.clicked.connect(self.reject)
+        button_layout.addWidget(cancel_btn)
+        layout.addLayout(button_layout)
+
+        self.setLayout(layout)
+
+    def check_branches(self, state):
+        for row in range(self.branch_list.count()):
+            self.branch_list.item(row).setCheckState(state)
+
+    def update_years(self):
+        self.year_combo.clear()
+        item_id = self.item_edit.item_id()
+        store_id = refdata.get(self.db).store_id
+        if item_id and store_id:
+            for year, total in self.db.fetch_all(queries.ISSUE_AVAILABLE_YEARS, (item_id, store_id)):
+                self.year_combo.addItem(f"{year} ({total})" if year else f"Unknown ({total})", year)
+
+    def add_lines(self):
+        item_id = self.item_edit.item_id()
+        branches = [self.branch_list.item(row) for row in range(self.branch_list.count())
+                    if self.branch_list.item(row).checkState() == Qt.Checked]
+        if not item_id or self.year_combo.currentIndex() < 0 or not branches:
+            QMessageBox.warning(self, "Warning", "Pick an item, a year and at least one branch.")
+            return
+        year = self.year_combo.currentData()
+        # Adding the same item, year and branch again replaces its quantity
+        existing = {(line.item_id, line.acquisition_year, line.branch_id): line for line in self.lines}
+        for entry in branches:
+            key = (item_id, year, entry.data(Qt.UserRole))
+            if key in existing:
+                existing[key].quantity = self.qty_spin.value()
+            else:
+                self.lines.append(allocation.VoucherLine(item_id, year, key[2], self.qty_spin.value()))
+        self.show_lines()
+
+    def remove_selected(self):
+        rows = {index.row() for index in self.table.selectedIndexes()}
+        self.lines = [line for row, line in enumerate(self.lines) if row not in rows]
+        self.show_lines()
+
+    def show_lines(self, problems=None):
+        # problems: {line index: message} from the last validation
+        refs = refdata.get(self.db)
+        item_ids = json.dumps(sorted({line.item_id for line in self.lines}))
+        names = dict(self.db.fetch_all("SELECT item_id, item_name FROM items WHERE item_id IN (SELECT value FROM json_each(?))", (item_ids,)))
+        self.table.blockSignals(True)
+        self.table.setRowCount(len(self.lines))
+        for row, line in enumerate(self.lines):
+            values = [names.get(line.item_id, ""), line.acquisition_year or "Unknown", refs.branch_names.get(line.branch_id, ""),
+                      str(line.quantity), (problems or {}).get(row, "OK" if problems is not None else "")]
+            for column, value in enumerate(values):
+                cell = QTableWidgetItem(value)
+                if column != self.QUANTITY_COLUMN:
+                    cell.setFlags(cell.flags() & ~Qt.ItemIsEditable)
+                if problems and row in problems:
+                    cell.setBackground(QColor("#f8d7da"))
+                self.table.setItem(row, column, cell)
+        self.table.blockSignals(False)
+        total = sum(line.quantity for line in self.lines)
+        self.status_label.setText(f"{len(self.lines)} lines, {total} units")
+
+    def quantity_edited(self, cell):
+        if cell.column() != self.QUANTITY_COLUMN:
+            return
+        try:
+            self.lines[cell.row()].quantity = int(cell.text())
+        except ValueError:
+            self.lines[cell.row()].quantity = 0
+        total = sum(line.quantity for line in self.lines)
+        self.status_label.setText(f"{len(self.lines)} lines, {total} units")
+
+    def issue(self, dry_run):
+        # Runs the voucher; shows the failing lines and returns None if any
+        if not self.lines:
+            QMessageBox.warning(self, "Warning", "The voucher has no lines.")
+            return None
+        try:
+            lines = allocation.issue_voucher(self.db, self.lines, self.date_edit.date().toString("yyyy-MM-dd"),
+                                             self.auth_edit.text(), self.remarks_edit.text(), dry_run=dry_run)
+        except allocation.VoucherError as e:
+            self.show_lines(dict(e.problems))
+            self.status_label.setText(str(e))
+            return None
+        except allocation.AllocationError as e:
+            QMessageBox.warning(self, "Warning", str(e))
+            return None
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Error", f"Voucher could not be posted: {e}")
+            return None
+        self.show_lines({})
+        return lines
+
+    def validate(self):
+        if self.issue(dry_run=True) is not None:
+            self.status_label.setText(f"All {len(self.lines)} lines can be issued.")
+
+    def post(self):
+        if not self.auth_edit.text():
+            QMessageBox.warning(self, "Warning", "Please fill required fields.")
+            return
+        lines = self.issue(dry_run=False)
+        if lines is None:
+            return
+        store_id = refdata.get(self.db).store_id
+        self.stock_changed.emit(StockChange({(line.item_id, branch_id, line.acquisition_year)
+                                             for line in lines for branch_id in (store_id, line.branch_id)}))
+        QMessageBox.information(self, "Success", f"Voucher posted: {len(lines)} lines issued.")
+        self.accept()
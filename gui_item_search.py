@@ -0,0 +1,68 @@
+from PySide6.QtWidgets import QLineEdit, QCompleter
+from PySide6.QtGui import QStandardItemModel, QStandardItem
+from PySide6.QtCore import Qt, QTimer, QModelIndex, Signal
+from db import Database
+import queries
+
+class ItemSearchEdit(QLineEdit):
+    # Type-ahead item picker. Nothing is loaded up front: as the user types,
+    # the best matches from the items_fts index (queries.ITEM_SEARCH) are
+    # offered in a popup, and picking one sets item_id().
+    item_changed = Signal(object)
+
+    def __init__(self, parent=None, db=None, limit=20, placeholder="Type to search items..."):
+        super().__init__(parent)
+        self.db = db or Database()
+        self.limit = limit
+        self._item_id = None
+        self.setPlaceholderText(placeholder)
+        self.setClearButtonEnabled(True)
+        self.matches = QStandardItemModel(self)
+        # The completer is attached with setWidget rather than setCompleter so
+        # it shows the index's matches as they are instead of re-filtering them.
+        self.completer = QCompleter(self.matches, self)
+        self.completer.setWidget(self)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.activated[QModelIndex].connect(self.choose)
+        # Search once typing pauses rather than on every keystroke
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(100)
+        self.search_timer.timeout.connect(self.search)
+        self.textEdited.connect(self.text_edited)
+
+    def item_id(self):
+        return self._item_id
+
+    def set_item(self, item_id):
+        row = self.db.fetch_one("SELECT item_name FROM items WHERE item_id = ?", (item_id,)) if item_id else None
+        self.setText(row[0] if row else "")
+        self.set_item_id(item_id if row else None)
+
+    def set_item_id(self, item_id):
+        if item_id != self._item_id:
+            self._item_id = item_id
+            self.item_changed.emit(item_id)
+
+    def text_edited(self, text):
+        # Editing the text drops the item that was picked
+        self.set_item_id(None)
+        self.search_timer.start()
+
+    def search(self):
+        match = queries.item_match(self.text())
+        self.matches.clear()
+        if match:
+            for item_id, name, code in self.db.fetch_all(queries.ITEM_SEARCH, {'match': match, 'limit': self.limit}):
+                row = QStandardItem(f"{name} ({code})" if code else name)
+                row.setData(item_id, Qt.UserRole)
+                row.setData(name, Qt.UserRole + 1)
+                self.matches.appendRow(row)
+        if self.matches.rowCount():
+            self.completer.complete()
+        else:
+            self.completer.popup().hide()
+
+    def choose(self, index):
+        self.setText(index.data(Qt.UserRole + 1))
+        self.set_item_id(index.data(Qt.UserRole))
@@ -1,7 +1,11 @@
+import sqlite3
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton, QLineEdit, QLabel, QMessageBox, QInputDialog, QComboBox, QFormLayout, QDialogButtonBox
 from PySide6.QtCore import Qt
 from db import Database
 from models import Item
+import masterdata
+import queries
+import refdata
 
 class ItemsDialog(QDialog):
     def __init__(self, parent=None):
@@ -15,6 +19,12 @@ class ItemsDialog(QDialog):
     def init_ui(self):
         layout = QVBoxLayout()
 
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search name, specification or property code...")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.load_items)
+        layout.addWidget(self.search_edit)
+
         self.list_widget = QListWidget()
         self.list_widget.setStyleSheet("QListWidget { border: 1px solid #ccc; }")
         layout.addWidget(self.list_widget)
@@ -40,20 +50,32 @@ class ItemsDialog(QDialog):
 
     def load_items(self):
         self.list_widget.clear()
-        items = self.db.fetch_all("""
-            SELECT i.item_id, i.item_name, c.category_name, sc.subcategory_name
-            FROM items i
-            JOIN categories c ON i.category_id = c.category_id
-            JOIN sub_categories sc ON i.subcategory_id = sc.subcategory_id
-        """)
+        match = queries.item_match(self.search_edit.text())
+        if match:
+            # Best matches from the full-text index
+            items = self.db.fetch_all(f"""
+                SELECT i.item_id, i.item_name, c.category_name, sc.subcategory_name
+                FROM ({queries.ITEM_SEARCH}) hit
+                JOIN items i ON hit.item_id = i.item_id
+                JOIN categories c ON i.category_id = c.category_id
+                JOIN sub_categories sc ON i.subcategory_id = sc.subcategory_id
+                ORDER BY i.item_name
+            """, {'match': match, 'limit': 200})
+        else:
+            items = self.db.fetch_all("""
+                SELECT i.item_id, i.item_name, c.category_name, sc.subcategory_name
+                FROM items i
+                JOIN categories c ON i.category_id = c.category_id
+                JOIN sub_categories sc ON i.subcategory_id = sc.subcategory_id
+            """)
         for it in items:
             self.list_widget.addItem(f"{it[0]}: {it[1]} ({it[2]} - {it[3]})")
 
     def get_categories(self):
-        return self.db.fetch_all("SELECT category_id, category_name FROM categories")
+        return refdata.get(self.db).categories
 
     def get_subcategories(self, cat_id):
-        return self.db.fetch_all("SELECT subcategory_id, subcategory_name FROM sub_categories WHERE category_id = ?", (cat_id,))
+        return refdata.get(self.db).subcategories(cat_id)
 
     def add_item(self):
         dialog = ItemEditDialog(self)
@@ -67,10 +89,11 @@ class ItemsDialog(QDialog):
             if item_count > 0 and not item.govt_property_code:
                 QMessageBox.warning(self, "Warning", "Govt Property Code is required for additional items.")
                 return
-            query = """INSERT INTO items (item_name, category_id, subcategory_id, specification, govt_property_code, remarks)
-                       VALUES (?, ?, ?, ?, ?, ?)"""
-            self.db.execute_query(query, (item.item_name, item.category_id, item.subcategory_id, item.specification,
-                                          item.govt_property_code, item.remarks))
+            try:
+                masterdata.create(self.db, 'items', self.item_values(item))
+            except (sqlite3.Error, ValueError) as e:
+                QMessageBox.critical(self, "Error", f"Item could not be saved: {e}")
+                return
             self.load_items()
 
     def edit_item(self):
@@ -87,12 +110,18 @@ class ItemsDialog(QDialog):
                 if not item.category_id or not item.subcategory_id:
                     QMessageBox.warning(self, "Warning", "Please select a category and subcategory.")
                     return
-                query = """UPDATE items SET item_name = ?, category_id = ?, subcategory_id = ?, specification = ?,
-                          govt_property_code = ?, remarks = ? WHERE item_id = ?"""
-                self.db.execute_query(query, (item.item_name, item.category_id, item.subcategory_id, item.specification,
-                                              item.govt_property_code, item.remarks, item_id))
+                try:
+                    masterdata.update(self.db, 'items', item_id, self.item_values(item))
+                except (sqlite3.Error, LookupError, ValueError) as e:
+                    QMessageBox.critical(self, "Error", f"Item could not be saved: {e}")
+                    return
                 self.load_items()
 
+    @staticmethod
+    def item_values(item):
+        return {'item_name': item.item_name, 'category_id': item.category_id, 'subcategory_id': item.subcategory_id,
+                'specification': item.specification, 'govt_property_code': item.govt_property_code, 'remarks': item.remarks}
+
     def delete_item(self):
         current_item = self.list_widget.currentItem()
         if not current_item:
@@ -106,7 +135,11 @@ class ItemsDialog(QDialog):
             if count > 0:
                 QMessageBox.warning(self, "Warning", "Cannot delete item that has asset batches.")
                 return
-            self.db.execute_query("DELETE FROM items WHERE item_id = ?", (item_id,))
+            try:
+                masterdata.delete(self.db, 'items', item_id)
+            except (sqlite3.Error, LookupError) as e:
+                QMessageBox.critical(self, "Error", f"Item could not be deleted: {e}")
+                return
             self.load_items()
 
 class ItemEditDialog(QDialog):
@@ -126,8 +159,7 @@ class ItemEditDialog(QDialog):
         form_layout.addRow("Item Name*:", self.name_edit)
 
         self.cat_combo = QComboBox()
-        cats = self.db.fetch_all("SELECT category_id, category_name FROM categories")
-        for cat in cats:
+        for cat in refdata.get(self.db).categories:
             self.cat_combo.addItem(cat[1], cat[0])
         self.cat_combo.currentIndexChanged.connect(self.update_subcats)
         form_layout.addRow("Category*:", self.cat_combo)
@@ -161,8 +193,7 @@ class ItemEditDialog(QDialog):
     def update_subcats(self):
         cat_id = self.cat_combo.currentData()
         self.subcat_combo.clear()
-        subcats = self.db.fetch_all("SELECT subcategory_id, subcategory_name FROM sub_categories WHERE category_id = ?", (cat_id,))
-        for sub in subcats:
+        for sub in refdata.get(self.db).subcategories(cat_id):
             self.subcat_combo.addItem(sub[1], sub[0])
 
     def load_item(self):
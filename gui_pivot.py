@@ -0,0 +1,129 @@
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QLabel, QComboBox, QMessageBox
+from PySide6.QtCore import Qt
+from db import Database
+from gui_workers import run_in_background
+
+class PivotDialog(QDialog):
+    # Categories / sub-categories / items against branches. The cube is loaded
+    # once in the background; changing the rows or measure, drilling down
+    # (double-click a row) and going back up only re-slice it in memory.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Pivot")
+        self.setGeometry(200, 200, 1000, 600)
+        self.db = Database()
+        self.cube = None
+        self.path = []
+        self.row_ids = []
+        self.init_ui()
+        self.load_cube()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Rows:"))
+        self.level_combo = QComboBox()
+        self.level_combo.addItem("Category", "category")
+        self.level_combo.addItem("Sub-Category", "subcategory")
+        self.level_combo.addItem("Item", "item")
+        self.level_combo.currentIndexChanged.connect(self.change_level)
+        filter_layout.addWidget(self.level_combo)
+        filter_layout.addWidget(QLabel("Show:"))
+        self.measure_combo = QComboBox()
+        self.measure_combo.addItem("Remaining Quantity", "quantity")
+        self.measure_combo.addItem("Remaining Value", "value")
+        self.measure_combo.currentIndexChanged.connect(self.show_slice)
+        filter_layout.addWidget(self.measure_combo)
+        self.back_btn = QPushButton("Up")
+        self.back_btn.setEnabled(False)
+        self.back_btn.clicked.connect(self.drill_up)
+        filter_layout.addWidget(self.back_btn)
+        self.path_label = QLabel("")
+        filter_layout.addWidget(self.path_label)
+        filter_layout.addStretch()
+        layout.addLayout(filter_layout)
+
+        self.table = QTableWidget()
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setStyleSheet("QTableWidget { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
+        self.table.cellDoubleClicked.connect(self.drill_down)
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        self.status_label = QLabel("Loading...")
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+        refresh_btn = QPushButton("Refresh")
+        refresh_btn.clicked.connect(self.load_cube)
+        button_layout.addWidget(refresh_btn)
+        close_btn = QPushButton("Close")
+        close_btn.clicked.connect(self.accept)
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def load_cube(self):
+        from pivot import PivotCube
+        db_name = self.db.db_name
+        self.status_label.setText("Loading...")
+        self.load_worker = run_in_background(lambda: PivotCube(Database(db_name)), self.cube_loaded, self.show_error)
+
+    def cube_loaded(self, cube):
+        self.cube = cube
+        self.show_slice()
+
+    def show_error(self, message):
+        self.status_label.setText("Failed")
+        QMessageBox.critical(self, "Error", f"Failed to load pivot: {message}")
+
+    def level(self):
+        return self.level_combo.currentData()
+
+    def change_level(self):
+        # Picking the rows directly starts again from the top
+        self.path = []
+        self.show_slice()
+
+    def drill_down(self, row, column):
+        if self.level() == "item" or row >= len(self.row_ids):
+            return
+        self.path.append((self.level_combo.currentIndex(), self.row_ids[row], self.table.verticalHeaderItem(row).text()))
+        self.set_level(self.level_combo.currentIndex() + 1)
+
+    def drill_up(self):
+        if self.path:
+            index = self.path.pop()[0]
+            self.set_level(index)
+
+    def set_level(self, index):
+        self.level_combo.blockSignals(True)
+        self.level_combo.setCurrentIndex(index)
+        self.level_combo.blockSignals(False)
+        self.show_slice()
+
+    def show_slice(self):
+        if self.cube is None:
+            return
+        measure = self.measure_combo.currentData()
+        parent_id = self.path[-1][1] if self.path else None
+        self.row_ids, labels, branches, matrix = self.cube.slice(self.level(), measure, parent_id)
+        self.back_btn.setEnabled(bool(self.path))
+        self.path_label.setText(" > ".join(label for _, _, label in self.path))
+
+        fmt = "{:,.2f}" if measure == "value" else "{:,.0f}"
+        self.table.setUpdatesEnabled(False)
+        self.table.clear()
+        self.table.setRowCount(len(labels) + 1)
+        self.table.setColumnCount(len(branches) + 1)
+        self.table.setHorizontalHeaderLabels(branches + ["Total"])
+        self.table.setVerticalHeaderLabels(labels + ["Total"])
+        rows = matrix.tolist()
+        rows.append(matrix.sum(axis=0).tolist())
+        for r, values in enumerate(rows):
+            values.append(sum(values))
+            for c, value in enumerate(values):
+                cell = QTableWidgetItem(fmt.format(value) if value else "")
+                cell.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(r, c, cell)
+        self.table.setUpdatesEnabled(True)
+        self.status_label.setText(f"{len(labels)} rows")
@@ -1,89 +1,52 @@
-from PySide6.QtWidgets import QDialog, QVBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QHBoxLayout, QMessageBox
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QTableView, QPushButton, QHBoxLayout, QLabel, QMessageBox, QCheckBox, QDateEdit, QComboBox
+from PySide6.QtCore import Qt, QDate
 from db import Database
+import queries
+import refdata
+from gui_table_model import QueryTableModel, KeysetTableModel
+from gui_workers import start_export, fetch_as_of_params, fetch_in_background
+from report_cache import report_cache
+from gui_item_search import ItemSearchEdit
+
+class ReportDialog(QDialog):
+    # Shared layout for the report dialogs: a virtualized table over one query,
+    # with CSV export and close buttons. Subclasses set the class attributes.
+    title = ""
+    headers = []
+    query = ""
+    params = ()
+    keys = ()
+    width = 800
 
-class StockRegisterDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setWindowTitle("Stock Register")
-        self.setGeometry(200, 200, 800, 600)
+        self.setWindowTitle(self.title)
+        self.setGeometry(200, 200, self.width, 600)
         self.db = Database()
         self.init_ui()
         self.load_data()
 
-    def init_ui(self):
-        layout = QVBoxLayout()
-        self.table = QTableWidget()
-        self.table.setStyleSheet("QTableWidget { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
-        layout.addWidget(self.table)
-        button_layout = QHBoxLayout()
-        export_btn = QPushButton("Export to CSV")
-        export_btn.clicked.connect(self.export_csv)
-        button_layout.addWidget(export_btn)
-        close_btn = QPushButton("Close")
-        close_btn.clicked.connect(self.accept)
-        button_layout.addWidget(close_btn)
-        layout.addLayout(button_layout)
-        self.setLayout(layout)
-
-    def load_data(self):
-        # Simple stock register: item, total acquired (original), disposed, remaining
-        data = self.db.fetch_all("""
-            SELECT i.item_name, SUM(ab.quantity) as acquired, SUM(COALESCE(ds.disposed, 0)) as disposed
-            FROM asset_batches ab
-            JOIN items i ON ab.item_id = i.item_id
-            LEFT JOIN (SELECT batch_id, SUM(quantity) as disposed FROM asset_disposal GROUP BY batch_id) ds ON ab.batch_id = ds.batch_id
-            WHERE ab.acquisition_method NOT IN ('Issue', 'Return')
-            GROUP BY i.item_id, i.item_name
-        """)
-        self.table.setRowCount(0)  # Start with 0 rows
-        self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels(["Item", "Acquired", "Disposed", "Remaining"])
-        row = 0
-        for name, acq, disp in data:
-            acq = acq or 0
-            disp = disp or 0
-            rem = acq - disp
-            if rem > 0:
-                self.table.insertRow(row)
-                self.table.setItem(row, 0, QTableWidgetItem(name))
-                self.table.setItem(row, 1, QTableWidgetItem(str(acq)))
-                self.table.setItem(row, 2, QTableWidgetItem(str(disp)))
-                self.table.setItem(row, 3, QTableWidgetItem(str(rem)))
-                row += 1
-
-    def export_csv(self):
-        import csv
-        from PySide6.QtWidgets import QFileDialog
-        filename, _ = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv)")
-        if filename:
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                headers = ["Item", "Acquired", "Disposed", "Remaining"]
-                writer.writerow(headers)
-                for row in range(self.table.rowCount()):
-                    row_data = []
-                    for col in range(self.table.columnCount()):
-                        item = self.table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    writer.writerow(row_data)
-            QMessageBox.information(self, "Export", "Data exported to CSV successfully.")
+    def create_model(self):
+        return QueryTableModel(self.headers, self, cache=report_cache)
 
-class BranchBalanceDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Branch-wise Balance")
-        self.setGeometry(200, 200, 800, 600)
-        self.db = Database()
-        self.init_ui()
-        self.load_data()
+    def add_filters(self, layout):
+        pass
 
     def init_ui(self):
         layout = QVBoxLayout()
-        self.table = QTableWidget()
-        self.table.setStyleSheet("QTableWidget { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
+        self.add_filters(layout)
+        self.model = self.create_model()
+        self.model.loading_changed.connect(self.set_loading)
+        self.model.failed.connect(self.show_error)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setStyleSheet("QTableView { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
         layout.addWidget(self.table)
         button_layout = QHBoxLayout()
-        export_btn = QPushButton("Export to CSV")
+        self.status_label = QLabel("")
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+        export_btn = QPushButton("Export...")
         export_btn.clicked.connect(self.export_csv)
         button_layout.addWidget(export_btn)
         close_btn = QPushButton("Close")
@@ -93,226 +56,178 @@ class BranchBalanceDialog(QDialog):
         self.setLayout(layout)
 
     def load_data(self):
-        # Branch, item, balance
-        data = self.db.fetch_all("""
-            SELECT b.branch_name, i.item_name,
-                   SUM(ab.quantity) - 
-                   (SELECT COALESCE(SUM(at.quantity), 0) FROM asset_transactions at WHERE at.batch_id = ab.batch_id AND at.transaction_type IN ('Issue', 'Transfer')) -
-                   (SELECT COALESCE(SUM(at.quantity), 0) FROM asset_transactions at WHERE at.batch_id = ab.batch_id AND at.transaction_type = 'Return') -
-                   (SELECT COALESCE(SUM(ad.quantity), 0) FROM asset_disposal ad WHERE ad.batch_id = ab.batch_id) as balance
-            FROM asset_batches ab
-            JOIN branches b ON ab.branch_id = b.branch_id
-            JOIN items i ON ab.item_id = i.item_id
-            GROUP BY b.branch_id, b.branch_name, i.item_id, i.item_name
-            HAVING balance > 0
-        """)
-        self.table.setRowCount(len(data))
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(["Branch", "Item", "Balance"])
-        for row, (br, it, bal) in enumerate(data):
-            self.table.setItem(row, 0, QTableWidgetItem(br))
-            self.table.setItem(row, 1, QTableWidgetItem(it))
-            self.table.setItem(row, 2, QTableWidgetItem(str(bal)))
+        self.model.set_query(self.db, self.query, self.params, self.keys)
 
-    def export_csv(self):
-        import csv
-        from PySide6.QtWidgets import QFileDialog
-        filename, _ = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv)")
-        if filename:
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                headers = ["Branch", "Item", "Balance"]
-                writer.writerow(headers)
-                for row in range(self.table.rowCount()):
-                    row_data = []
-                    for col in range(self.table.columnCount()):
-                        item = self.table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    writer.writerow(row_data)
-            QMessageBox.information(self, "Export", "Data exported to CSV successfully.")
+    def set_loading(self, loading):
+        if loading:
+            self.status_label.setText("Loading...")
+        else:
+            self.status_label.setText(f"{self.model.rowCount()} rows" + (" (cached)" if self.model.from_cache else ""))
 
-class DisposalReportDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Disposal Report")
-        self.setGeometry(200, 200, 800, 600)
-        self.db = Database()
-        self.init_ui()
-        self.load_data()
+    def show_error(self, message):
+        self.status_label.setText("Failed")
+        QMessageBox.critical(self, "Error", f"Failed to load report: {message}")
 
-    def init_ui(self):
-        layout = QVBoxLayout()
-        self.table = QTableWidget()
-        self.table.setStyleSheet("QTableWidget { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
-        layout.addWidget(self.table)
-        button_layout = QHBoxLayout()
-        export_btn = QPushButton("Export to CSV")
-        export_btn.clicked.connect(self.export_csv)
-        button_layout.addWidget(export_btn)
-        close_btn = QPushButton("Close")
-        close_btn.clicked.connect(self.accept)
-        button_layout.addWidget(close_btn)
-        layout.addLayout(button_layout)
-        self.setLayout(layout)
-
-    def load_data(self):
-        data = self.db.fetch_all("""
-            SELECT i.item_name, ad.disposal_date, ad.quantity, ad.disposal_method, ad.authority_ref
-            FROM asset_disposal ad
-            JOIN asset_batches ab ON ad.batch_id = ab.batch_id
-            JOIN items i ON ab.item_id = i.item_id
-            ORDER BY ad.disposal_date DESC
-        """)
-        self.table.setRowCount(len(data))
-        self.table.setColumnCount(5)
-        self.table.setHorizontalHeaderLabels(["Item", "Date", "Quantity", "Method", "Authority"])
-        for row, (it, dt, qty, meth, auth) in enumerate(data):
-            self.table.setItem(row, 0, QTableWidgetItem(it))
-            self.table.setItem(row, 1, QTableWidgetItem(dt))
-            self.table.setItem(row, 2, QTableWidgetItem(str(qty)))
-            self.table.setItem(row, 3, QTableWidgetItem(meth))
-            self.table.setItem(row, 4, QTableWidgetItem(auth or ""))
+    def done(self, result):
+        # Stop the background query so it does not keep running for a closed dialog
+        self.model.cancel()
+        super().done(result)
 
     def export_csv(self):
-        import csv
-        from PySide6.QtWidgets import QFileDialog
-        filename, _ = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv)")
-        if filename:
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                headers = ["Item", "Date", "Quantity", "Method", "Authority"]
-                writer.writerow(headers)
-                for row in range(self.table.rowCount()):
-                    row_data = []
-                    for col in range(self.table.columnCount()):
-                        item = self.table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    writer.writerow(row_data)
-            QMessageBox.information(self, "Export", "Data exported to CSV successfully.")
-
-class AcquisitionHistoryDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Acquisition History")
-        self.setGeometry(200, 200, 800, 600)
-        self.db = Database()
-        self.init_ui()
-        self.load_data()
-
-    def init_ui(self):
-        layout = QVBoxLayout()
-        self.table = QTableWidget()
-        self.table.setStyleSheet("QTableWidget { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
-        layout.addWidget(self.table)
-        button_layout = QHBoxLayout()
-        export_btn = QPushButton("Export to CSV")
-        export_btn.clicked.connect(self.export_csv)
-        button_layout.addWidget(export_btn)
-        close_btn = QPushButton("Close")
-        close_btn.clicked.connect(self.accept)
-        button_layout.addWidget(close_btn)
-        layout.addLayout(button_layout)
-        self.setLayout(layout)
+        # Streams straight from the database, independent of what the view has loaded
+        self.export_worker = start_export(self, self.db, self.query, self.headers, self.params)
+
+class StockRegisterDialog(ReportDialog):
+    # Simple stock register: item, total acquired (original), disposed, remaining
+    title = "Stock Register"
+    headers = queries.REPORTS['stock-register']['headers']
+    query = queries.REPORTS['stock-register']['query']
+    keys = queries.REPORTS['stock-register']['keys']
+
+class BranchBalanceDialog(ReportDialog):
+    title = "Branch-wise Balance"
+    headers = queries.REPORTS['branch-balance']['headers']
+    query = queries.REPORTS['branch-balance']['query']
+    keys = queries.REPORTS['branch-balance']['keys']
+
+    def add_filters(self, layout):
+        self.as_of_worker = None
+        filter_layout = QHBoxLayout()
+        self.as_of_check = QCheckBox("As of")
+        filter_layout.addWidget(self.as_of_check)
+        self.as_of_edit = QDateEdit(QDate.currentDate())
+        self.as_of_edit.setCalendarPopup(True)
+        filter_layout.addWidget(self.as_of_edit)
+        filter_layout.addStretch()
+        apply_btn = QPushButton("Apply")
+        apply_btn.clicked.connect(self.load_data)
+        filter_layout.addWidget(apply_btn)
+        layout.addLayout(filter_layout)
 
     def load_data(self):
-        data = self.db.fetch_all("""
-            SELECT i.item_name, b.branch_name, ab.acquisition_date, ab.acquisition_year, ab.quantity, ab.acquisition_method, ab.source
-            FROM asset_batches ab
-            JOIN items i ON ab.item_id = i.item_id
-            JOIN branches b ON ab.branch_id = b.branch_id
-            WHERE ab.acquisition_method NOT IN ('Issue', 'Return')
-            ORDER BY ab.acquisition_date DESC
-        """)
-        self.table.setRowCount(len(data))
-        self.table.setColumnCount(7)
-        self.table.setHorizontalHeaderLabels(["Item", "Branch", "Date", "Acquisition Year", "Quantity", "Method", "Source"])
-        for row, (it, br, dt, ay, qty, meth, src) in enumerate(data):
-            self.table.setItem(row, 0, QTableWidgetItem(it))
-            self.table.setItem(row, 1, QTableWidgetItem(br))
-            self.table.setItem(row, 2, QTableWidgetItem(dt))
-            self.table.setItem(row, 3, QTableWidgetItem(ay or ""))
-            self.table.setItem(row, 4, QTableWidgetItem(str(qty)))
-            self.table.setItem(row, 5, QTableWidgetItem(meth))
-            self.table.setItem(row, 6, QTableWidgetItem(src or ""))
-
-    def export_csv(self):
-        import csv
-        from PySide6.QtWidgets import QFileDialog
-        filename, _ = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv)")
-        if filename:
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                headers = ["Item", "Branch", "Date", "Acquisition Year", "Quantity", "Method", "Source"]
-                writer.writerow(headers)
-                for row in range(self.table.rowCount()):
-                    row_data = []
-                    for col in range(self.table.columnCount()):
-                        item = self.table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    writer.writerow(row_data)
-            QMessageBox.information(self, "Export", "Data exported to CSV successfully.")
-
-class TransactionHistoryDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Transaction History")
-        self.setGeometry(200, 200, 1000, 600)
-        self.db = Database()
-        self.init_ui()
-        self.load_data()
+        self.as_of_worker = None
+        if not self.as_of_check.isChecked():
+            self.query, self.params = queries.BRANCH_BALANCE, ()
+            super().load_data()
+            return
+        # Balances on a past date come from the nearest monthly checkpoint
+        self.model.cancel()
+        self.set_loading(True)
+        worker = fetch_as_of_params(self.db, self.as_of_edit.date().toString("yyyy-MM-dd"),
+                                    lambda params: self.show_as_of(worker, params), self.show_error)
+        self.as_of_worker = worker
+
+    def show_as_of(self, worker, params):
+        if worker is self.as_of_worker:
+            self.as_of_worker = None
+            self.query, self.params = queries.BRANCH_BALANCE_AS_OF, params
+            super().load_data()
+
+class ValuationDialog(ReportDialog):
+    # Remaining stock valued FIFO at the cost of the acquisitions it came from
+    title = "Inventory Valuation"
+    headers = queries.REPORTS['valuation']['headers']
+    query = queries.REPORTS['valuation']['query']
+    keys = queries.REPORTS['valuation']['keys']
+    width = 900
+
+class CategoryValuationDialog(ReportDialog):
+    title = "Valuation by Category"
+    headers = queries.REPORTS['category-valuation']['headers']
+    query = queries.REPORTS['category-valuation']['query']
+    keys = queries.REPORTS['category-valuation']['keys']
+
+class HistoryReportDialog(ReportDialog):
+    # History reports page through the ledger with keyset pagination
+    # (queries.history_query); the filter bar and header sorting are applied
+    # in SQL, so only the rows on screen are ever read.
+    history = ""
+    type_label = "Type"
+
+    def create_model(self):
+        return KeysetTableModel(self.headers, self)
+
+    def add_filters(self, layout):
+        filter_layout = QHBoxLayout()
+        self.date_check = QCheckBox("From")
+        filter_layout.addWidget(self.date_check)
+        self.from_edit = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.from_edit.setCalendarPopup(True)
+        filter_layout.addWidget(self.from_edit)
+        filter_layout.addWidget(QLabel("To"))
+        self.to_edit = QDateEdit(QDate.currentDate())
+        self.to_edit.setCalendarPopup(True)
+        filter_layout.addWidget(self.to_edit)
+        self.branch_combo = QComboBox()
+        self.branch_combo.addItem("All branches", None)
+        for branch_id, name in sorted(refdata.get(self.db).branches, key=lambda row: row[1]):
+            self.branch_combo.addItem(name, branch_id)
+        filter_layout.addWidget(self.branch_combo)
+        self.item_edit = ItemSearchEdit(self, self.db, placeholder="All items")
+        filter_layout.addWidget(self.item_edit)
+        self.type_combo = QComboBox()
+        self.type_combo.addItem(f"All ({self.type_label})", None)
+        # The types in use are looked up off the GUI thread and added when found
+        self.types_worker = fetch_in_background(self.db, queries.HISTORY[self.history]['types'], (), self.add_types)
+        filter_layout.addWidget(self.type_combo)
+        apply_btn = QPushButton("Apply")
+        apply_btn.clicked.connect(self.load_data)
+        filter_layout.addWidget(apply_btn)
+        layout.addLayout(filter_layout)
+
+    def add_types(self, rows):
+        self.types_worker = None
+        for (value,) in rows:
+            self.type_combo.addItem(value, value)
+
+    def done(self, result):
+        if self.types_worker is not None:
+            self.types_worker.cancel()
+            self.types_worker = None
+        super().done(result)
 
     def init_ui(self):
-        layout = QVBoxLayout()
-        self.table = QTableWidget()
-        self.table.setStyleSheet("QTableWidget { border: 1px solid #ccc; gridline-color: #ddd; } QHeaderView::section { background-color: #f0f0f0; border: 1px solid #ccc; }")
-        layout.addWidget(self.table)
-        button_layout = QHBoxLayout()
-        export_btn = QPushButton("Export to CSV")
-        export_btn.clicked.connect(self.export_csv)
-        button_layout.addWidget(export_btn)
-        close_btn = QPushButton("Close")
-        close_btn.clicked.connect(self.accept)
-        button_layout.addWidget(close_btn)
-        layout.addLayout(button_layout)
-        self.setLayout(layout)
+        super().init_ui()
+        # Newest first by default; clicking a header re-sorts in SQL
+        history = queries.HISTORY[self.history]
+        self.table.horizontalHeader().setSortIndicator(history['sort'].index(history['date']), Qt.DescendingOrder)
+        self.table.setSortingEnabled(True)
+
+    def filters(self):
+        filters = {
+            'branch_id': self.branch_combo.currentData(),
+            'item_id': self.item_edit.item_id(),
+            'type': self.type_combo.currentData(),
+        }
+        if self.date_check.isChecked():
+            filters['date_from'] = self.from_edit.date().toString("yyyy-MM-dd")
+            filters['date_to'] = self.to_edit.date().toString("yyyy-MM-dd")
+        return filters
 
     def load_data(self):
-        data = self.db.fetch_all("""
-            SELECT at.transaction_date, at.transaction_type, fb.branch_name as from_branch, tb.branch_name as to_branch,
-                   i.item_name, at.quantity, at.authority_ref, at.remarks
-            FROM asset_transactions at
-            LEFT JOIN branches fb ON at.from_branch_id = fb.branch_id
-            LEFT JOIN branches tb ON at.to_branch_id = tb.branch_id
-            JOIN asset_batches ab ON at.batch_id = ab.batch_id
-            JOIN items i ON ab.item_id = i.item_id
-            ORDER BY at.transaction_date DESC
-        """)
-        self.table.setRowCount(len(data))
-        self.table.setColumnCount(8)
-        self.table.setHorizontalHeaderLabels(["Date", "Type", "From Branch", "To Branch", "Item", "Quantity", "Authority", "Remarks"])
-        for row, (dt, typ, fb, tb, it, qty, auth, rem) in enumerate(data):
-            self.table.setItem(row, 0, QTableWidgetItem(dt))
-            self.table.setItem(row, 1, QTableWidgetItem(typ))
-            self.table.setItem(row, 2, QTableWidgetItem(fb or ""))
-            self.table.setItem(row, 3, QTableWidgetItem(tb or ""))
-            self.table.setItem(row, 4, QTableWidgetItem(it))
-            self.table.setItem(row, 5, QTableWidgetItem(str(qty)))
-            self.table.setItem(row, 6, QTableWidgetItem(auth or ""))
-            self.table.setItem(row, 7, QTableWidgetItem(rem or ""))
+        filters = self.filters()
+        self.model.set_pager(self.db, lambda after, column, descending: queries.history_query(
+            self.history, filters, column, descending, after, self.model.chunk_size))
 
     def export_csv(self):
-        import csv
-        from PySide6.QtWidgets import QFileDialog
-        filename, _ = QFileDialog.getSaveFileName(self, "Save CSV", "", "CSV Files (*.csv)")
-        if filename:
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                headers = ["Date", "Type", "From Branch", "To Branch", "Item", "Quantity", "Authority", "Remarks"]
-                writer.writerow(headers)
-                for row in range(self.table.rowCount()):
-                    row_data = []
-                    for col in range(self.table.columnCount()):
-                        item = self.table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    writer.writerow(row_data)
-            QMessageBox.information(self, "Export", "Data exported to CSV successfully.")
\ No newline at end of file
+        # Exports the filtered, sorted history, not just the loaded pages
+        query, params = queries.history_query(self.history, self.filters(), self.model.sort_column, self.model.descending, keys=False)
+        self.export_worker = start_export(self, self.db, query, self.headers, params)
+
+class DisposalReportDialog(HistoryReportDialog):
+    title = "Disposal Report"
+    headers = queries.REPORTS['disposals']['headers']
+    history = 'disposals'
+    type_label = "Method"
+
+class AcquisitionHistoryDialog(HistoryReportDialog):
+    title = "Acquisition History"
+    headers = queries.REPORTS['acquisitions']['headers']
+    history = 'acquisitions'
+    type_label = "Method"
+
+class TransactionHistoryDialog(HistoryReportDialog):
+    title = "Transaction History"
+    headers = queries.REPORTS['transactions']['headers']
+    history = 'transactions'
+    width = 1100
\ No newline at end of file
@@ -1,6 +1,9 @@
+import sqlite3
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton, QLineEdit, QLabel, QMessageBox, QInputDialog, QComboBox, QFormLayout, QDialogButtonBox
 from PySide6.QtCore import Qt
 from db import Database
+import masterdata
+import refdata
 from models import SubCategory
 
 class SubCategoriesDialog(QDialog):
@@ -40,23 +43,22 @@ class SubCategoriesDialog(QDialog):
 
     def load_subcategories(self):
         self.list_widget.clear()
-        subcats = self.db.fetch_all("""
-            SELECT sc.subcategory_id, sc.subcategory_name, c.category_name
-            FROM sub_categories sc
-            JOIN categories c ON sc.category_id = c.category_id
-        """)
-        for sub in subcats:
+        for sub in refdata.get(self.db).all_subcategories():
             self.list_widget.addItem(f"{sub[0]}: {sub[1]} ({sub[2]})")
 
     def get_categories(self):
-        return self.db.fetch_all("SELECT category_id, category_name FROM categories")
+        return refdata.get(self.db).categories
 
     def add_subcategory(self):
         dialog = SubCategoryEditDialog(self)
         if dialog.exec() == QDialog.Accepted:
             sub = dialog.get_subcategory()
-            query = "INSERT INTO sub_categories (category_id, subcategory_name, remarks) VALUES (?, ?, ?)"
-            self.db.execute_query(query, (sub.category_id, sub.subcategory_name, sub.remarks))
+            try:
+                masterdata.create(self.db, 'sub-categories', {'category_id': sub.category_id, 'subcategory_name': sub.subcategory_name,
+                                                              'remarks': sub.remarks})
+            except (sqlite3.Error, ValueError) as e:
+                QMessageBox.critical(self, "Error", f"Sub-category could not be saved: {e}")
+                return
             self.load_subcategories()
 
     def edit_subcategory(self):
@@ -70,8 +72,12 @@ class SubCategoriesDialog(QDialog):
             dialog = SubCategoryEditDialog(self, sub_data)
             if dialog.exec() == QDialog.Accepted:
                 sub = dialog.get_subcategory()
-                query = "UPDATE sub_categories SET category_id = ?, subcategory_name = ?, remarks = ? WHERE subcategory_id = ?"
-                self.db.execute_query(query, (sub.category_id, sub.subcategory_name, sub.remarks, sub_id))
+                try:
+                    masterdata.update(self.db, 'sub-categories', sub_id, {'category_id': sub.category_id,
+                                                                          'subcategory_name': sub.subcategory_name, 'remarks': sub.remarks})
+                except (sqlite3.Error, LookupError, ValueError) as e:
+                    QMessageBox.critical(self, "Error", f"Sub-category could not be saved: {e}")
+                    return
                 self.load_subcategories()
 
     def delete_subcategory(self):
@@ -87,7 +93,11 @@ class SubCategoriesDialog(QDialog):
             if count > 0:
                 QMessageBox.warning(self, "Warning", "Cannot delete sub-category that has items.")
                 return
-            self.db.execute_query("DELETE FROM sub_categories WHERE subcategory_id = ?", (sub_id,))
+            try:
+                masterdata.delete(self.db, 'sub-categories', sub_id)
+            except (sqlite3.Error, LookupError) as e:
+                QMessageBox.critical(self, "Error", f"Sub-category could not be deleted: {e}")
+                return
             self.load_subcategories()
 
 class SubCategoryEditDialog(QDialog):
@@ -104,8 +114,7 @@ class SubCategoryEditDialog(QDialog):
         form_layout = QFormLayout()
 
         self.cat_combo = QComboBox()
-        cats = self.db.fetch_all("SELECT category_id, category_name FROM categories")
-        for cat in cats:
+        for cat in refdata.get(self.db).categories:
             self.cat_combo.addItem(cat[1], cat[0])
         form_layout.addRow("Category*:", self.cat_combo)
 
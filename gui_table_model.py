@@ -0,0 +1,222 @@
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, Signal
+from gui_workers import QueryWorker, query_pool
+import queries
+
+def insertion_point(rows, value, sort_key):
+    # bisect.bisect over sort_key(row), without the key= argument that only
+    # arrived in Python 3.10
+    low, high = 0, len(rows)
+    while low < high:
+        middle = (low + high) // 2
+        if value < sort_key(rows[middle]):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+class QueryTableModel(QAbstractTableModel):
+    # Read-only model over a report query, read a page at a time with keyset
+    # pagination (queries.keyset_page). Rows are kept as plain tuples. Each
+    # page is a short query of its own on a pool thread (gui_workers.
+    # QueryWorker), started as the view scrolls (canFetchMore / fetchMore), so
+    # no pool thread or read snapshot is held between pages and neither a
+    # large report nor a slow query blocks the event loop. With a cache
+    # (report_cache.ReportCache), complete results are stored under the
+    # database's data version and shown straight from memory next time.
+    loading_changed = Signal(bool)
+    failed = Signal(str)
+
+    def __init__(self, headers, parent=None, chunk_size=500, cache=None):
+        super().__init__(parent)
+        self.headers = list(headers)
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.cache_key = None
+        self.cache_version = None
+        self.from_cache = False
+        self.rows = []
+        self.worker = None
+        self.generation = 0
+        self.pending = False
+        self.db = None
+        self.query = None
+        self.params = ()
+        self.keys = ()
+        self.exhausted = True
+
+    def set_query(self, db, query, params=(), keys=()):
+        # keys: the output columns of query that order it and identify a row
+        self.cancel()
+        self.db = db
+        self.query, self.params, self.keys = query, params, tuple(keys)
+        self.from_cache = False
+        if self.cache is not None:
+            self.cache_key = self.cache.key(db.db_name, query, params)
+            self.cache_version = db.data_version()
+            rows = self.cache.get(self.cache_key, self.cache_version)
+            if rows is not None:
+                self.beginResetModel()
+                self.rows = list(rows)
+                self.endResetModel()
+                self.exhausted = True
+                self.from_cache = True
+                self.loading_changed.emit(False)
+                return
+        self.reload()
+
+    def page_query(self, after):
+        return queries.keyset_page(self.query, self.params, self.keys, after, self.chunk_size)
+
+    def key_width(self):
+        # How many trailing columns of a row form its page key
+        return len(self.keys)
+
+    def sort_key(self, row):
+        return tuple(row[len(row) - self.key_width():])
+
+    def reload(self):
+        self.cancel()
+        self.beginResetModel()
+        self.rows = []
+        self.endResetModel()
+        self.exhausted = False
+        self.fetch_page()
+
+    def fetch_page(self):
+        self.generation += 1
+        after = self.sort_key(self.rows[-1]) if self.rows else None
+        query, params = self.page_query(after)
+        # One chunk larger than a page, so a full page is also the last chunk
+        self.worker = QueryWorker(self.generation, self.db.db_name, query, params, self.chunk_size + 1)
+        self.worker.signals.chunk.connect(self.on_chunk)
+        self.worker.signals.done.connect(self.on_done)
+        self.worker.signals.failed.connect(self.on_failed)
+        self.set_pending(True)
+        query_pool.start(self.worker)
+
+    def cancel(self):
+        # Drops the running request; late chunks from it are ignored.
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+        self.generation += 1
+        self.set_pending(False)
+
+    def set_pending(self, pending):
+        if pending != self.pending:
+            self.pending = pending
+            self.loading_changed.emit(pending)
+
+    def is_loading(self):
+        return self.pending
+
+    def is_complete(self):
+        # True once the whole result has been loaded into rows
+        return self.exhausted and not self.pending
+
+    def patch_rows(self, key, keys, rows):
+        # Replaces the rows whose key(row) is in keys with `rows`, which come
+        # from a page_query-shaped query: rows still present are updated in
+        # place, vanished ones removed and new ones inserted at their page key
+        # position. New rows past the last page loaded are left for the pages
+        # still to come. Only valid while no page is loading.
+        fresh = {key(row): row for row in rows}
+        for index in reversed(range(len(self.rows))):
+            row_key = key(self.rows[index])
+            if row_key not in keys:
+                continue
+            if row_key in fresh:
+                self.rows[index] = fresh.pop(row_key)
+                self.dataChanged.emit(self.index(index, 0), self.index(index, len(self.headers) - 1))
+            else:
+                self.beginRemoveRows(QModelIndex(), index, index)
+                del self.rows[index]
+                self.endRemoveRows()
+        last = self.sort_key(self.rows[-1]) if self.rows and not self.exhausted else None
+        for row in fresh.values():
+            if last is not None and self.sort_key(row) > last:
+                continue
+            index = insertion_point(self.rows, self.sort_key(row), self.sort_key)
+            self.beginInsertRows(QModelIndex(), index, index)
+            self.rows.insert(index, row)
+            self.endInsertRows()
+
+    def on_chunk(self, generation, chunk):
+        if generation != self.generation:
+            return
+        if len(chunk) < self.chunk_size:
+            self.exhausted = True
+        if chunk:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(chunk) - 1)
+            self.rows.extend(chunk)
+            self.endInsertRows()
+        self.set_pending(False)
+
+    def on_done(self, generation):
+        if generation == self.generation:
+            self.worker = None
+            if self.cache is not None and self.exhausted:
+                self.cache.put(self.cache_key, self.cache_version, self.rows)
+
+    def on_failed(self, generation, message):
+        if generation == self.generation:
+            self.worker = None
+            self.exhausted = True
+            self.set_pending(False)
+            self.failed.emit(message)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        value = self.rows[index.row()][index.column()]
+        return "" if value is None else str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.db is not None and not self.exhausted and not self.pending
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.fetch_page()
+
+class KeysetTableModel(QueryTableModel):
+    # Pages through a result whose SQL builds its own keyset pages:
+    # page(after, sort_column, descending) returns the SQL and parameters of
+    # the next page_size rows after the key `after` (None for the first page).
+    # Each row ends with its sort value and id, which form the key for the
+    # following page. Sorting from the header re-queries.
+    def __init__(self, headers, parent=None, page_size=500):
+        super().__init__(headers, parent, chunk_size=page_size)
+        self.page = None
+        self.sort_column = None
+        self.descending = True
+
+    def set_pager(self, db, page):
+        self.db = db
+        self.page = page
+        self.reload()
+
+    def page_query(self, after):
+        return self.page(after, self.sort_column, self.descending)
+
+    def key_width(self):
+        return 2
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.descending = order == Qt.DescendingOrder
+        if self.page is not None:
+            self.reload()
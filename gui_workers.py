@@ -0,0 +1,235 @@
+import threading
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from PySide6.QtWidgets import QFileDialog, QInputDialog, QMessageBox, QProgressDialog
+from db import Database
+import checkpoints
+import export
+import importer
+
+# Report queries get their own pool so long-running exports cannot starve them.
+query_pool = QThreadPool()
+query_pool.setMaxThreadCount(8)
+
+class QuerySignals(QObject):
+    chunk = Signal(int, object)
+    done = Signal(int)
+    failed = Signal(int, str)
+
+class QueryWorker(QRunnable):
+    # Runs a read query on a pool thread and streams the whole result back in
+    # chunks, then closes its cursor; models page with keyset queries rather
+    # than keep one open. Every signal carries the generation it was started
+    # with, letting the receiver drop chunks from requests it has since
+    # replaced.
+    def __init__(self, generation, db_name, query, params=(), chunk_size=500):
+        super().__init__()
+        self.generation = generation
+        self.db_name = db_name
+        self.query = query
+        self.params = params
+        self.chunk_size = chunk_size
+        self.signals = QuerySignals()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        cursor = None
+        try:
+            cursor = Database(self.db_name).connect().execute(self.query, self.params)
+            while not self.cancel_event.is_set():
+                chunk = cursor.fetchmany(self.chunk_size)
+                if self.cancel_event.is_set():
+                    break
+                self.signals.chunk.emit(self.generation, chunk)
+                if len(chunk) < self.chunk_size:
+                    self.signals.done.emit(self.generation)
+                    break
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+def fetch_in_background(db, query, params, on_rows, on_failed=None):
+    # Collects the full result off the GUI thread and calls on_rows(rows) on
+    # the GUI thread. Returns the worker so the caller can cancel() it.
+    rows = []
+    worker = QueryWorker(0, db.db_name, query, params)
+    worker.signals.chunk.connect(lambda generation, chunk: rows.extend(chunk))
+    worker.signals.done.connect(lambda generation: on_rows(rows))
+    if on_failed:
+        worker.signals.failed.connect(lambda generation, message: on_failed(message))
+    query_pool.start(worker)
+    return worker
+
+class TaskSignals(QObject):
+    done = Signal(object)
+    failed = Signal(str)
+
+class TaskWorker(QRunnable):
+    # Runs fn() on a pool thread and hands its result back on the GUI thread.
+    # fn must open its own Database(db_name) rather than use the GUI's.
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            result = self.fn()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.done.emit(result)
+
+def run_in_background(fn, on_done, on_failed=None):
+    worker = TaskWorker(fn)
+    worker.signals.done.connect(on_done)
+    if on_failed:
+        worker.signals.failed.connect(on_failed)
+    query_pool.start(worker)
+    return worker
+
+def fetch_as_of_params(db, as_of, on_params, on_failed=None):
+    # Builds any missing balance checkpoints off the GUI thread, then calls
+    # on_params with the parameters for the *_AS_OF queries.
+    db_name = db.db_name
+    return run_in_background(lambda: checkpoints.as_of_params(Database(db_name), as_of), on_params, on_failed)
+
+class ExportSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(int)
+    failed = Signal(str)
+    cancelled = Signal()
+
+class ExportWorker(QRunnable):
+    # Runs export.export_query on a pool thread. The worker thread opens its
+    # own connection through Database, so the GUI connection is never shared.
+    def __init__(self, db_name, query, headers, filename, params=()):
+        super().__init__()
+        self.db_name = db_name
+        self.query = query
+        self.headers = headers
+        self.filename = filename
+        self.params = params
+        self.signals = ExportSignals()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            count = export.export_query(Database(self.db_name), self.query, self.headers, self.filename, self.params,
+                                        progress=self.signals.progress.emit, is_cancelled=self.cancel_event.is_set)
+        except export.ExportCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(count)
+
+def start_export(parent, db, query, headers, params=()):
+    # Asks for a file, then streams the query to it in the background with a
+    # cancellable progress dialog. Returns the worker, or None if no file chosen.
+    filename, _ = QFileDialog.getSaveFileName(parent, "Export", "", "CSV Files (*.csv);;Gzip CSV Files (*.csv.gz);;JSON Lines (*.jsonl)")
+    if not filename:
+        return None
+    progress = QProgressDialog("Exporting...", "Cancel", 0, 0, parent)
+    progress.setWindowTitle("Export")
+    progress.setMinimumDuration(500)
+    worker = ExportWorker(db.db_name, query, headers, filename, params)
+    progress.canceled.connect(worker.cancel)
+    worker.signals.progress.connect(lambda count: progress.setLabelText(f"Exported {count} rows..."))
+    worker.signals.finished.connect(lambda count: (progress.reset(), QMessageBox.information(parent, "Export", f"Exported {count} rows successfully.")))
+    worker.signals.failed.connect(lambda message: (progress.reset(), QMessageBox.critical(parent, "Export", f"Export failed: {message}")))
+    worker.signals.cancelled.connect(progress.reset)
+    QThreadPool.globalInstance().start(worker)
+    return worker
+
+class ImportSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(int, int)
+    failed = Signal(str)
+    cancelled = Signal()
+
+class ImportWorker(QRunnable):
+    # Runs importer.import_acquisitions on a pool thread with its own connection
+    def __init__(self, db_name, filename, errors_filename):
+        super().__init__()
+        self.db_name = db_name
+        self.filename = filename
+        self.errors_filename = errors_filename
+        self.signals = ImportSignals()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            imported, rejected = importer.import_acquisitions(Database(self.db_name), self.filename, self.errors_filename,
+                                                              progress=self.signals.progress.emit, is_cancelled=self.cancel_event.is_set)
+        except importer.ImportCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(imported, rejected)
+
+def start_import(parent, db, on_finished):
+    # Asks for a CSV file and imports it in the background with a cancellable
+    # progress dialog; on_finished() runs after the import ends either way, as
+    # the chunks committed before a failure or cancellation stay imported.
+    filename, _ = QFileDialog.getOpenFileName(parent, "Import Acquisitions", "", "CSV Files (*.csv)")
+    if not filename:
+        return None
+    errors_filename = importer.error_filename(filename)
+    progress = QProgressDialog("Importing...", "Cancel", 0, 0, parent)
+    progress.setWindowTitle("Import")
+    progress.setMinimumDuration(500)
+    worker = ImportWorker(db.db_name, filename, errors_filename)
+    progress.canceled.connect(worker.cancel)
+    worker.signals.progress.connect(lambda count: progress.setLabelText(f"Read {count} rows..."))
+    def finished(imported, rejected):
+        progress.reset()
+        on_finished()
+        if rejected:
+            QMessageBox.warning(parent, "Import", f"Imported {imported} rows. {rejected} rows were rejected; see {errors_filename}.")
+        else:
+            QMessageBox.information(parent, "Import", f"Imported {imported} rows successfully.")
+    worker.signals.finished.connect(finished)
+    worker.signals.failed.connect(lambda message: (progress.reset(), on_finished(), QMessageBox.critical(parent, "Import", f"Import failed: {message}")))
+    worker.signals.cancelled.connect(lambda: (progress.reset(), on_finished()))
+    QThreadPool.globalInstance().start(worker)
+    return worker
+
+def start_master_data_import(parent, db, on_finished):
+    # Asks for a CSV (and which kind of records it holds) or JSON file and
+    # upserts it in one background transaction, then reports the counts.
+    filename, _ = QFileDialog.getOpenFileName(parent, "Import Master Data", "", "CSV or JSON Files (*.csv *.json)")
+    if not filename:
+        return None
+    kind = None
+    if not filename.lower().endswith('.json'):
+        labels = {"Categories": 'categories', "Sub-Categories": 'sub_categories', "Branches": 'branches', "Items": 'items'}
+        label, ok = QInputDialog.getItem(parent, "Import Master Data", "The file holds:", list(labels), 0, False)
+        if not ok:
+            return None
+        kind = labels[label]
+    db_name = db.db_name
+    def load():
+        return importer.upsert_master_data(Database(db_name), importer.read_master_data(filename, kind))
+    def done(result):
+        counts, problems = result
+        on_finished()
+        summary = "\n".join(f"{name}: {count['inserted']} inserted, {count['updated']} updated, {count['rejected']} rejected"
+                             for name, count in counts.items())
+        if problems:
+            details = "\n".join(f"{name} record {number}: {reason}" for name, number, reason in problems[:10])
+            QMessageBox.warning(parent, "Import", f"{summary}\n\n{details}")
+        else:
+            QMessageBox.information(parent, "Import", summary)
+    return run_in_background(load, done, lambda message: QMessageBox.critical(parent, "Import", f"Import failed: {message}"))
@@ -0,0 +1,301 @@
+import csv
+import itertools
+import json
+import math
+import os
+from datetime import date
+import refdata
+
+# Streams CSV files into the database one chunk at a time: rows are read,
+# resolved and validated in memory, the valid ones of each chunk are written
+# with one executemany inside one transaction, and rejected rows go to an
+# error file with the reason, so memory use stays flat however long the file.
+
+class ImportCancelled(Exception):
+    pass
+
+def column_name(header):
+    # "Acquisition Date" -> "acquisition_date"
+    return "_".join(header.strip().lower().split())
+
+def error_filename(filename):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.errors{ext or '.csv'}"
+
+def read_chunks(reader, chunk_size):
+    while True:
+        chunk = list(itertools.islice(reader, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+class ItemLookup:
+    # item_id by property code and by name; a name shared by several items
+    # only resolves together with its code. Codes match exactly, as they do
+    # in the UNIQUE column and upsert_master_data; names ignore case.
+    def __init__(self, db):
+        self.by_code = {}
+        self.by_name = {}
+        for item_id, name, code in db.connect().execute("SELECT item_id, item_name, govt_property_code FROM items"):
+            if code:
+                self.by_code[code.strip()] = item_id
+            key = name.strip().lower()
+            self.by_name[key] = None if key in self.by_name else item_id
+
+    def resolve(self, name, code):
+        if code:
+            item_id = self.by_code.get(code.strip())
+            if item_id is None:
+                raise ValueError(f"unknown property code {code!r}")
+            return item_id
+        if not name:
+            raise ValueError("item or govt_property_code is required")
+        key = name.strip().lower()
+        if key not in self.by_name:
+            raise ValueError(f"unknown item {name!r}")
+        if self.by_name[key] is None:
+            raise ValueError(f"item name {name!r} is shared by several items; give its govt_property_code")
+        return self.by_name[key]
+
+def iso_date(name, value):
+    # value if it is a YYYY-MM-DD date; raises ValueError naming the field.
+    # Dates are compared as text, so only the zero-padded form will do.
+    if isinstance(value, str):
+        try:
+            if date.fromisoformat(value).isoformat() == value:
+                return value
+        except ValueError:
+            pass
+    raise ValueError(f"{name} {value!r} is not a YYYY-MM-DD date")
+
+def acquisition_row(row, items, store_id):
+    # asset_batches values for one CSV row; raises ValueError with the reason
+    item_id = items.resolve(row.get("item"), row.get("govt_property_code"))
+    acquired = iso_date("acquisition_date", (row.get("acquisition_date") or "").strip())
+    method = (row.get("acquisition_method") or "").strip()
+    if not method:
+        raise ValueError("acquisition_method is required")
+    year = (row.get("acquisition_year") or "").strip()
+    if not year:
+        raise ValueError("acquisition_year is required")
+    try:
+        quantity = int(row.get("quantity") or "")
+    except ValueError:
+        raise ValueError(f"quantity {row.get('quantity')!r} is not a whole number")
+    if quantity <= 0:
+        raise ValueError("quantity must be positive")
+    try:
+        cost = float(row.get("cost") or 0)
+    except ValueError:
+        raise ValueError(f"cost {row.get('cost')!r} is not a number")
+    if not math.isfinite(cost):
+        raise ValueError(f"cost {row.get('cost')!r} is not a number")
+    if cost < 0:
+        raise ValueError("cost cannot be negative")
+    return (item_id, store_id, acquired, method, row.get("source") or "", quantity, cost,
+            row.get("authority_ref") or "", row.get("remarks") or "", year)
+
+# asset_batches columns of an acquisition, in the order acquisition_row() gives them
+ACQUISITION_COLUMNS = ('item_id', 'branch_id', 'acquisition_date', 'acquisition_method', 'source', 'quantity', 'cost',
+                       'authority_ref', 'remarks', 'acquisition_year')
+
+def add_acquisitions(db, batches):
+    # Inserts the batches (tuples of ACQUISITION_COLUMNS) in one transaction
+    remote = db.remote()
+    if remote is not None:
+        remote.call("POST", "/acquisitions", [dict(zip(ACQUISITION_COLUMNS, batch)) for batch in batches])
+        return
+    with db.transaction():
+        db.execute_many(f"""INSERT INTO asset_batches ({', '.join(ACQUISITION_COLUMNS)})
+                            VALUES ({', '.join('?' * len(ACQUISITION_COLUMNS))})""", batches)
+
+def import_acquisitions(db, filename, errors_filename=None, chunk_size=5000, progress=None, is_cancelled=None):
+    # Imports acquisitions into Store. Returns (imported, rejected); rejected
+    # rows are written to errors_filename (default <file>.errors.csv), which
+    # is removed again if every row was valid. Chunks committed before a
+    # cancellation stay imported.
+    store_id = refdata.get(db).store_id
+    if store_id is None:
+        raise ValueError("Store branch not found.")
+    items = ItemLookup(db)
+    errors_filename = errors_filename or error_filename(filename)
+    imported = rejected = 0
+    with open(filename, newline='', encoding='utf-8-sig') as source:
+        reader = csv.reader(source)
+        headers = next(reader, None)
+        if not headers:
+            raise ValueError(f"{filename} is empty.")
+        columns = [column_name(header) for header in headers]
+        missing = {"acquisition_date", "acquisition_method", "quantity", "acquisition_year"} - set(columns)
+        if missing or not {"item", "govt_property_code"} & set(columns):
+            raise ValueError(f"{filename} needs the columns {', '.join(sorted(missing) or ['item or govt_property_code'])}.")
+        # the error file is only created once the header is known to be usable
+        with open(errors_filename, 'w', newline='', encoding='utf-8') as errors:
+            error_writer = csv.writer(errors)
+            error_writer.writerow(headers + ["error"])
+            line = 1
+            for chunk in read_chunks(reader, chunk_size):
+                if is_cancelled and is_cancelled():
+                    raise ImportCancelled()
+                batches = []
+                for values in chunk:
+                    line += 1
+                    try:
+                        batches.append(acquisition_row(dict(zip(columns, values)), items, store_id))
+                    except ValueError as e:
+                        error_writer.writerow(values + [f"line {line}: {e}"])
+                        rejected += 1
+                if batches:
+                    add_acquisitions(db, batches)
+                imported += len(batches)
+                if progress:
+                    progress(imported + rejected)
+    if not rejected:
+        os.remove(errors_filename)
+    return imported, rejected
+
+# Master data, loaded parents first. CSV files hold one kind each; a JSON
+# file holds either a list of records of one kind or an object with a list
+# per kind, e.g. {"categories": [...], "sub_categories": [...], "items": [...]}.
+MASTER_DATA = ('categories', 'sub_categories', 'branches', 'items')
+
+UPSERT_CATEGORY = """
+    INSERT INTO categories (category_name, remarks) VALUES (?, ?)
+    ON CONFLICT (category_name) DO UPDATE SET remarks = COALESCE(excluded.remarks, remarks)
+"""
+
+UPSERT_BRANCH = """
+    INSERT INTO branches (branch_name, address, remarks) VALUES (?, ?, ?)
+    ON CONFLICT (branch_name) DO UPDATE SET address = COALESCE(excluded.address, address), remarks = COALESCE(excluded.remarks, remarks)
+"""
+
+UPSERT_ITEM = """
+    INSERT INTO items (item_name, category_id, subcategory_id, specification, govt_property_code, remarks) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (govt_property_code) DO UPDATE SET
+        item_name = excluded.item_name, category_id = excluded.category_id, subcategory_id = excluded.subcategory_id,
+        specification = COALESCE(excluded.specification, specification), remarks = COALESCE(excluded.remarks, remarks)
+"""
+
+def read_master_data(filename, kind=None):
+    # {kind: [record, ...]} with the record keys normalised by column_name()
+    if filename.lower().endswith('.json'):
+        with open(filename, encoding='utf-8') as source:
+            data = json.load(source)
+        if isinstance(data, list):
+            if not kind:
+                raise ValueError(f"{filename} is a list of records; say which kind they are.")
+            data = {kind: data}
+    else:
+        if not kind:
+            raise ValueError(f"Say which kind of records {filename} holds.")
+        with open(filename, newline='', encoding='utf-8-sig') as source:
+            data = {kind: list(csv.DictReader(source))}
+    unknown = set(data) - set(MASTER_DATA)
+    if unknown:
+        raise ValueError(f"Unknown master data: {', '.join(sorted(unknown))}.")
+    return {name: [{column_name(key): value for key, value in record.items() if key is not None} for record in records]
+            for name, records in data.items()}
+
+def field_text(record, key):
+    value = record.get(key)
+    value = "" if value is None else str(value).strip()
+    return value or None
+
+def upsert_master_data(db, records):
+    # Inserts or updates every record in one transaction, matching
+    # categories and branches by name, sub-categories by category and name
+    # and items by govt_property_code (exactly, as ItemLookup does); an
+    # item's category and sub-category are resolved by name. Returns
+    # ({kind: {'inserted', 'updated', 'rejected'}}, [(kind, record number,
+    # reason)]).
+    remote = db.remote()
+    if remote is not None:
+        reply = remote.call("POST", "/master-data", records)
+        return reply['counts'], [tuple(problem) for problem in reply['problems']]
+    counts = {kind: {'inserted': 0, 'updated': 0, 'rejected': 0} for kind in MASTER_DATA if kind in records}
+    problems = []
+
+    def reject(kind, number, reason):
+        counts[kind]['rejected'] += 1
+        problems.append((kind, number, reason))
+
+    def count(kind, existing, name):
+        # Names match case-insensitively and keep the spelling already stored
+        counts[kind]['updated' if name.lower() in existing else 'inserted'] += 1
+        return existing.setdefault(name.lower(), name)
+
+    with db.transaction():
+        category_rows = "SELECT category_id, category_name FROM categories"
+        rows = []
+        existing = {name.lower(): name for _, name in db.fetch_all(category_rows)}
+        for number, record in enumerate(records.get('categories', []), 1):
+            name = field_text(record, 'category_name')
+            if not name:
+                reject('categories', number, "category_name is required")
+                continue
+            rows.append((count('categories', existing, name), field_text(record, 'remarks')))
+        if rows:
+            db.execute_many(UPSERT_CATEGORY, rows)
+        categories = {name.lower(): category_id for category_id, name in db.fetch_all(category_rows)}
+
+        # sub_categories has no unique key, so existing ones are matched here
+        subcategory_rows = "SELECT subcategory_id, category_id, subcategory_name FROM sub_categories"
+        subcategories = {(category_id, name.lower()): subcategory_id for subcategory_id, category_id, name in db.fetch_all(subcategory_rows)}
+        inserts, updates = {}, []
+        for number, record in enumerate(records.get('sub_categories', []), 1):
+            category, name = field_text(record, 'category_name'), field_text(record, 'subcategory_name')
+            if not category or not name:
+                reject('sub_categories', number, "category_name and subcategory_name are required")
+                continue
+            if category.lower() not in categories:
+                reject('sub_categories', number, f"unknown category {category!r}")
+                continue
+            key = (categories[category.lower()], name.lower())
+            if key in subcategories:
+                counts['sub_categories']['updated'] += 1
+                updates.append((field_text(record, 'remarks'), subcategories[key]))
+            elif key in inserts:
+                counts['sub_categories']['updated'] += 1
+                inserts[key] = (key[0], name, field_text(record, 'remarks') or inserts[key][2])
+            else:
+                counts['sub_categories']['inserted'] += 1
+                inserts[key] = (key[0], name, field_text(record, 'remarks'))
+        if inserts:
+            db.execute_many("INSERT INTO sub_categories (category_id, subcategory_name, remarks) VALUES (?, ?, ?)", list(inserts.values()))
+            subcategories = {(category_id, name.lower()): subcategory_id for subcategory_id, category_id, name in db.fetch_all(subcategory_rows)}
+        if updates:
+            db.execute_many("UPDATE sub_categories SET remarks = COALESCE(?, remarks) WHERE subcategory_id = ?", updates)
+
+        rows = []
+        existing = {name.lower(): name for (name,) in db.fetch_all("SELECT branch_name FROM branches")}
+        for number, record in enumerate(records.get('branches', []), 1):
+            name = field_text(record, 'branch_name')
+            if not name:
+                reject('branches', number, "branch_name is required")
+                continue
+            rows.append((count('branches', existing, name), field_text(record, 'address'), field_text(record, 'remarks')))
+        if rows:
+            db.execute_many(UPSERT_BRANCH, rows)
+
+        rows = []
+        existing = {code for (code,) in db.fetch_all("SELECT govt_property_code FROM items WHERE govt_property_code IS NOT NULL")}
+        for number, record in enumerate(records.get('items', []), 1):
+            name, code = field_text(record, 'item_name'), field_text(record, 'govt_property_code')
+            category, subcategory = field_text(record, 'category_name'), field_text(record, 'subcategory_name')
+            if not name or not code or not category or not subcategory:
+                reject('items', number, "item_name, govt_property_code, category_name and subcategory_name are required")
+                continue
+            category_id = categories.get(category.lower())
+            if category_id is None:
+                reject('items', number, f"unknown category {category!r}")
+                continue
+            subcategory_id = subcategories.get((category_id, subcategory.lower()))
+            if subcategory_id is None:
+                reject('items', number, f"no sub-category {subcategory!r} in {category!r}")
+                continue
+            counts['items']['updated' if code in existing else 'inserted'] += 1
+            existing.add(code)
+            rows.append((name, category_id, subcategory_id, field_text(record, 'specification'), code, field_text(record, 'remarks')))
+        if rows:
+            db.execute_many(UPSERT_ITEM, rows)
+    return counts, problems
@@ -1,9 +1,23 @@
 from gui import MainWindow
+import argparse
 import sys
 from PySide6.QtWidgets import QApplication
+from db import Database
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
+def main(argv=None):
+    # The GUI entry point; gui.py runs this too. Qt options pass through.
+    parser = argparse.ArgumentParser(description="Assets and Inventory Management System")
+    parser.add_argument("--server", metavar="URL", help="work through an AIMS server (python -m aims serve; its token from AIMS_TOKEN) instead of the local file")
+    args, qt_args = parser.parse_known_args(argv)
+    Database.server_url = args.server
+    app = QApplication(sys.argv[:1] + qt_args)
     window = MainWindow()
+    if args.server:
+        window.setWindowTitle(f"{window.windowTitle()} - {args.server}")
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    exit_code = app.exec()
+    Database.close_all()
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,69 @@
+import sqlite3
+import refdata
+
+# Adding, editing and deleting master data, shared by the master data dialogs
+# and the server's /master operations. In client mode (Database.server_url)
+# every change is sent to the server, which makes it with these same
+# functions on its own connection.
+
+# kind: (table, key column, writable columns, required columns)
+MASTER_TABLES = {
+    'categories': ('categories', 'category_id', ('category_name', 'remarks'), ('category_name',)),
+    'sub-categories': ('sub_categories', 'subcategory_id', ('category_id', 'subcategory_name', 'remarks'),
+                       ('category_id', 'subcategory_name')),
+    'branches': ('branches', 'branch_id', ('branch_name', 'address', 'remarks'), ('branch_name',)),
+    'items': ('items', 'item_id', ('item_name', 'category_id', 'subcategory_id', 'specification', 'govt_property_code', 'remarks'),
+              ('item_name', 'category_id', 'subcategory_id')),
+}
+
+# The same checks the master data dialogs make before deleting
+IN_USE = {
+    'categories': ("SELECT COUNT(*) FROM sub_categories WHERE category_id = :id", "Cannot delete category that has subcategories."),
+    'sub-categories': ("SELECT COUNT(*) FROM items WHERE subcategory_id = :id", "Cannot delete sub-category that has items."),
+    'branches': ("""SELECT (SELECT COUNT(*) FROM asset_batches WHERE branch_id = :id)
+                         + (SELECT COUNT(*) FROM asset_transactions WHERE from_branch_id = :id OR to_branch_id = :id)""",
+                 "Cannot delete branch that has associated assets or transactions."),
+    'items': ("SELECT COUNT(*) FROM asset_batches WHERE item_id = :id", "Cannot delete item that has asset batches."),
+}
+
+def create(db, kind, values):
+    # Inserts one row of values {column: value}; returns its id
+    table, key = MASTER_TABLES[kind][:2]
+    remote = db.remote()
+    if remote is not None:
+        return remote.call("POST", f"/master/{kind}", values)[key]
+    with db.transaction():
+        if kind == 'items' and not values.get('govt_property_code') and db.fetch_one("SELECT COUNT(*) FROM items")[0]:
+            raise ValueError("Govt Property Code is required for additional items.")
+        names = list(values)
+        return db.execute_query(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                                [values[name] for name in names])
+
+def update(db, kind, row_id, values):
+    # Raises LookupError if there is no such row
+    table, key = MASTER_TABLES[kind][:2]
+    remote = db.remote()
+    if remote is not None:
+        remote.call("PUT", f"/master/{kind}/{row_id}", values)
+        return
+    with db.transaction():
+        cursor = db.connect().execute(f"UPDATE {table} SET {', '.join(f'{name} = ?' for name in values)} WHERE {key} = ?",
+                                      list(values.values()) + [row_id])
+        if not cursor.rowcount:
+            raise LookupError(f"No {kind} {row_id}.")
+
+def delete(db, kind, row_id):
+    # Raises sqlite3.IntegrityError, leaving the row, while anything uses it
+    table, key = MASTER_TABLES[kind][:2]
+    remote = db.remote()
+    if remote is not None:
+        remote.call("DELETE", f"/master/{kind}/{row_id}")
+        return
+    in_use, message = IN_USE[kind]
+    with db.transaction():
+        if kind == 'branches' and row_id == refdata.get(db).store_id:
+            raise sqlite3.IntegrityError("Cannot delete the Store branch.")
+        if db.fetch_one(in_use, {'id': row_id})[0]:
+            raise sqlite3.IntegrityError(message)
+        if not db.connect().execute(f"DELETE FROM {table} WHERE {key} = ?", (row_id,)).rowcount:
+            raise LookupError(f"No {kind} {row_id}.")
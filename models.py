@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Optional, Set, Tuple
 
 @dataclass
 class Category:
@@ -72,4 +72,9 @@ class User:
     user_id: Optional[int] = None
     username: str = ""
     password_hash: str = ""
-    role: str = ""
\ No newline at end of file
+    role: str = ""
+
+@dataclass
+class StockChange:
+    # (item_id, branch_id, acquisition_year) balance keys touched by a write
+    keys: Set[Tuple[int, int, Optional[str]]] = field(default_factory=set)
\ No newline at end of file
@@ -0,0 +1,117 @@
+import numpy as np
+from db import Database
+import refdata
+
+# Category / sub-category / item x branch pivot of remaining quantity and
+# value. Balance facts are read once into NumPy arrays with the dimensions
+# coded as dense integers; the cube for every level is then computed with
+# bincount group-bys, so rolling up, drilling down and slicing are array
+# operations that do not touch the database again.
+
+LEVELS = ('category', 'subcategory', 'item')
+MEASURES = ('quantity', 'value')
+
+FACTS = """
+    SELECT bb.item_id, bb.branch_id, bb.balance, COALESCE(ab.cost, 0)
+    FROM batch_balances bb
+    JOIN asset_batches ab ON bb.batch_id = ab.batch_id
+    WHERE bb.balance != 0
+"""
+
+def _codes(ids):
+    # Lookup array mapping an id to its position in ids (-1 if absent)
+    lookup = np.full(int(ids.max()) + 1 if len(ids) else 1, -1, dtype=np.int64)
+    lookup[ids] = np.arange(len(ids))
+    return lookup
+
+def _lookup(codes, ids):
+    inside = (ids >= 0) & (ids < len(codes))
+    return np.where(inside, codes[np.clip(ids, 0, len(codes) - 1)], -1)
+
+def _roll_up(cube, codes, groups):
+    # Sums the rows of cube into `groups` rows by code, one bincount for all columns
+    columns = cube.shape[1]
+    index = (codes[:, None] * columns + np.arange(columns)).ravel()
+    return np.bincount(index, weights=cube.ravel(), minlength=groups * columns).reshape(groups, columns)
+
+class PivotCube:
+    def __init__(self, db=None):
+        self.db = db or Database()
+        self.load()
+
+    def load(self):
+        db = self.db
+        refs = refdata.get(db)
+        categories = sorted(refs.categories, key=lambda row: row[1])
+        subcategories = sorted(((subcategory_id, refs.subcategory_categories[subcategory_id], f"{category_name} / {name}")
+                                for subcategory_id, name, category_name in refs.all_subcategories() if category_name is not None),
+                               key=lambda row: row[2])
+        items = db.fetch_all("SELECT item_id, subcategory_id, item_name FROM items ORDER BY item_name")
+        branches = sorted(refs.branches, key=lambda row: row[1])
+
+        self.ids = {
+            'category': np.array([row[0] for row in categories], dtype=np.int64),
+            'subcategory': np.array([row[0] for row in subcategories], dtype=np.int64),
+            'item': np.array([row[0] for row in items], dtype=np.int64),
+        }
+        self.labels = {
+            'category': [row[1] for row in categories],
+            'subcategory': [row[2] for row in subcategories],
+            'item': [row[2] for row in items],
+        }
+        self.branch_ids = np.array([row[0] for row in branches], dtype=np.int64)
+        self.branch_labels = [row[1] for row in branches]
+        # Parent code of each row at the level below
+        self.parents = {
+            'subcategory': _lookup(_codes(self.ids['category']), np.array([row[1] for row in subcategories], dtype=np.int64)),
+            'item': _lookup(_codes(self.ids['subcategory']), np.array([row[1] for row in items], dtype=np.int64)),
+        }
+
+        facts = np.array(db.fetch_all(FACTS), dtype=np.float64).reshape(-1, 4)
+        item_codes = _lookup(_codes(self.ids['item']), facts[:, 0].astype(np.int64))
+        branch_codes = _lookup(_codes(self.branch_ids), facts[:, 1].astype(np.int64))
+        known = (item_codes >= 0) & (branch_codes >= 0)
+        item_codes, branch_codes, facts = item_codes[known], branch_codes[known], facts[known]
+
+        n_items, n_branches = len(self.ids['item']), len(self.branch_ids)
+        cell = item_codes * n_branches + branch_codes
+        self.cubes = {'item': {
+            'quantity': np.bincount(cell, weights=facts[:, 2], minlength=n_items * n_branches).reshape(n_items, n_branches),
+            'value': np.bincount(cell, weights=facts[:, 2] * facts[:, 3], minlength=n_items * n_branches).reshape(n_items, n_branches),
+        }}
+        # Roll items up to sub-categories and those up to categories; rows
+        # whose parent is missing are left out of the higher levels.
+        for level, child in (('subcategory', 'item'), ('category', 'subcategory')):
+            codes = self.parents[child]
+            known = codes >= 0
+            self.cubes[level] = {measure: _roll_up(cube[known], codes[known], len(self.ids[level]))
+                                 for measure, cube in self.cubes[child].items()}
+
+    def slice(self, level='category', measure='quantity', parent_id=None, include_empty=False):
+        # Rows at `level` (optionally only the children of one category or
+        # sub-category when drilling down) against every branch. Returns
+        # (row ids, row labels, branch labels, matrix).
+        matrix = self.cubes[level][measure]
+        rows = np.ones(len(matrix), dtype=bool)
+        if parent_id is not None:
+            parent_level = LEVELS[LEVELS.index(level) - 1]
+            parent_code = _lookup(_codes(self.ids[parent_level]), np.array([parent_id], dtype=np.int64))[0]
+            rows &= self.parents[level] == parent_code
+        if not include_empty:
+            rows &= matrix.any(axis=1)
+        selected = np.flatnonzero(rows)
+        return (self.ids[level][selected].tolist(), [self.labels[level][index] for index in selected],
+                list(self.branch_labels), matrix[selected])
+
+if __name__ == "__main__":
+    import sys
+    import time
+    start = time.perf_counter()
+    cube = PivotCube(Database(sys.argv[1]) if len(sys.argv) > 1 else None)
+    print(f"Loaded cube in {(time.perf_counter() - start) * 1000:.1f} ms")
+    start = time.perf_counter()
+    ids, labels, branches, matrix = cube.slice('category', 'value')
+    print(f"Sliced in {(time.perf_counter() - start) * 1000:.2f} ms")
+    print("Category," + ",".join(branches) + ",Total")
+    for label, row in zip(labels, matrix):
+        print(f"{label}," + ",".join(f"{value:.2f}" for value in row) + f",{row.sum():.2f}")
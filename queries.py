@@ -0,0 +1,605 @@
+import re
+import sys
+from db import Database
+
+# Balance engine: every item x branch x acquisition year balance in one
+# grouped pass over batch_balances (a covering index scan). The dashboard, the
+# Branch-wise Balance report and the transaction dialogs all select from it,
+# so they cannot disagree; filters on item/branch/year are pushed down into it.
+BALANCES = """
+    SELECT item_id, branch_id, acquisition_year, SUM(balance) as balance
+    FROM batch_balances
+    GROUP BY item_id, branch_id, acquisition_year
+"""
+
+# The same balances as of the end of day :as_of: the month-end checkpoint
+# :month plus the ledger movements dated from :start (the first day after
+# that month) up to :as_of. With no checkpoint, :month and :start are ''.
+# checkpoints.as_of_params() builds any missing checkpoints and the params.
+AS_OF_BALANCES = """
+    SELECT item_id, branch_id, acquisition_year, SUM(balance) as balance
+    FROM (
+        SELECT item_id, branch_id, acquisition_year, balance
+        FROM balance_checkpoints WHERE month = :month
+        UNION ALL
+        SELECT item_id, branch_id, acquisition_year, quantity
+        FROM asset_batches WHERE acquisition_date >= :start AND acquisition_date <= :as_of
+        UNION ALL
+        SELECT ab.item_id, ab.branch_id, ab.acquisition_year, -at.quantity
+        FROM asset_transactions at JOIN asset_batches ab ON at.batch_id = ab.batch_id
+        WHERE at.transaction_date >= :start AND at.transaction_date <= :as_of AND at.transaction_type IN ('Issue', 'Transfer', 'Return')
+        UNION ALL
+        SELECT ab.item_id, ab.branch_id, ab.acquisition_year, -ad.quantity
+        FROM asset_disposal ad JOIN asset_batches ab ON ad.batch_id = ab.batch_id
+        WHERE ad.disposal_date >= :start AND ad.disposal_date <= :as_of
+    )
+    GROUP BY item_id, branch_id, acquisition_year
+"""
+
+# Report queries
+
+def _stock_register_from(balances):
+    return f"""
+    FROM ({balances}) bal
+    JOIN items i ON bal.item_id = i.item_id
+    JOIN categories c ON i.category_id = c.category_id
+    JOIN sub_categories sc ON i.subcategory_id = sc.subcategory_id
+    JOIN branches b ON bal.branch_id = b.branch_id
+    WHERE bal.balance > 0
+"""
+
+STOCK_REGISTER_FROM = _stock_register_from(BALANCES)
+
+STOCK_REGISTER = f"""
+    SELECT c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year, bal.balance
+    {STOCK_REGISTER_FROM}
+    ORDER BY c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year
+"""
+
+# The dashboard shows the stock register with the item and branch ids appended
+# (not displayed), so that after a transaction it can re-query just the
+# (item_id, branch_id, acquisition_year) rows that changed.
+DASHBOARD = f"""
+    SELECT c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year, bal.balance,
+           bal.item_id, bal.branch_id
+    {STOCK_REGISTER_FROM}
+    ORDER BY c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year
+"""
+
+STOCK_REGISTER_AS_OF = f"""
+    SELECT c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year, bal.balance
+    {_stock_register_from(AS_OF_BALANCES)}
+    ORDER BY c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year
+"""
+
+DASHBOARD_AS_OF = f"""
+    SELECT c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year, bal.balance,
+           bal.item_id, bal.branch_id
+    {_stock_register_from(AS_OF_BALANCES)}
+    ORDER BY c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year
+"""
+
+# Output columns that order the dashboard and identify a row, for keyset
+# pagination (keyset_page)
+DASHBOARD_KEYS = ('category_name', 'subcategory_name', 'item_name', 'branch_name', 'acquisition_year', 'item_id', 'branch_id')
+
+# BALANCES for just the (item_id, branch_id, acquisition_year) keys in :keys,
+# a JSON array of [item_id, branch_id, year]
+CHANGED_BALANCES = """
+    SELECT bb.item_id, bb.branch_id, bb.acquisition_year, SUM(bb.balance) as balance
+    FROM json_each(:keys) changed
+    JOIN batch_balances bb ON bb.item_id = json_extract(changed.value, '$[0]') AND bb.branch_id = json_extract(changed.value, '$[1]')
+                          AND bb.acquisition_year IS json_extract(changed.value, '$[2]')
+    GROUP BY bb.item_id, bb.branch_id, bb.acquisition_year
+"""
+
+# Every dashboard row a transaction touched, re-queried in one read
+DASHBOARD_ROWS = f"""
+    SELECT c.category_name, sc.subcategory_name, i.item_name, b.branch_name, bal.acquisition_year, bal.balance,
+           bal.item_id, bal.branch_id
+    {_stock_register_from(CHANGED_BALANCES)}
+"""
+
+SUMMARY = """
+    SELECT i.item_name, SUM(ab.quantity) as acquired, SUM(bb.disposed) as disposed,
+           SUM(ab.quantity) - SUM(bb.disposed) as remaining, ab.item_id
+    FROM asset_batches ab
+    JOIN batch_balances bb ON ab.batch_id = bb.batch_id
+    JOIN items i ON ab.item_id = i.item_id
+    WHERE ab.acquisition_method NOT IN ('Issue', 'Return')
+    GROUP BY ab.item_id, i.item_name
+    HAVING remaining > 0
+"""
+
+def _branch_balance(balances):
+    return f"""
+    SELECT b.branch_name, i.item_name, SUM(bal.balance) as total_balance, b.branch_id, i.item_id
+    FROM ({balances}) bal
+    JOIN branches b ON bal.branch_id = b.branch_id
+    JOIN items i ON bal.item_id = i.item_id
+    GROUP BY b.branch_id, b.branch_name, i.item_id, i.item_name
+    HAVING total_balance > 0
+"""
+
+BRANCH_BALANCE = _branch_balance(BALANCES)
+BRANCH_BALANCE_AS_OF = _branch_balance(AS_OF_BALANCES)
+
+# FIFO valuation. Issues and returns consume the oldest batches first and
+# split them into derived batches (allocation.issue_return), so the units
+# left in a batch are valued at the cost of the acquisition at the root of
+# its source_batch_id chain. One recursive pass walks every chain from its
+# root; a derived batch whose chain is broken, or whose root has no cost,
+# keeps the cost copied onto it.
+BATCH_COSTS = """
+    WITH RECURSIVE lineage(batch_id, cost) AS (
+        SELECT ab.batch_id, ab.cost FROM asset_batches ab
+        WHERE ab.source_batch_id IS NULL OR NOT EXISTS (SELECT 1 FROM asset_batches src WHERE src.batch_id = ab.source_batch_id)
+        UNION ALL
+        SELECT ab.batch_id, COALESCE(lineage.cost, ab.cost)
+        FROM lineage JOIN asset_batches ab ON ab.source_batch_id = lineage.batch_id
+    )
+    SELECT batch_id, cost FROM lineage
+"""
+
+# batch_balances is searched by batch_id for each lineage row. The CROSS
+# JOIN keeps that order: with ANALYZE statistics SQLite would rather scan
+# batch_balances against an automatic index built over the whole lineage.
+VALUATION_BALANCES = f"""
+    SELECT bb.item_id, bb.branch_id, bb.acquisition_year, SUM(bb.balance) as balance,
+           SUM(bb.balance * COALESCE(bc.cost, 0)) as value
+    FROM ({BATCH_COSTS}) bc
+    CROSS JOIN batch_balances bb ON bb.batch_id = bc.batch_id
+    WHERE bb.balance != 0
+    GROUP BY bb.item_id, bb.branch_id, bb.acquisition_year
+"""
+
+VALUATION = f"""
+    SELECT c.category_name, i.item_name, b.branch_name, bal.acquisition_year, bal.balance, ROUND(bal.value, 2),
+           bal.item_id, bal.branch_id
+    {_stock_register_from(VALUATION_BALANCES)}
+    ORDER BY c.category_name, i.item_name, b.branch_name, bal.acquisition_year
+"""
+
+CATEGORY_VALUATION = f"""
+    SELECT c.category_name, b.branch_name, SUM(bal.balance), ROUND(SUM(bal.value), 2)
+    {_stock_register_from(VALUATION_BALANCES)}
+    GROUP BY c.category_id, b.branch_id
+    ORDER BY c.category_name, b.branch_name
+"""
+
+DISPOSAL_REPORT = """
+    SELECT i.item_name, ad.disposal_date, ad.quantity, ad.disposal_method, ad.authority_ref
+    FROM asset_disposal ad
+    JOIN asset_batches ab ON ad.batch_id = ab.batch_id
+    JOIN items i ON ab.item_id = i.item_id
+    ORDER BY ad.disposal_date DESC
+"""
+
+ACQUISITION_HISTORY = """
+    SELECT i.item_name, b.branch_name, ab.acquisition_date, ab.acquisition_year, ab.quantity, ab.acquisition_method, ab.source
+    FROM asset_batches ab
+    JOIN items i ON ab.item_id = i.item_id
+    JOIN branches b ON ab.branch_id = b.branch_id
+    WHERE ab.acquisition_method NOT IN ('Issue', 'Return')
+    ORDER BY ab.acquisition_date DESC
+"""
+
+TRANSACTION_HISTORY = """
+    SELECT at.transaction_date, at.transaction_type, fb.branch_name as from_branch, tb.branch_name as to_branch,
+           i.item_name, at.quantity, at.authority_ref, at.remarks
+    FROM asset_transactions at
+    LEFT JOIN branches fb ON at.from_branch_id = fb.branch_id
+    LEFT JOIN branches tb ON at.to_branch_id = tb.branch_id
+    JOIN asset_batches ab ON at.batch_id = ab.batch_id
+    JOIN items i ON ab.item_id = i.item_id
+    ORDER BY at.transaction_date DESC
+"""
+
+# Report definitions shared by the report dialogs and the command line
+# (aims.py): column headings, SQL, the output columns the date-range and
+# branch filters apply to, and for the reports the dialogs page through, the
+# output columns that order a report and identify a row (keyset_page). Output
+# columns past the headings only carry those keys and are not shown or
+# exported.
+REPORTS = {
+    'dashboard': {
+        'headers': ["Category", "Sub-Category", "Item", "Branch", "Acquisition Year", "Balance"],
+        'query': STOCK_REGISTER, 'as_of': STOCK_REGISTER_AS_OF, 'date': None, 'branch': ('branch_name',),
+    },
+    'stock-register': {
+        'headers': ["Item", "Acquired", "Disposed", "Remaining"],
+        'query': SUMMARY, 'date': None, 'branch': (), 'keys': ('item_id',),
+    },
+    'branch-balance': {
+        'headers': ["Branch", "Item", "Balance"],
+        'query': BRANCH_BALANCE, 'as_of': BRANCH_BALANCE_AS_OF, 'date': None, 'branch': ('branch_name',),
+        'keys': ('branch_id', 'item_id'),
+    },
+    'valuation': {
+        'headers': ["Category", "Item", "Branch", "Acquisition Year", "Quantity", "Value"],
+        'query': VALUATION, 'date': None, 'branch': ('branch_name',),
+        'keys': ('category_name', 'item_name', 'branch_name', 'acquisition_year', 'item_id', 'branch_id'),
+    },
+    'category-valuation': {
+        'headers': ["Category", "Branch", "Quantity", "Value"],
+        'query': CATEGORY_VALUATION, 'date': None, 'branch': ('branch_name',), 'keys': ('category_name', 'branch_name'),
+    },
+    'disposals': {
+        'headers': ["Item", "Date", "Quantity", "Method", "Authority"],
+        'query': DISPOSAL_REPORT, 'date': 'disposal_date', 'branch': (),
+    },
+    'acquisitions': {
+        'headers': ["Item", "Branch", "Date", "Acquisition Year", "Quantity", "Method", "Source"],
+        'query': ACQUISITION_HISTORY, 'date': 'acquisition_date', 'branch': ('branch_name',),
+    },
+    'transactions': {
+        'headers': ["Date", "Type", "From Branch", "To Branch", "Item", "Quantity", "Authority", "Remarks"],
+        'query': TRANSACTION_HISTORY, 'date': 'transaction_date', 'branch': ('from_branch', 'to_branch'),
+    },
+}
+
+def report_query(name, date_from=None, date_to=None, branch=None, as_of_params=None):
+    # The report's SQL and (named) parameters with the optional filters applied
+    # to its output columns; SQLite flattens the wrapper, so the filters still
+    # reach the indexes. as_of_params (checkpoints.as_of_params) selects the
+    # as-of variant of a balance report. Raises ValueError for a filter the
+    # report does not support.
+    report = REPORTS[name]
+    query = report['query']
+    conditions = []
+    params = {}
+    if as_of_params is not None:
+        if not report.get('as_of'):
+            raise ValueError(f"The {name} report has no as-of view.")
+        query = report['as_of']
+        params.update(as_of_params)
+    if date_from or date_to:
+        if not report['date']:
+            raise ValueError(f"The {name} report cannot be filtered by date.")
+        if date_from:
+            conditions.append(f"{report['date']} >= :date_from")
+            params['date_from'] = date_from
+        if date_to:
+            conditions.append(f"{report['date']} <= :date_to")
+            params['date_to'] = date_to
+    if branch:
+        if not report['branch']:
+            raise ValueError(f"The {name} report cannot be filtered by branch.")
+        conditions.append("(" + " OR ".join(f"{column} = :branch" for column in report['branch']) + ")")
+        params['branch'] = branch
+    if not conditions:
+        return query, params
+    return f"SELECT * FROM ({query}) WHERE {' AND '.join(conditions)}", params
+
+# Page forms of the reports keyed by ids that lead an index: the keyset
+# predicate ({after}) and the ORDER BY are on the key columns inside the
+# query, so a page seeks the index and reads only the batches of its own
+# rows. Each row ends with its keys, as keyset_page() returns them.
+SUMMARY_PAGE = """
+    SELECT i.item_name, SUM(ab.quantity) as acquired, SUM(bb.disposed) as disposed,
+           SUM(ab.quantity) - SUM(bb.disposed) as remaining, ab.item_id, ab.item_id
+    FROM asset_batches ab
+    JOIN batch_balances bb ON ab.batch_id = bb.batch_id
+    JOIN items i ON ab.item_id = i.item_id
+    WHERE ab.acquisition_method NOT IN ('Issue', 'Return') AND {after}
+    GROUP BY ab.item_id
+    HAVING remaining > 0
+    ORDER BY ab.item_id
+"""
+
+BRANCH_BALANCE_PAGE = """
+    SELECT b.branch_name, i.item_name, SUM(bb.balance) as total_balance, bb.branch_id, bb.item_id, bb.branch_id, bb.item_id
+    FROM batch_balances bb
+    JOIN branches b ON bb.branch_id = b.branch_id
+    JOIN items i ON bb.item_id = i.item_id
+    WHERE {after}
+    GROUP BY bb.branch_id, bb.item_id
+    HAVING total_balance > 0
+    ORDER BY bb.branch_id, bb.item_id
+"""
+
+# report query: (its page form, the key columns as named inside it)
+SEEK_PAGES = {
+    SUMMARY: (SUMMARY_PAGE, ('ab.item_id',)),
+    BRANCH_BALANCE: (BRANCH_BALANCE_PAGE, ('bb.branch_id', 'bb.item_id')),
+}
+
+def _after(columns, params, after):
+    # "(columns) > (after)" and params with the values of after added
+    if isinstance(params, dict):
+        names = [f"after_{number}" for number in range(len(columns))]
+        return f"({', '.join(columns)}) > ({', '.join(':' + name for name in names)})", {**params, **dict(zip(names, after))}
+    return f"({', '.join(columns)}) > ({', '.join('?' * len(columns))})", tuple(params) + tuple(after)
+
+def keyset_page(query, params, keys, after=None, limit=None):
+    # A page of a report query read with keyset pagination: keys names output
+    # columns of query that order it and together identify a row. Every row
+    # comes back with those keys appended (NULL as ''), and `after` - the
+    # appended keys of the previous page's last row - selects the rows that
+    # follow it instead of OFFSET, so each page is a query of its own.
+    #
+    # A query in SEEK_PAGES pages through its index. Any other is wrapped,
+    # which hides the indexes from the keys: every page of the dashboard, the
+    # valuations or an as-of view computes and sorts the whole report, whose
+    # rows are ordered by names, before it skips to `after`. A page then
+    # costs about as much as the full report; python benchmark.py paging
+    # times both.
+    if query in SEEK_PAGES:
+        page, columns = SEEK_PAGES[query]
+        condition = "1"
+        if after is not None:
+            condition, params = _after(columns, params, after)
+        query = page.format(after=condition)
+    else:
+        columns = [f"IFNULL({key}, '')" for key in keys]
+        condition = ""
+        if after is not None:
+            condition, params = _after(columns, params, after)
+            condition = f"WHERE {condition}"
+        query = f"SELECT *, {', '.join(columns)} FROM ({query}) {condition} ORDER BY {', '.join(columns)}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    return query, params
+
+def _distinct(column, table, where="1"):
+    # The distinct values of an indexed column in order, one index seek per
+    # value (a skip scan) instead of a read of every ledger row
+    return f"""
+    WITH RECURSIVE found(value) AS (
+        SELECT MIN({column}) FROM {table}
+        UNION ALL
+        SELECT (SELECT MIN({column}) FROM {table} WHERE {column} > found.value) FROM found WHERE found.value IS NOT NULL
+    )
+    SELECT value FROM found WHERE value IS NOT NULL AND {where}
+"""
+
+# History reports with filters, sorting and keyset pagination pushed into
+# SQL. 'sort' lists one NULL-free expression per displayed column; 'date',
+# 'branch', 'item' and 'type' are the columns the filters compare against.
+HISTORY = {
+    'disposals': {
+        'select': "i.item_name, ad.disposal_date, ad.quantity, ad.disposal_method, ad.authority_ref",
+        'from': """asset_disposal ad
+                  JOIN asset_batches ab ON ad.batch_id = ab.batch_id
+                  JOIN items i ON ab.item_id = i.item_id""",
+        'where': "1",
+        'id': "ad.disposal_id",
+        'sort': ["i.item_name", "ad.disposal_date", "ad.quantity", "ad.disposal_method", "IFNULL(ad.authority_ref, '')"],
+        'date': "ad.disposal_date", 'branch': ("ab.branch_id",), 'item': "ab.item_id", 'type': "ad.disposal_method",
+        'types': _distinct("disposal_method", "asset_disposal"),
+    },
+    'acquisitions': {
+        'select': "i.item_name, b.branch_name, ab.acquisition_date, ab.acquisition_year, ab.quantity, ab.acquisition_method, ab.source",
+        'from': """asset_batches ab
+                  JOIN items i ON ab.item_id = i.item_id
+                  JOIN branches b ON ab.branch_id = b.branch_id""",
+        'where': "ab.acquisition_method NOT IN ('Issue', 'Return')",
+        'id': "ab.batch_id",
+        'sort': ["i.item_name", "b.branch_name", "ab.acquisition_date", "IFNULL(ab.acquisition_year, '')", "ab.quantity",
+                 "ab.acquisition_method", "IFNULL(ab.source, '')"],
+        'date': "ab.acquisition_date", 'branch': ("ab.branch_id",), 'item': "ab.item_id", 'type': "ab.acquisition_method",
+        'types': _distinct("acquisition_method", "asset_batches", "value NOT IN ('Issue', 'Return')"),
+    },
+    'transactions': {
+        'select': "at.transaction_date, at.transaction_type, fb.branch_name, tb.branch_name, i.item_name, at.quantity, at.authority_ref, at.remarks",
+        'from': """asset_transactions at
+                  LEFT JOIN branches fb ON at.from_branch_id = fb.branch_id
+                  LEFT JOIN branches tb ON at.to_branch_id = tb.branch_id
+                  JOIN asset_batches ab ON at.batch_id = ab.batch_id
+                  JOIN items i ON ab.item_id = i.item_id""",
+        'where': "1",
+        'id': "at.transaction_id",
+        'sort': ["at.transaction_date", "at.transaction_type", "IFNULL(fb.branch_name, '')", "IFNULL(tb.branch_name, '')", "i.item_name",
+                 "at.quantity", "IFNULL(at.authority_ref, '')", "IFNULL(at.remarks, '')"],
+        'date': "at.transaction_date", 'branch': ("at.from_branch_id", "at.to_branch_id"), 'item': "ab.item_id", 'type': "at.transaction_type",
+        'types': _distinct("transaction_type", "asset_transactions"),
+    },
+}
+
+def history_query(name, filters=None, sort_column=None, descending=True, after=None, limit=None, keys=True):
+    # SQL and parameters for a history report. filters may hold date_from,
+    # date_to, branch_id, item_id and type; sort_column indexes the displayed
+    # columns (default: the date). With keys=True every row ends with its sort
+    # value and id, and `after` - such a pair from the previous page - selects
+    # the next page by keyset comparison instead of OFFSET.
+    history = HISTORY[name]
+    filters = filters or {}
+    sort = history['sort'][sort_column] if sort_column is not None else history['date']
+    conditions = [history['where']]
+    params = []
+    if filters.get('date_from'):
+        conditions.append(f"{history['date']} >= ?")
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        conditions.append(f"{history['date']} <= ?")
+        params.append(filters['date_to'])
+    if filters.get('branch_id'):
+        conditions.append("(" + " OR ".join(f"{column} = ?" for column in history['branch']) + ")")
+        params.extend([filters['branch_id']] * len(history['branch']))
+    if filters.get('item_id'):
+        conditions.append(f"{history['item']} = ?")
+        params.append(filters['item_id'])
+    if filters.get('type'):
+        conditions.append(f"{history['type']} = ?")
+        params.append(filters['type'])
+    if after is not None:
+        conditions.append(f"({sort}, {history['id']}) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+    direction = "DESC" if descending else "ASC"
+    query = f"""
+        SELECT {history['select']}{f", {sort}, {history['id']}" if keys else ""}
+        FROM {history['from']}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {sort} {direction}, {history['id']} {direction}
+    """
+    if limit is not None:
+        query += f"LIMIT {int(limit)}"
+    return query, tuple(params)
+
+# Balance key (item_id, branch_id, acquisition_year) of a batch
+BATCH_KEY = "SELECT item_id, branch_id, acquisition_year FROM batch_balances WHERE batch_id = ?"
+
+# Issue/Return queries
+
+ISSUE_AVAILABLE_YEARS = f"""
+    SELECT acquisition_year, balance
+    FROM ({BALANCES})
+    WHERE item_id = ? AND branch_id = ? AND balance > 0
+    ORDER BY acquisition_year
+"""
+
+BATCH_AVAILABLE = "SELECT balance FROM batch_balances WHERE batch_id = ?"
+
+# FIFO split of :quantity over the batches of one item/branch/year in a single
+# query: each batch takes what is left after the older batches' running total.
+FIFO_SPLIT = """
+    SELECT batch_id, cost, MIN(balance, :quantity - (running - balance)) as take
+    FROM (
+        SELECT bb.batch_id, bb.balance, ab.cost,
+               SUM(bb.balance) OVER (ORDER BY bb.batch_id) as running
+        FROM batch_balances bb
+        JOIN asset_batches ab ON bb.batch_id = ab.batch_id
+        WHERE bb.item_id = :item_id AND bb.branch_id = :branch_id AND bb.acquisition_year IS :year AND bb.balance > 0
+    )
+    WHERE running - balance < :quantity
+    ORDER BY batch_id
+"""
+
+# Type-ahead item search over the items_fts index, best matches first: a
+# hit in the name counts for more than one in the property code, and that
+# for more than one in the specification. Only the first 500 matches are
+# ranked, so a one- or two-letter prefix matching most items still answers
+# in a few milliseconds; the ranking is exact once the user has typed
+# enough to narrow the matches below that.
+ITEM_SEARCH = """
+    SELECT i.item_id, i.item_name, i.govt_property_code
+    FROM (
+        SELECT rowid, bm25(items_fts, 10.0, 1.0, 5.0) as score
+        FROM items_fts
+        WHERE items_fts MATCH :match
+        LIMIT 500
+    ) hit
+    JOIN items i ON i.item_id = hit.rowid
+    ORDER BY hit.score, i.item_name
+    LIMIT :limit
+"""
+
+def item_match(text):
+    # FTS5 query for what the user typed: every word has to be the start of a
+    # word in the name, specification or code. None if nothing searchable.
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words) or None
+
+# Store batches with stock left for a set of items (:items is a JSON array
+# of item ids), oldest first within each item and year: the whole FIFO
+# picture a bulk issue voucher is validated and split against.
+STORE_BATCHES = """
+    SELECT bb.batch_id, bb.item_id, bb.acquisition_year, bb.balance, ab.cost
+    FROM json_each(:items) requested
+    JOIN batch_balances bb ON bb.item_id = requested.value AND bb.branch_id = :branch_id AND bb.balance > 0
+    JOIN asset_batches ab ON bb.batch_id = ab.batch_id
+    ORDER BY bb.item_id, bb.acquisition_year, bb.batch_id
+"""
+
+# Disposal queries
+
+DISPOSAL_STORE_STOCK = """
+    SELECT bb.item_id, i.item_name, bb.acquisition_year, SUM(bb.balance) as balance
+    FROM batch_balances bb
+    JOIN items i ON bb.item_id = i.item_id
+    WHERE bb.branch_id = (SELECT branch_id FROM branches WHERE branch_name = 'Store')
+    GROUP BY bb.item_id, bb.acquisition_year
+    HAVING SUM(bb.balance) > 0
+    ORDER BY i.item_name, bb.acquisition_year
+"""
+
+# Queries checked by check_query_plans(), with sample parameters.
+CHECKED_QUERIES = {
+    'BALANCES': (BALANCES, ()),
+    'AS_OF_BALANCES': (AS_OF_BALANCES, {'month': '2024-05', 'start': '2024-06-01', 'as_of': '2024-06-15'}),
+    'STOCK_REGISTER': (STOCK_REGISTER, ()),
+    'DASHBOARD': (DASHBOARD, ()),
+    'DASHBOARD_ROWS': (DASHBOARD_ROWS, {'keys': '[[1, 1, "2024"], [2, 1, null]]'}),
+    'BATCH_KEY': (BATCH_KEY, (1,)),
+    'SUMMARY': (SUMMARY, ()),
+    'BRANCH_BALANCE': (BRANCH_BALANCE, ()),
+    'VALUATION': (VALUATION, ()),
+    'CATEGORY_VALUATION': (CATEGORY_VALUATION, ()),
+    'DISPOSAL_REPORT': (DISPOSAL_REPORT, ()),
+    'ACQUISITION_HISTORY': (ACQUISITION_HISTORY, ()),
+    'TRANSACTION_HISTORY': (TRANSACTION_HISTORY, ()),
+    'ISSUE_AVAILABLE_YEARS': (ISSUE_AVAILABLE_YEARS, (1, 1)),
+    'BATCH_AVAILABLE': (BATCH_AVAILABLE, (1,)),
+    'FIFO_SPLIT': (FIFO_SPLIT, {'item_id': 1, 'branch_id': 1, 'year': '2024', 'quantity': 5}),
+    'ITEM_SEARCH': (ITEM_SEARCH, {'match': '"lap"*', 'limit': 20}),
+    'STORE_BATCHES': (STORE_BATCHES, {'items': '[1, 2, 3]', 'branch_id': 1}),
+    'DISPOSAL_STORE_STOCK': (DISPOSAL_STORE_STOCK, ()),
+}
+
+for name in HISTORY:
+    CHECKED_QUERIES[f'{name.upper()}_PAGE'] = history_query(name, after=('2024-01-01', 1), limit=500)
+    CHECKED_QUERIES[f'{name.upper()}_TYPES'] = (HISTORY[name]['types'], ())
+
+CHECKED_QUERIES['SUMMARY_PAGE'] = keyset_page(SUMMARY, (), REPORTS['stock-register']['keys'], (1,), 500)
+CHECKED_QUERIES['BRANCH_BALANCE_PAGE'] = keyset_page(BRANCH_BALANCE, (), REPORTS['branch-balance']['keys'], (1, 1), 500)
+
+# Master tables (and the aliases the queries give them) may be scanned;
+# every other table must be read through an index.
+SCAN_ALLOWED_TABLES = {'categories', 'c', 'sub_categories', 'sc', 'branches', 'b', 'fb', 'tb', 'items', 'i'}
+
+# Whole-ledger reports, unfiltered in CHECKED_QUERIES, have to read every row
+# of these tables (by plan alias); any other ledger read must be a SEARCH.
+FULL_READS = {
+    'BALANCES': {'batch_balances'},
+    'STOCK_REGISTER': {'batch_balances'},
+    'DASHBOARD': {'batch_balances'},
+    'BRANCH_BALANCE': {'batch_balances'},
+    'SUMMARY': {'ab'},
+    'VALUATION': {'ab'},
+    'CATEGORY_VALUATION': {'ab'},
+    'DISPOSAL_REPORT': {'ad'},
+    'ACQUISITION_HISTORY': {'ab'},
+    'TRANSACTION_HISTORY': {'at'},
+}
+
+def full_table_scans(db, query, params=(), full_reads=()):
+    # Plan details look like "SCAN ab", "SCAN ab USING COVERING INDEX ..." or
+    # "SEARCH ab USING INDEX ... (col=?)". Only a SEARCH narrows the read: a
+    # SCAN through an index still visits every row, so any SCAN of a ledger
+    # table not in full_reads fails, as does an AUTOMATIC index SQLite had to
+    # build over a materialized aggregate. "SCAN x VIRTUAL TABLE INDEX ..." is
+    # a full-text lookup or a json_each parameter list, not a table; "SCAN
+    # (subquery-N)" and "SCAN <alias>" of a MATERIALIZEd subquery or a
+    # CO-ROUTINE (such as a recursive CTE) walk a result whose own plan
+    # lines are checked too.
+    scans = []
+    materialized = set()
+    for row in db.fetch_all("EXPLAIN QUERY PLAN " + query, params):
+        detail = row[-1]
+        if detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+            materialized.add(detail.split()[1])
+        elif detail.startswith("SCAN ") and " VIRTUAL TABLE " not in detail:
+            name = detail.split()[1]
+            if (not name.startswith("(") and name not in SCAN_ALLOWED_TABLES and name not in materialized
+                    and name not in full_reads):
+                scans.append(detail)
+        elif "AUTOMATIC" in detail:
+            scans.append(detail)
+    return scans
+
+def check_query_plans(db=None):
+    # Returns {query name: [offending plan lines]} for queries that scan a table.
+    db = db or Database(':memory:')
+    failures = {}
+    for name, (query, params) in CHECKED_QUERIES.items():
+        scans = full_table_scans(db, query, params, FULL_READS.get(name, ()))
+        if scans:
+            failures[name] = scans
+    return failures
+
+if __name__ == "__main__":
+    failures = check_query_plans(Database(sys.argv[1]) if len(sys.argv) > 1 else None)
+    for name, scans in failures.items():
+        print(f"{name}: {'; '.join(scans)}")
+    print("Query plans OK." if not failures else f"{len(failures)} queries fall back to full table scans.")
+    sys.exit(1 if failures else 0)
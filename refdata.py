@@ -0,0 +1,69 @@
+import threading
+from db import Database
+
+# Shared in-process copy of the small master tables (categories,
+# sub-categories, branches) that the dialogs keep looking up. It is loaded
+# once per database file and only reloaded after master data changed: when
+# Database.data_version() shows the file was written, the trigger-maintained
+# master_data_version counter is read to see whether the write touched them.
+
+STORE = 'Store'
+
+class ReferenceData:
+    # Rows are (id, name) tuples in id order, as the dialogs list them
+    def __init__(self, db, version):
+        self.version = version
+        self.categories = db.fetch_all("SELECT category_id, category_name FROM categories ORDER BY category_id")
+        self.category_names = dict(self.categories)
+        self.subcategory_names = {}
+        self.subcategories_by_category = {}
+        for subcategory_id, category_id, name in db.fetch_all(
+                "SELECT subcategory_id, category_id, subcategory_name FROM sub_categories ORDER BY subcategory_id"):
+            self.subcategory_names[subcategory_id] = name
+            self.subcategories_by_category.setdefault(category_id, []).append((subcategory_id, name))
+        self.subcategory_categories = {subcategory_id: category_id
+                                       for category_id, rows in self.subcategories_by_category.items()
+                                       for subcategory_id, _ in rows}
+        self.branches = db.fetch_all("SELECT branch_id, branch_name FROM branches ORDER BY branch_id")
+        self.branch_names = dict(self.branches)
+        self.branch_ids = {name: branch_id for branch_id, name in self.branches}
+        self.store_id = self.branch_ids.get(STORE)
+
+    def subcategories(self, category_id):
+        return self.subcategories_by_category.get(category_id, [])
+
+    def all_subcategories(self):
+        # (id, name, category name) for every sub-category
+        return [(subcategory_id, self.subcategory_names[subcategory_id], self.category_names.get(category_id))
+                for subcategory_id, category_id in sorted(self.subcategory_categories.items())]
+
+    def branches_except_store(self):
+        return [row for row in self.branches if row[0] != self.store_id]
+
+class Registry:
+    def __init__(self):
+        self.entries = {}
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    def get(self, db=None):
+        db = db or Database()
+        data_version = db.data_version()
+        with self._lock:
+            entry = self.entries.get(db.db_name)
+        if entry is not None and entry[0] == data_version:
+            return entry[1]
+        version = db.fetch_one("SELECT version FROM master_data_version")[0]
+        if entry is not None and entry[1].version == version:
+            data = entry[1]
+        else:
+            data = ReferenceData(db, version)
+            self.loads += 1
+        with self._lock:
+            self.entries[db.db_name] = (data_version, data)
+        return data
+
+registry = Registry()
+
+def get(db=None):
+    return registry.get(db)
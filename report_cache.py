@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+# In-memory cache of complete report results. Entries are keyed on the
+# database file, the query and its parameters, and are only returned while
+# Database.data_version() still matches the version they were stored under.
+# Memory is bounded by a total row budget with least-recently-used eviction.
+
+class ReportCache:
+    def __init__(self, max_rows=200000):
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(db_name, query, params=()):
+        if isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        return (db_name, query, tuple(params))
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, version, rows):
+        # Results larger than the whole budget are not cached.
+        rows = tuple(rows)
+        if len(rows) > self.max_rows:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (version, rows)
+            self.rows += len(rows)
+            while self.rows > self.max_rows:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        version, rows = self.entries.pop(key)
+        self.rows -= len(rows)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.rows = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'rows': self.rows,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+# Shared by the report dialogs and the dashboard
+report_cache = ReportCache()
@@ -0,0 +1,571 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+from db import Database
+import allocation
+import checkpoints
+import importer
+import masterdata
+import queries
+
+# HTTP/JSON service over one database file, run on the machine that holds
+# it so clerks elsewhere never open the file over a network share. Reads run
+# on a pool of threads, each with its own query_only connection; every write
+# runs on a single writer thread, one at a time, so writers never contend for
+# the file lock. Writes are only the named operations below. A GUI in client
+# mode (python main.py --server http://host:8765) sends its writes to them
+# and its reads to /query, which runs a single read-only SELECT on a pooled
+# connection and returns the rows a page at a time, keeping the rest under a
+# cursor id.
+#
+# With AIMS_TOKEN set in the environment every request but /health must
+# carry "Authorization: Bearer <token>"; the server refuses to listen on
+# anything but a loopback address without one.
+#
+#   AIMS_TOKEN=<secret> python -m aims serve [--host 0.0.0.0] [--port 8765] [--readers 4]
+#
+#   GET  /master/<kind>                   kind: categories, sub-categories, branches, items
+#   POST /master/<kind>                   create; PUT or DELETE /master/<kind>/<id>
+#   POST /master-data                     bulk upsert, {"items": [...], ...}
+#   POST /acquisitions                    one acquisition, or a list of them
+#   POST /issue-return                    allocation.issue_return arguments
+#   POST /vouchers                        {"lines": [{item_id, acquisition_year, branch_id, quantity}], ...}
+#   POST /disposals                       {"lines": [{item_id, acquisition_year, quantity}], ...}
+#   POST /as-of                           {"as_of": "YYYY-MM-DD"}: parameters for the *_AS_OF queries
+#   GET  /reports/<name>?from=&to=&branch=&as_of=
+#   POST /query                           {"sql", "params", "size"}: {"rows", "cursor"}
+#   POST /query/<cursor>                  {"size"}: the next rows; DELETE /query/<cursor> drops the rest
+#   GET  /data-version                    a number that changes whenever the data may have changed
+
+KEEP_ALIVE = 120
+# A /query cursor left unread this long is closed, ending its read snapshot
+QUERY_TIMEOUT = 60
+# /query cursors open at once, each holding one of the QueryPool's connections
+MAX_QUERIES = 64
+QUERY_PAGE = 500
+MAX_QUERY_PAGE = 5000
+
+# What a /query statement may do: read tables and call functions. ATTACH,
+# PRAGMA, transactions, DDL and every kind of write are refused.
+QUERY_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# The statements FTS5 runs itself when a query opens items_fts: declaring the
+# table and checking its config is current. query_only still stops any write.
+FTS5_ACTIONS = {(sqlite3.SQLITE_UPDATE, 'sqlite_master'), (sqlite3.SQLITE_PRAGMA, 'data_version')}
+
+ACQUISITION_REQUIRED = ('item_id', 'branch_id', 'acquisition_date', 'acquisition_method', 'quantity', 'acquisition_year')
+ISSUE_RETURN_FIELDS = ('transaction_type', 'item_id', 'branch_id', 'acquisition_year', 'quantity', 'transaction_date',
+                       'authority_ref', 'remarks', 'dry_run')
+
+class HTTPError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+def fields(body, allowed, required=()):
+    if not isinstance(body, dict):
+        raise HTTPError(400, "Expected a JSON object.")
+    unknown = set(body) - set(allowed)
+    if unknown:
+        raise HTTPError(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+    missing = [name for name in required if body.get(name) in (None, "")]
+    if missing:
+        raise HTTPError(400, f"Required: {', '.join(missing)}.")
+    return body
+
+# Checks on the values of a write body; each raises a 400 naming the field,
+# as acquisition_row() does for an imported row
+def whole_number(values, name):
+    value = values.get(name)
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise HTTPError(400, f"{name} must be a positive whole number, got {value!r}.")
+    return value
+
+def text(values, name):
+    value = values.get(name)
+    if value is not None and not isinstance(value, str):
+        raise HTTPError(400, f"{name} must be text, got {value!r}.")
+    return value
+
+def iso_date(values, name):
+    try:
+        return importer.iso_date(name, values.get(name))
+    except ValueError as e:
+        raise HTTPError(400, f"{e}.")
+
+def cost(values):
+    value = values.get('cost')
+    if value is None:
+        return value
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+        raise HTTPError(400, f"cost must be a number, got {value!r}.")
+    if value < 0:
+        raise HTTPError(400, "cost cannot be negative.")
+    return value
+
+def records(cursor):
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def page_size(body):
+    size = body.get('size', QUERY_PAGE)
+    if not isinstance(size, int) or size <= 0:
+        raise HTTPError(400, "size must be a positive whole number.")
+    return min(size, MAX_QUERY_PAGE)
+
+def read_only(action, name, *args):
+    allowed = action in QUERY_ACTIONS or (action, name) in FTS5_ACTIONS
+    return sqlite3.SQLITE_OK if allowed else sqlite3.SQLITE_DENY
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class QueryPool:
+    # The connections /query cursors run on, at most size of them: query_only,
+    # with the read_only authorizer installed when each is opened. A cursor
+    # takes one for its lifetime and gives it back when closed, so the next
+    # query reuses it and its statement cache. They are separate from the
+    # readers' own connections, so the read snapshot a cursor holds while the
+    # client pages never makes reports or dry runs see stale data.
+    def __init__(self, db_name, size):
+        self.db_name = db_name
+        self.size = size
+        self.idle = []
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def full(self):
+        with self.lock:
+            return not self.idle and self.opened >= self.size
+
+    def take(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            if self.opened >= self.size:
+                raise HTTPError(503, "Too many queries are open; try again.")
+            self.opened += 1
+        try:
+            connection = sqlite3.connect(self.db_name, check_same_thread=False)
+            connection.execute("PRAGMA query_only = ON")
+            connection.set_authorizer(read_only)
+            return connection
+        except BaseException:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def give_back(self, connection):
+        with self.lock:
+            if self.opened <= self.size:
+                self.idle.append(connection)
+                return
+            self.opened -= 1
+        connection.close()
+
+    def close(self):
+        # Pooled connections still out are closed as their cursors give them back
+        with self.lock:
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+            self.size = 0
+        for connection in idle:
+            connection.close()
+
+class OpenQuery:
+    # The cursor of one /query, on a connection taken from the QueryPool
+    def __init__(self, pool, sql, params):
+        self.pool = pool
+        self.connection = pool.take()
+        try:
+            self.cursor = self.connection.execute(sql, params)
+        except BaseException as e:
+            pool.give_back(self.connection)
+            if isinstance(e, sqlite3.DatabaseError) and str(e) == "not authorized":
+                raise HTTPError(403, "Only a single read-only SELECT can run through /query.")
+            raise
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def fetch(self, size):
+        # On a reader thread; one request at a time uses a cursor
+        with self.lock:
+            self.last_used = time.monotonic()
+            return self.cursor.fetchmany(size)
+
+    def close(self):
+        # Ends the statement, and its read snapshot, before the connection is reused
+        with self.lock:
+            if self.connection is None:
+                return
+            connection, self.connection = self.connection, None
+            self.cursor.close()
+            self.pool.give_back(connection)
+
+# Operations; each runs on a reader or the writer thread with that thread's
+# connection
+
+def list_master(db, kind):
+    table, key = masterdata.MASTER_TABLES[kind][:2]
+    return records(db.connect().execute(f"SELECT * FROM {table} ORDER BY {key}"))
+
+def create_master(db, kind, body):
+    key, columns, required = masterdata.MASTER_TABLES[kind][1:]
+    return {key: masterdata.create(db, kind, fields(body, columns, required))}
+
+def update_master(db, kind, row_id, body):
+    key, columns = masterdata.MASTER_TABLES[kind][1:3]
+    values = fields(body, columns)
+    if not values:
+        raise HTTPError(400, "Nothing to update.")
+    masterdata.update(db, kind, row_id, values)
+    return {key: row_id}
+
+def delete_master(db, kind, row_id):
+    masterdata.delete(db, kind, row_id)
+    return {masterdata.MASTER_TABLES[kind][1]: row_id}
+
+def upsert_master_data(db, body):
+    if not isinstance(body, dict) or set(body) - set(importer.MASTER_DATA):
+        raise HTTPError(400, f"Expected an object with lists of {', '.join(importer.MASTER_DATA)}.")
+    data = {kind: [{importer.column_name(name): value for name, value in record.items()} for record in rows]
+            for kind, rows in body.items()}
+    counts, problems = importer.upsert_master_data(db, data)
+    return {'counts': counts, 'problems': problems}
+
+def acquisition(body):
+    values = fields(body, importer.ACQUISITION_COLUMNS, ACQUISITION_REQUIRED)
+    for name in ('item_id', 'branch_id', 'quantity'):
+        whole_number(values, name)
+    for name in ('acquisition_method', 'source', 'authority_ref', 'remarks', 'acquisition_year'):
+        text(values, name)
+    iso_date(values, 'acquisition_date')
+    cost(values)
+    return tuple(values.get(name) for name in importer.ACQUISITION_COLUMNS)
+
+def add_acquisition(db, body):
+    if isinstance(body, list):
+        batches = [acquisition(record) for record in body]
+        importer.add_acquisitions(db, batches)
+        return {'count': len(batches)}
+    values = acquisition(body)
+    with db.transaction():
+        batch_id = db.execute_query(f"INSERT INTO asset_batches ({', '.join(importer.ACQUISITION_COLUMNS)}) "
+                                    f"VALUES ({', '.join('?' * len(values))})", values)
+    return {'batch_id': batch_id}
+
+def issue_return(db, body):
+    values = fields(body, ISSUE_RETURN_FIELDS, ('transaction_type', 'item_id', 'branch_id', 'quantity', 'transaction_date'))
+    for name in ('item_id', 'branch_id', 'quantity'):
+        whole_number(values, name)
+    for name in ('transaction_type', 'acquisition_year', 'authority_ref', 'remarks'):
+        text(values, name)
+    iso_date(values, 'transaction_date')
+    return {'allocations': [asdict(a) for a in allocation.issue_return(db, **values)]}
+
+def voucher_lines(body):
+    lines = []
+    for line in lines_of(body):
+        values = fields(line, ('item_id', 'acquisition_year', 'branch_id', 'quantity'), ('item_id', 'branch_id', 'quantity'))
+        for name in ('item_id', 'branch_id', 'quantity'):
+            whole_number(values, name)
+        text(values, 'acquisition_year')
+        lines.append(allocation.VoucherLine(**values))
+    return lines
+
+def lines_of(body):
+    lines = body.pop('lines')
+    if not isinstance(lines, list):
+        raise HTTPError(400, "lines must be a list.")
+    return lines
+
+def plan_voucher(db, body):
+    fields(body, ('lines', 'transaction_date', 'authority_ref', 'remarks', 'dry_run'), ('lines',))
+    return {'lines': [asdict(line) for line in allocation.plan_voucher(db, voucher_lines(body))]}
+
+def issue_voucher(db, body):
+    values = fields(body, ('lines', 'transaction_date', 'authority_ref', 'remarks', 'dry_run'), ('lines', 'transaction_date'))
+    iso_date(values, 'transaction_date')
+    for name in ('authority_ref', 'remarks'):
+        text(values, name)
+    lines = voucher_lines(values)
+    return {'lines': [asdict(line) for line in allocation.issue_voucher(db, lines, **values)]}
+
+def disposal_lines(body):
+    lines = []
+    for line in lines_of(body):
+        values = fields(line, ('item_id', 'acquisition_year', 'quantity'), ('item_id', 'quantity'))
+        for name in ('item_id', 'quantity'):
+            whole_number(values, name)
+        text(values, 'acquisition_year')
+        lines.append(allocation.DisposalLine(**values))
+    return lines
+
+def plan_disposal(db, body):
+    fields(body, ('lines', 'dry_run'), ('lines',))
+    return {'lines': [asdict(line) for line in allocation.plan_disposal(db, disposal_lines(body))]}
+
+def dispose(db, body):
+    values = fields(body, ('lines', 'disposal_date', 'disposal_method', 'authority_ref', 'remarks', 'dry_run'),
+                    ('lines', 'disposal_date', 'disposal_method'))
+    values.pop('dry_run', None)
+    iso_date(values, 'disposal_date')
+    for name in ('disposal_method', 'authority_ref', 'remarks'):
+        text(values, name)
+    lines = disposal_lines(values)
+    return {'lines': [asdict(line) for line in allocation.dispose(db, lines, **values)]}
+
+def as_of_params(db, body):
+    return checkpoints.as_of_params(db, iso_date(fields(body, ('as_of',), ('as_of',)), 'as_of'))
+
+def run_report(db, name, query, params):
+    cursor = db.connect().execute(query, params)
+    headers = queries.REPORTS[name]['headers']
+    return {'headers': headers, 'rows': [row[:len(headers)] for row in cursor.fetchall()]}
+
+class Server:
+    def __init__(self, db_name, readers=4, token=None):
+        self.db_name = db_name
+        self.token = token
+        Database(db_name).connect()  # migrate before the pool opens its connections
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix="aims-reader", initializer=self._open_reader)
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="aims-writer")
+        self.queries = {}
+        self.pool = QueryPool(db_name, MAX_QUERIES)
+        self.writes = 0
+
+    def _open_reader(self):
+        Database(self.db_name).connect().execute("PRAGMA query_only = ON")
+
+    async def read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.readers, fn, Database(self.db_name), *args)
+
+    async def on_writer(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.writer, fn, Database(self.db_name), *args)
+
+    async def write(self, fn, *args):
+        try:
+            return await self.on_writer(fn, *args)
+        finally:
+            self.writes += 1
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        route = (method, parts[0], len(parts))
+        if route == ("POST", "query", 1):
+            return await self.open_query(body)
+        if route == ("POST", "query", 2):
+            return await self.next_page(parts[1], page_size(fields(body, ('size',))))
+        if route == ("DELETE", "query", 2):
+            await self.close_query(parts[1])
+            return {}
+        if route == ("GET", "data-version", 1):
+            # Changes on every write made through the server and, through the
+            # writer connection's own pragma, on writes from other processes
+            data_version = await self.on_writer(lambda db: db.connect().execute("PRAGMA data_version").fetchone()[0])
+            return {'data_version': self.writes + data_version}
+        if parts[0] == "master" and len(parts) > 1:
+            kind = parts[1]
+            if kind not in masterdata.MASTER_TABLES:
+                raise HTTPError(404, f"No master data {kind}.")
+            if route == ("GET", "master", 2):
+                return await self.read(list_master, kind)
+            if route == ("POST", "master", 2):
+                return await self.write(create_master, kind, body)
+            if route[2] == 3:
+                try:
+                    row_id = int(parts[2])
+                except ValueError:
+                    raise HTTPError(404, f"No {kind} {parts[2]}.")
+                if method == "PUT":
+                    return await self.write(update_master, kind, row_id, body)
+                if method == "DELETE":
+                    return await self.write(delete_master, kind, row_id)
+        if route == ("POST", "master-data", 1):
+            return await self.write(upsert_master_data, body)
+        if route == ("POST", "acquisitions", 1):
+            return await self.write(add_acquisition, body)
+        if route == ("POST", "issue-return", 1):
+            if isinstance(body, dict) and body.get('dry_run'):
+                return await self.read(issue_return, body)
+            return await self.write(issue_return, body)
+        if route == ("POST", "vouchers", 1):
+            if isinstance(body, dict) and body.get('dry_run'):
+                return await self.read(plan_voucher, body)
+            return await self.write(issue_voucher, body)
+        if route == ("POST", "disposals", 1):
+            if isinstance(body, dict) and body.get('dry_run'):
+                return await self.read(plan_disposal, body)
+            return await self.write(dispose, body)
+        if route == ("POST", "as-of", 1):
+            # Building missing checkpoints writes, so it goes through the writer
+            return await self.write(as_of_params, body)
+        if route == ("GET", "reports", 2):
+            return await self.report(parts[1], query)
+        if route == ("GET", "health", 1):
+            return {'ok': True}
+        raise HTTPError(404, f"No route {method} {url.path}.")
+
+    async def report(self, name, query):
+        if name not in queries.REPORTS:
+            raise HTTPError(404, f"No report {name}.")
+        for name in ('from', 'to', 'as_of'):
+            if query.get(name):
+                iso_date(query, name)
+        as_of = query.get('as_of')
+        if as_of and not queries.REPORTS[name].get('as_of'):
+            raise HTTPError(400, f"The {name} report has no as-of view.")
+        # Building missing checkpoints writes, so it goes through the writer
+        as_of_params = await self.write(checkpoints.as_of_params, as_of) if as_of else None
+        sql, params = queries.report_query(name, query.get('from'), query.get('to'), query.get('branch'), as_of_params)
+        return await self.read(run_report, name, sql, params)
+
+    async def open_query(self, body):
+        values = fields(body, ('sql', 'params', 'size'), ('sql',))
+        size = page_size(values)
+        params = values.get('params') or []
+        if not isinstance(values['sql'], str) or not isinstance(params, (list, dict)):
+            raise HTTPError(400, "Expected sql text and a list or object of params.")
+        # With every pooled connection held, the least recently read cursor gives its up
+        while self.pool.full() and self.queries:
+            await self.close_query(min(self.queries, key=lambda key: self.queries[key].last_used))
+        loop = asyncio.get_running_loop()
+        cursor = await loop.run_in_executor(self.readers, OpenQuery, self.pool, values['sql'], params)
+        return await self.page(uuid.uuid4().hex, cursor, size)
+
+    async def next_page(self, cursor_id, size):
+        cursor = self.queries.pop(cursor_id, None)
+        if cursor is None:
+            raise HTTPError(404, "The query was closed on the server; run it again.")
+        return await self.page(cursor_id, cursor, size)
+
+    async def page(self, cursor_id, cursor, size):
+        # A short page is the last one; otherwise the cursor waits for the next request
+        loop = asyncio.get_running_loop()
+        try:
+            rows = await loop.run_in_executor(self.readers, cursor.fetch, size)
+        except BaseException:
+            await loop.run_in_executor(self.readers, cursor.close)
+            raise
+        if len(rows) < size:
+            await loop.run_in_executor(self.readers, cursor.close)
+            return {'rows': rows, 'cursor': None}
+        self.queries[cursor_id] = cursor
+        return {'rows': rows, 'cursor': cursor_id}
+
+    async def close_query(self, cursor_id):
+        cursor = self.queries.pop(cursor_id, None)
+        if cursor is not None:
+            await asyncio.get_running_loop().run_in_executor(self.readers, cursor.close)
+
+    async def expire_queries(self):
+        # Closes cursors whose client has stopped reading, releasing the WAL
+        # snapshot they hold
+        while True:
+            await asyncio.sleep(QUERY_TIMEOUT / 3)
+            now = time.monotonic()
+            for cursor_id, cursor in list(self.queries.items()):
+                if now - cursor.last_used > QUERY_TIMEOUT:
+                    await self.close_query(cursor_id)
+
+    def authorized(self, headers):
+        if not self.token:
+            return True
+        return hmac.compare_digest(headers.get("authorization", "").encode(), f"Bearer {self.token}".encode())
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive: JSON in, JSON out
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                raw = await reader.readexactly(length) if length else b""
+                if self.authorized(headers) or urlsplit(target).path == "/health":
+                    status, reply = await self.respond(method, target, raw)
+                else:
+                    status, reply = 401, {'error': "Missing or wrong AIMS_TOKEN.", 'type': "HTTPError"}
+                payload = json.dumps(reply).encode()
+                writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, raw):
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            return 400, {'error': "Body is not valid JSON.", 'type': "ValueError"}
+        try:
+            return 200, await self.dispatch(method, target, body)
+        except HTTPError as e:
+            return e.status, {'error': str(e), 'type': "HTTPError", **e.extra}
+        except (allocation.VoucherError, allocation.DisposalError) as e:
+            return 400, {'error': str(e), 'type': type(e).__name__, 'problems': e.problems}
+        except ValueError as e:
+            return 400, {'error': str(e), 'type': type(e).__name__}
+        except LookupError as e:
+            return 404, {'error': str(e), 'type': "LookupError"}
+        except sqlite3.IntegrityError as e:
+            return 409, {'error': str(e), 'type': type(e).__name__}
+        except sqlite3.Error as e:
+            return 500, {'error': str(e), 'type': type(e).__name__}
+        except Exception as e:
+            return 500, {'error': f"{type(e).__name__}: {e}", 'type': type(e).__name__}
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        expiry = asyncio.create_task(self.expire_queries())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            expiry.cancel()
+            for cursor in self.queries.values():
+                cursor.close()
+            self.pool.close()
+            self.readers.shutdown(wait=False)
+            self.writer.shutdown(wait=True)
+
+def serve(db_name, host="127.0.0.1", port=8765, readers=4, token=None):
+    # Raises ValueError rather than serve the network without a token
+    if not token and not is_loopback(host):
+        raise ValueError(f"Set AIMS_TOKEN to serve on {host}; without it anyone who can reach the port can read and change the data.")
+    async def main():
+        await Server(db_name, readers, token).serve(host, port)
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+
+@pytest.fixture
+def db(tmp_path):
+    # A freshly migrated database file per test
+    database = Database(str(tmp_path / "aims.db"))
+    database.connect()
+    yield database
+    database.close()
+
+def seed(db, items=3, branches=2, years=("2023", "2024"), quantity=10):
+    # Store plus `branches` more, items (every name used twice, so names do
+    # not identify items) and one Store acquisition per item and year, then
+    # an issue of half of each to every branch (a None year stays in Store)
+    db.execute_query("INSERT INTO categories (category_name) VALUES ('IT')")
+    db.execute_query("INSERT INTO sub_categories (category_id, subcategory_name) VALUES (1, 'Computers')")
+    db.execute_query("INSERT INTO branches (branch_name) VALUES ('Store')")
+    db.execute_many("INSERT INTO branches (branch_name) VALUES (?)", [(f"Branch {n}",) for n in range(branches)])
+    db.execute_many("INSERT INTO items (item_name, category_id, subcategory_id, govt_property_code) VALUES (?, 1, 1, ?)",
+                    [(f"Item {n // 2}", f"GP{n}") for n in range(items)])
+    db.execute_many("""INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year)
+                       VALUES (?, 1, ?, 'Purchase', ?, 2.5, ?)""",
+                    [(item_id, f"{year or '2022'}-01-15", quantity * (branches + 1), year)
+                     for item_id in range(1, items + 1) for year in years])
+    import allocation
+    for item_id in range(1, items + 1):
+        for year in filter(None, years):
+            for branch_id in range(2, branches + 2):
+                allocation.issue_return(db, "Issue", item_id, branch_id, year, quantity // 2, f"{year or '2022'}-02-01")
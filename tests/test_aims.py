@@ -0,0 +1,43 @@
+import argparse
+import os
+import subprocess
+import sys
+import pytest
+import aims
+from db import Database
+
+@pytest.mark.parametrize("value", ["2024-01-05", "2024-12-31"])
+def test_iso_date_accepts_padded_dates(value):
+    assert aims.iso_date(value) == value
+
+@pytest.mark.parametrize("value", ["2024-1-5", "2024-01-5", "20240105", "2024-02-30", "05/01/2024", ""])
+def test_iso_date_rejects_other_forms(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        aims.iso_date(value)
+
+def test_report_rejects_unpadded_date(db, capsys):
+    with pytest.raises(SystemExit) as exit:
+        aims.main(["--db", db.db_name, "report", "transactions", "--from", "2024-1-1"])
+    assert exit.value.code == 2
+    assert "YYYY-MM-DD" in capsys.readouterr().err
+
+def test_master_data_import_creates_a_new_database(tmp_path):
+    path = tmp_path / "new.db"
+    source = tmp_path / "categories.csv"
+    source.write_text("Category Name,Remarks\nIT,\nFurniture,\n", encoding="utf-8")
+    assert aims.main(["--db", str(path), "import", "categories", str(source)]) == 0
+    db = Database(str(path))
+    assert db.fetch_all("SELECT category_name FROM categories ORDER BY category_name") == [("Furniture",), ("IT",)]
+    db.disconnect()
+
+def test_other_commands_need_an_existing_database(tmp_path, capsys):
+    path = tmp_path / "missing.db"
+    assert aims.main(["--db", str(path), "report", "transactions"]) == 2
+    assert "database not found" in capsys.readouterr().err
+    assert not path.exists()
+
+def test_report_command_does_not_load_the_server():
+    code = "import sys, aims; aims.build_parser(); print('server' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(aims.__file__)))
+    assert result.stdout.strip() == "False"
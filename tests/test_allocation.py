@@ -0,0 +1,39 @@
+import sqlite3
+import pytest
+import allocation
+from conftest import seed
+
+def voucher(quantity):
+    return [allocation.VoucherLine(item_id=1, acquisition_year="2024", branch_id=2, quantity=quantity),
+            allocation.VoucherLine(item_id=2, acquisition_year="2024", branch_id=3, quantity=quantity)]
+
+def test_voucher_dry_run_does_not_take_the_write_lock(db):
+    seed(db)
+    db.connect().execute("PRAGMA busy_timeout = 0")
+    # Another writer holds the lock; Database shares one connection per thread
+    writer = sqlite3.connect(db.db_name, isolation_level=None)
+    try:
+        writer.execute("BEGIN IMMEDIATE")
+        lines = allocation.issue_voucher(db, voucher(4), "2024-03-01", dry_run=True)
+    finally:
+        writer.close()
+    assert [sum(a.quantity for a in line.allocations) for line in lines] == [4, 4]
+    assert db.fetch_one("SELECT COUNT(*) FROM asset_transactions WHERE transaction_date = '2024-03-01'")[0] == 0
+
+def test_voucher_posts_nothing_when_a_line_fails(db):
+    seed(db)
+    with pytest.raises(allocation.VoucherError) as error:
+        allocation.issue_voucher(db, voucher(4)[:1] + voucher(100)[1:], "2024-03-01")
+    assert error.value.problems == [(1, "Quantity exceeds available (20).")]
+    assert db.fetch_one("SELECT COUNT(*) FROM asset_transactions WHERE transaction_date = '2024-03-01'")[0] == 0
+    allocation.issue_voucher(db, voucher(4), "2024-03-01")
+    assert db.fetch_one("SELECT SUM(quantity) FROM asset_transactions WHERE transaction_date = '2024-03-01'")[0] == 8
+
+def test_batches_without_a_year_issue_like_any_other(db):
+    seed(db, items=1, branches=1, years=(None,))
+    assert allocation.plan_voucher(db, [allocation.VoucherLine(1, None, 2, 5)])[0].allocations[0].quantity == 5
+    allocations = allocation.issue_return(db, "Issue", 1, 2, None, 5, "2024-03-01")
+    assert [(a.batch_id, a.quantity) for a in allocations] == [(1, 5)]
+    assert db.fetch_one("SELECT acquisition_year, quantity FROM asset_batches WHERE branch_id = 2") == (None, 5)
+    allocation.issue_return(db, "Return", 1, 2, None, 2, "2024-03-02")
+    assert db.fetch_one("SELECT SUM(balance) FROM batch_balances WHERE branch_id = 1")[0] == 17
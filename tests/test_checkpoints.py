@@ -0,0 +1,40 @@
+from datetime import date
+import pytest
+import allocation
+import checkpoints
+import queries
+from conftest import seed
+
+def as_of(db, day):
+    params = checkpoints.as_of_params(db, day)
+    return set(db.fetch_all(f"SELECT * FROM ({queries.AS_OF_BALANCES}) WHERE balance != 0", params))
+
+def live(db):
+    return set(db.fetch_all(f"SELECT * FROM ({queries.BALANCES}) WHERE balance != 0"))
+
+def test_as_of_today_matches_the_live_balances(db):
+    seed(db)
+    assert as_of(db, date.today().isoformat()) == live(db)
+    assert db.fetch_one("SELECT COUNT(*) FROM checkpoint_months")[0] > 0
+
+def test_back_dated_postings_drop_the_later_checkpoints(db):
+    seed(db)
+    checkpoints.build_checkpoints(db, "2024-06")
+    before = as_of(db, "2023-03-09")
+    allocation.issue_return(db, "Issue", 1, 2, "2023", 2, "2023-03-10")
+    db.execute_query("""INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year)
+                        VALUES (2, 1, '2023-04-20', 'Purchase', 6, 4.0, '2023')""")
+    allocation.dispose(db, [allocation.DisposalLine(3, "2024", 3)], "2024-05-02", "Auction")
+    assert db.fetch_one("SELECT MAX(month) FROM checkpoint_months")[0] == "2023-02"
+    assert as_of(db, "2023-03-09") == before
+    assert (1, 2, "2023", 7) in as_of(db, "2023-03-10")
+    assert as_of(db, "2024-06-30") == live(db)
+
+@pytest.mark.parametrize("day", ["2022-12-31", "2023-02-28", "2023-03-10", "2023-04-30", "2024-05-01", "2024-05-31"])
+def test_checkpointed_balances_match_a_ledger_replay(db, day):
+    seed(db, items=4, branches=3, years=("2023", "2024", None))
+    checkpoints.build_checkpoints(db, "2024-06")
+    allocation.issue_return(db, "Issue", 1, 2, "2023", 2, "2023-03-10")
+    allocation.issue_return(db, "Return", 1, 2, "2023", 3, "2023-04-01")
+    allocation.dispose(db, [allocation.DisposalLine(4, None, 3)], "2024-05-02", "Auction")
+    assert checkpoints.verify_as_of(db, day) == []
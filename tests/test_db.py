@@ -0,0 +1,35 @@
+import sqlite3
+import pytest
+
+def test_execute_query_raises_and_rolls_back(db):
+    db.execute_query("INSERT INTO branches (branch_name) VALUES ('North')")
+    with pytest.raises(sqlite3.IntegrityError):
+        db.execute_query("INSERT INTO branches (branch_name) VALUES ('North')")
+    assert db.fetch_all("SELECT branch_name FROM branches") == [('North',)]
+    assert not db.connect().in_transaction
+
+def test_execute_query_returns_lastrowid(db):
+    assert db.execute_query("INSERT INTO branches (branch_name) VALUES ('North')") == 1
+    assert db.execute_query("INSERT INTO branches (branch_name) VALUES ('South')") == 2
+
+def test_fetch_raises_outside_transaction(db):
+    with pytest.raises(sqlite3.OperationalError):
+        db.fetch_all("SELECT missing FROM branches")
+    with pytest.raises(sqlite3.OperationalError):
+        db.fetch_one("SELECT missing FROM branches")
+
+def test_transaction_rolls_back_every_statement(db):
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction():
+            db.execute_query("INSERT INTO branches (branch_name) VALUES ('North')")
+            db.execute_many("INSERT INTO branches (branch_name) VALUES (?)", [('South',), ('North',)])
+    assert db.fetch_all("SELECT branch_name FROM branches") == []
+
+def test_nested_transactions_commit_once(db):
+    with db.transaction():
+        db.execute_query("INSERT INTO branches (branch_name) VALUES ('North')")
+        with db.transaction():
+            db.execute_query("INSERT INTO branches (branch_name) VALUES ('South')")
+        assert db.connect().in_transaction
+    assert not db.connect().in_transaction
+    assert db.fetch_one("SELECT COUNT(*) FROM branches")[0] == 2
@@ -0,0 +1,74 @@
+import os
+import pytest
+import importer
+from conftest import seed
+
+ROW = {"item": "", "govt_property_code": "GP0", "acquisition_date": "2024-01-05",
+       "acquisition_method": "Purchase", "acquisition_year": "2024", "quantity": "3", "cost": "2.5"}
+
+@pytest.fixture
+def items(db):
+    seed(db, years=())
+    return importer.ItemLookup(db)
+
+def test_acquisition_row_accepts_valid_row(items):
+    assert importer.acquisition_row(ROW, items, 1)[:7] == (1, 1, "2024-01-05", "Purchase", "", 3, 2.5)
+
+@pytest.mark.parametrize("value", ["2024-1-5", "2024-01-5", "20240105", "2024-02-30", ""])
+def test_acquisition_row_rejects_other_date_forms(items, value):
+    with pytest.raises(ValueError, match="YYYY-MM-DD"):
+        importer.acquisition_row(dict(ROW, acquisition_date=value), items, 1)
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", "abc"])
+def test_acquisition_row_rejects_non_finite_cost(items, value):
+    with pytest.raises(ValueError, match="not a number"):
+        importer.acquisition_row(dict(ROW, cost=value), items, 1)
+
+def test_missing_columns_leave_no_error_file(db, tmp_path):
+    seed(db, years=())
+    source = tmp_path / "acquisitions.csv"
+    source.write_text("Item,Quantity\nItem 0,3\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="needs the columns"):
+        importer.import_acquisitions(db, str(source))
+    assert not os.path.exists(importer.error_filename(str(source)))
+
+def test_item_codes_match_exactly_in_lookup_and_upsert(db):
+    seed(db, years=())
+    assert importer.ItemLookup(db).resolve("", "GP0") == 1
+    with pytest.raises(ValueError, match="unknown property code"):
+        importer.ItemLookup(db).resolve("", "gp0")
+    counts, problems = importer.upsert_master_data(db, {'items': [
+        {'item_name': "Laptop", 'govt_property_code': "gp0", 'category_name': "IT", 'subcategory_name': "Computers"}]})
+    assert counts['items']['inserted'] == 1 and not problems
+    lookup = importer.ItemLookup(db)
+    assert (lookup.resolve("", "GP0"), lookup.resolve("", "gp0")) == (1, 4)
+
+def test_master_data_upsert_inserts_new_records_and_updates_known_ones(db):
+    seed(db, years=())
+    counts, problems = importer.upsert_master_data(db, {
+        'categories': [{'category_name': "it", 'remarks': "Hardware"}, {'category_name': "Furniture"}],
+        'sub_categories': [{'category_name': "Furniture", 'subcategory_name': "Desks"},
+                           {'category_name': "IT", 'subcategory_name': "computers", 'remarks': "PCs"}],
+        'branches': [{'branch_name': "STORE", 'address': "Main road"}, {'branch_name': "North"}],
+        'items': [{'item_name': "Desk", 'govt_property_code': "FD1", 'category_name': "furniture", 'subcategory_name': "desks"},
+                  {'item_name': "Laptop", 'govt_property_code': "GP0", 'category_name': "IT", 'subcategory_name': "Computers"}],
+    })
+    assert not problems
+    assert counts == {kind: {'inserted': 1, 'updated': 1, 'rejected': 0} for kind in importer.MASTER_DATA}
+    # Known names keep their stored spelling; fields left out are kept
+    assert db.fetch_all("SELECT category_name, remarks FROM categories ORDER BY category_id") == [("IT", "Hardware"), ("Furniture", None)]
+    assert db.fetch_one("SELECT remarks FROM sub_categories WHERE subcategory_id = 1")[0] == "PCs"
+    assert db.fetch_all("SELECT branch_name, address FROM branches WHERE branch_name IN ('Store', 'North') ORDER BY branch_id") == [("Store", "Main road"), ("North", None)]
+    assert db.fetch_all("SELECT govt_property_code, item_name FROM items WHERE govt_property_code IN ('GP0', 'FD1') ORDER BY item_id") == [("GP0", "Laptop"), ("FD1", "Desk")]
+
+def test_master_data_upsert_reports_the_records_it_rejects(db, tmp_path):
+    seed(db, years=())
+    source = tmp_path / "items.csv"
+    source.write_text("Item Name,Govt Property Code,Category Name,Subcategory Name\n"
+                      "Chair,FC1,Furniture,Chairs\nMouse,,IT,Computers\nMonitor,GP9,IT,Screens\nLaptop,GP8,IT,Computers\n", encoding="utf-8")
+    counts, problems = importer.upsert_master_data(db, importer.read_master_data(str(source), 'items'))
+    assert counts == {'items': {'inserted': 1, 'updated': 0, 'rejected': 3}}
+    assert problems == [('items', 1, "unknown category 'Furniture'"),
+                        ('items', 2, "item_name, govt_property_code, category_name and subcategory_name are required"),
+                        ('items', 3, "no sub-category 'Screens' in 'IT'")]
+    assert db.fetch_one("SELECT item_name FROM items WHERE govt_property_code = 'GP8'")[0] == "Laptop"
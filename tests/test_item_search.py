@@ -0,0 +1,42 @@
+import pytest
+import queries
+from conftest import seed
+
+def search(db, text, limit=20):
+    return [item_id for item_id, name, code in db.fetch_all(queries.ITEM_SEARCH, {'match': queries.item_match(text), 'limit': limit})]
+
+@pytest.fixture
+def items(db):
+    seed(db, items=3, branches=1)
+    db.execute_many("INSERT INTO items (item_name, category_id, subcategory_id, specification, govt_property_code) VALUES (?, 1, 1, ?, ?)",
+                    [("Laptop Dell", "14 inch", "PC-100"), ("Laser Printer", "laptop compatible", "PR-7"), ("Desk", None, "LAP-9")])
+    return db
+
+@pytest.mark.parametrize("text, match", [
+    ("Ite", '"Ite"*'),
+    ("lap-top 15", '"lap"* "top"* "15"*'),
+    ('GP"1', '"GP"* "1"*'),
+    (" - ", None),
+])
+def test_item_match_quotes_every_word_as_a_prefix(text, match):
+    assert queries.item_match(text) == match
+
+def test_a_name_prefix_finds_every_item_it_starts(items):
+    assert sorted(search(items, "Ite")) == [1, 2, 3]
+    assert search(items, "item 1") == [3]
+
+def test_a_property_code_finds_its_item(items):
+    assert search(items, "GP2") == [3]
+    assert search(items, "pc-100") == [4]
+    assert search(items, "pc-1") == [4]
+
+def test_name_hits_rank_before_code_and_specification_hits(items):
+    assert search(items, "lap") == [4, 6, 5]
+    assert search(items, "lap", limit=1) == [4]
+
+def test_the_index_follows_item_edits(items):
+    items.execute_query("UPDATE items SET item_name = 'Notebook Dell' WHERE item_id = 4")
+    assert search(items, "note") == [4]
+    assert search(items, "lap") == [6, 5]
+    items.execute_query("DELETE FROM items WHERE item_id = 6")
+    assert search(items, "lap") == [5]
@@ -0,0 +1,47 @@
+import sqlite3
+import pytest
+import masterdata
+from conftest import seed
+
+def test_create_and_update_a_row(db):
+    seed(db, years=())
+    branch_id = masterdata.create(db, 'branches', {'branch_name': "North", 'address': "Hill road"})
+    masterdata.update(db, 'branches', branch_id, {'branch_name': "North Office"})
+    assert db.fetch_one("SELECT branch_name, address FROM branches WHERE branch_id = ?", (branch_id,)) == ("North Office", "Hill road")
+
+def test_updating_a_missing_row_raises_lookup_error(db):
+    seed(db, years=())
+    with pytest.raises(LookupError):
+        masterdata.update(db, 'categories', 99, {'category_name': "Furniture"})
+    with pytest.raises(LookupError):
+        masterdata.delete(db, 'categories', 99)
+
+def test_items_after_the_first_need_a_property_code(db):
+    db.execute_query("INSERT INTO categories (category_name) VALUES ('IT')")
+    db.execute_query("INSERT INTO sub_categories (category_id, subcategory_name) VALUES (1, 'Computers')")
+    item = {'item_name': "Laptop", 'category_id': 1, 'subcategory_id': 1}
+    masterdata.create(db, 'items', item)
+    with pytest.raises(ValueError, match="Govt Property Code"):
+        masterdata.create(db, 'items', item)
+    assert masterdata.create(db, 'items', dict(item, govt_property_code="GP1")) == 2
+
+@pytest.mark.parametrize("kind, row_id, message", [
+    ('categories', 1, "has subcategories"),
+    ('sub-categories', 1, "has items"),
+    ('branches', 2, "associated assets"),
+    ('items', 1, "asset batches"),
+    ('branches', 1, "Store"),
+])
+def test_rows_in_use_are_not_deleted(db, kind, row_id, message):
+    seed(db, items=2, branches=1)
+    table, key = masterdata.MASTER_TABLES[kind][:2]
+    with pytest.raises(sqlite3.IntegrityError, match=message):
+        masterdata.delete(db, kind, row_id)
+    assert db.fetch_one(f"SELECT COUNT(*) FROM {table} WHERE {key} = ?", (row_id,))[0] == 1
+
+def test_unused_rows_are_deleted(db):
+    seed(db, items=2, branches=1, years=())
+    masterdata.delete(db, 'items', 2)
+    masterdata.delete(db, 'branches', 2)
+    assert db.fetch_all("SELECT item_id FROM items") == [(1,)]
+    assert db.fetch_all("SELECT branch_id FROM branches") == [(1,)]
@@ -0,0 +1,42 @@
+import pytest
+import allocation
+import queries
+from conftest import seed
+
+np = pytest.importorskip("numpy")
+import pivot
+
+def cells(cube, level, measure, parent_id=None):
+    ids, labels, branches, matrix = cube.slice(level, measure, parent_id)
+    return {(row_id, branch_id): value for row_id, row in zip(ids, matrix)
+            for branch_id, value in zip(cube.branch_ids.tolist(), row) if value}
+
+@pytest.fixture
+def cube(db):
+    seed(db, items=5, branches=3, years=("2023", None))
+    db.execute_query("INSERT INTO categories (category_name) VALUES ('Furniture')")
+    db.execute_query("INSERT INTO sub_categories (category_id, subcategory_name) VALUES (2, 'Desks')")
+    db.execute_query("INSERT INTO items (item_name, category_id, subcategory_id, govt_property_code) VALUES ('Desk', 2, 2, 'GP9')")
+    db.execute_query("""INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year)
+                        VALUES (6, 1, '2023-03-01', 'Purchase', 8, 40.0, '2023')""")
+    allocation.issue_return(db, "Issue", 6, 3, "2023", 3, "2023-03-02")
+    allocation.dispose(db, [allocation.DisposalLine(2, "2023", 4)], "2023-04-01", "Auction")
+    return pivot.PivotCube(db)
+
+def test_item_quantities_equal_the_branch_balance_report(db, cube):
+    report = {(item_id, branch_id): total for _, _, total, branch_id, item_id in db.fetch_all(queries.BRANCH_BALANCE)}
+    assert cells(cube, 'item', 'quantity') == report
+
+def test_item_values_use_each_batch_cost(db, cube):
+    values = dict(((item_id, branch_id), value) for item_id, branch_id, value in db.fetch_all("""
+        SELECT bb.item_id, bb.branch_id, SUM(bb.balance * ab.cost) FROM batch_balances bb
+        JOIN asset_batches ab ON bb.batch_id = ab.batch_id GROUP BY bb.item_id, bb.branch_id HAVING SUM(bb.balance) != 0"""))
+    assert cells(cube, 'item', 'value') == pytest.approx(values)
+
+@pytest.mark.parametrize("measure", pivot.MEASURES)
+def test_levels_sum_to_the_same_totals(cube, measure):
+    items, categories = cube.slice('item', measure)[3], cube.slice('category', measure)[3]
+    assert categories.sum(axis=0) == pytest.approx(items.sum(axis=0))
+    desks = cube.slice('item', measure, parent_id=2)
+    assert desks[1] == ['Desk']
+    assert cube.slice('subcategory', measure, parent_id=2)[3] == pytest.approx(desks[3])
@@ -0,0 +1,36 @@
+import allocation
+import balances
+import queries
+from conftest import seed
+
+def test_checked_queries_search_their_ledger_tables(db):
+    assert queries.check_query_plans(db) == {}
+
+def test_plans_stay_on_the_indexes_with_statistics(db):
+    # With ANALYZE statistics for a populated ledger the planner may pick
+    # other plans than for the empty schema; they must still search
+    seed(db, items=20, branches=4, years=("2022", "2023", "2024", None))
+    allocation.dispose(db, [allocation.DisposalLine(item_id, "2023", 2) for item_id in range(1, 21)], "2024-06-01", "Auction")
+    db.execute_query("ANALYZE")
+    assert queries.check_query_plans(db) == {}
+
+def test_indexed_balances_match_the_ledger(db):
+    seed(db, items=6, branches=3, years=("2023", None))
+    allocation.issue_return(db, "Return", 1, 2, "2023", 3, "2023-03-01")
+    allocation.dispose(db, [allocation.DisposalLine(2, None, 4)], "2023-04-01", "Auction")
+    assert balances.verify_balances(db) == []
+    assert balances.verify_batch_balances(db) == []
+
+def test_covering_index_scan_is_a_full_scan(db):
+    scans = queries.full_table_scans(db, "SELECT item_id, SUM(balance) FROM batch_balances GROUP BY item_id")
+    assert scans and "USING COVERING INDEX" in scans[0]
+
+def test_full_reads_allow_whole_ledger_reports(db):
+    query = "SELECT item_id, SUM(balance) FROM batch_balances GROUP BY item_id"
+    assert queries.full_table_scans(db, query, full_reads={'batch_balances'}) == []
+
+def test_search_passes(db):
+    assert queries.full_table_scans(db, queries.BATCH_AVAILABLE, (1,)) == []
+
+def test_bare_ledger_scan_fails(db):
+    assert queries.full_table_scans(db, "SELECT * FROM asset_disposal WHERE remarks = 'x'")
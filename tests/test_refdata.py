@@ -0,0 +1,37 @@
+import sqlite3
+import pytest
+import allocation
+import refdata
+from conftest import seed
+
+@pytest.fixture
+def registry(db):
+    seed(db, items=2, branches=2)
+    return refdata.Registry()
+
+def test_reference_data_is_loaded_once(db, registry):
+    data = registry.get(db)
+    assert registry.get(db) is data
+    assert (registry.loads, data.store_id, data.branch_names[3]) == (1, 1, "Branch 1")
+    assert [row[0] for row in data.branches_except_store()] == [2, 3]
+
+def test_a_ledger_write_keeps_the_reference_data(db, registry):
+    data = registry.get(db)
+    allocation.issue_return(db, "Issue", 1, 2, "2024", 1, "2024-03-01")
+    assert registry.get(db) is data
+    assert registry.loads == 1
+
+def test_a_master_data_write_reloads_it(db, registry):
+    registry.get(db)
+    db.execute_query("INSERT INTO sub_categories (category_id, subcategory_name) VALUES (1, 'Printers')")
+    assert registry.get(db).subcategories(1) == [(1, "Computers"), (2, "Printers")]
+    assert registry.loads == 2
+
+def test_a_master_data_write_from_another_connection_reloads_it(db, registry):
+    registry.get(db)
+    other = sqlite3.connect(db.db_name)
+    with other:
+        other.execute("UPDATE branches SET branch_name = 'North' WHERE branch_id = 2")
+    other.close()
+    assert registry.get(db).branch_names[2] == "North"
+    assert registry.loads == 2
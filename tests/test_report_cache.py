@@ -0,0 +1,55 @@
+import sqlite3
+import allocation
+import queries
+from conftest import seed
+from report_cache import ReportCache
+
+def cached_report(db, cache, query):
+    # What QueryTableModel does: look up under the current version, fill on a miss
+    key, version = cache.key(db.db_name, query), db.data_version()
+    rows = cache.get(key, version)
+    if rows is None:
+        rows = db.fetch_all(query)
+        cache.put(key, version, rows)
+    return list(rows)
+
+def test_a_write_through_the_database_misses_the_cache(db):
+    seed(db)
+    cache = ReportCache()
+    first = cached_report(db, cache, queries.BRANCH_BALANCE)
+    assert cached_report(db, cache, queries.BRANCH_BALANCE) == first
+    assert (cache.hits, cache.misses) == (1, 1)
+    allocation.issue_return(db, "Issue", 1, 2, "2024", 1, "2024-03-01")
+    assert cached_report(db, cache, queries.BRANCH_BALANCE) != first
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_a_write_from_another_connection_misses_the_cache(db):
+    seed(db)
+    cache = ReportCache()
+    first = cached_report(db, cache, queries.STOCK_REGISTER)
+    other = sqlite3.connect(db.db_name)
+    with other:
+        other.execute("""INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year)
+                         VALUES (1, 1, '2024-03-01', 'Purchase', 5, 1.0, '2024')""")
+    other.close()
+    assert cached_report(db, cache, queries.STOCK_REGISTER) != first
+    assert cache.hits == 0
+
+def test_entries_are_keyed_on_the_parameters():
+    cache = ReportCache()
+    cache.put(cache.key("a.db", "q", {'b': 2, 'a': 1}), 1, [(1,)])
+    assert cache.get(cache.key("a.db", "q", {'a': 1, 'b': 2}), 1) == ((1,),)
+    assert cache.get(cache.key("a.db", "q", {'a': 1, 'b': 3}), 1) is None
+    assert cache.get(cache.key("b.db", "q", {'a': 1, 'b': 2}), 1) is None
+
+def test_the_least_recently_used_entries_are_evicted_past_the_row_budget():
+    cache = ReportCache(max_rows=5)
+    for name in "abc":
+        cache.put(name, 1, [(name,)] * 2)
+    assert cache.get("a", 1) is None
+    assert cache.get("b", 1) is not None
+    cache.put("d", 1, [("d",)] * 2)
+    assert cache.get("c", 1) is None and cache.get("b", 1) is not None
+    cache.put("e", 1, [("e",)] * 6)
+    assert cache.get("e", 1) is None
+    assert cache.stats()['rows'] == 4
@@ -0,0 +1,91 @@
+import json
+import pytest
+import allocation
+import queries
+from conftest import seed
+
+def pages(db, query, params, keys, size):
+    rows, after = [], None
+    while True:
+        page_sql, page_params = queries.keyset_page(query, params, keys, after, size)
+        page = db.fetch_all(page_sql, page_params)
+        rows.extend(page)
+        if len(page) < size:
+            return rows
+        after = page[-1][-len(keys):]
+
+@pytest.mark.parametrize("name", ['stock-register', 'branch-balance', 'valuation', 'category-valuation'])
+def test_report_pages_cover_the_report(db, name):
+    seed(db, items=7, branches=3, years=("2023", None))
+    report = queries.REPORTS[name]
+    width = len(report['headers'])
+    full = db.fetch_all(report['query'])
+    paged = pages(db, report['query'], (), report['keys'], 4)
+    assert len(paged) == len(full)
+    assert sorted(map(repr, (row[:width] for row in paged))) == sorted(map(repr, (row[:width] for row in full)))
+
+@pytest.mark.parametrize("name", ['stock-register', 'branch-balance'])
+def test_seek_pages_match_the_wrapped_report(db, name, monkeypatch):
+    seed(db, items=7, branches=3, years=("2023", None))
+    report = queries.REPORTS[name]
+    assert "FROM (" not in queries.keyset_page(report['query'], (), report['keys'], (1,) * len(report['keys']), 4)[0]
+    seeked = pages(db, report['query'], (), report['keys'], 4)
+    monkeypatch.setattr(queries, "SEEK_PAGES", {})
+    assert pages(db, report['query'], (), report['keys'], 4) == seeked
+
+def test_dashboard_pages_keep_the_report_order(db):
+    seed(db, items=9, branches=3, years=("2023", None))
+    full = db.fetch_all(queries.DASHBOARD)
+    paged = pages(db, queries.DASHBOARD, (), queries.DASHBOARD_KEYS, 5)
+    assert [row[:8] for row in paged] == full
+
+def test_pages_with_named_parameters(db):
+    seed(db, items=5, branches=2)
+    params = {'month': '', 'start': '', 'as_of': '2024-12-31'}
+    full = db.fetch_all(queries.DASHBOARD_AS_OF, params)
+    assert [row[:8] for row in pages(db, queries.DASHBOARD_AS_OF, params, queries.DASHBOARD_KEYS, 3)] == full
+
+def test_report_keys_identify_rows(db):
+    seed(db, items=6, branches=2, years=("2023", None))
+    for name, report in queries.REPORTS.items():
+        if 'keys' in report:
+            query, params = queries.keyset_page(report['query'], (), report['keys'])
+            keys = [row[-len(report['keys']):] for row in db.fetch_all(query, params)]
+            assert len(keys) == len(set(keys)), name
+
+def test_dashboard_rows_match_the_dashboard(db):
+    seed(db, items=5, branches=2, years=("2023", None))
+    full = db.fetch_all(queries.DASHBOARD)
+    wanted = [row for n, row in enumerate(full) if n % 3 == 0]
+    keys = json.dumps([[row[6], row[7], row[4]] for row in wanted] + [[99, 1, "2023"]])
+    assert db.fetch_all(queries.DASHBOARD_ROWS + " ORDER BY 1, 2, 3, 4, 5", {'keys': keys}) == wanted
+    assert None in [row[4] for row in wanted]
+
+@pytest.mark.parametrize("name, distinct", [
+    ('disposals', "SELECT DISTINCT disposal_method FROM asset_disposal ORDER BY 1"),
+    ('acquisitions', "SELECT DISTINCT acquisition_method FROM asset_batches WHERE acquisition_method NOT IN ('Issue', 'Return') ORDER BY 1"),
+    ('transactions', "SELECT DISTINCT transaction_type FROM asset_transactions ORDER BY 1"),
+])
+def test_history_types_are_the_distinct_values(db, name, distinct):
+    seed(db, items=3, branches=2)
+    db.execute_many("INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, acquisition_year) "
+                    "VALUES (1, 1, '2024-01-01', ?, 1, '2024')", [("Donation",), ("Transfer In",), ("Donation",)])
+    db.execute_many("INSERT INTO asset_disposal (batch_id, disposal_date, quantity, disposal_method) VALUES (1, '2024-06-01', 1, ?)",
+                    [("Sale",), ("Condemnation",), ("Sale",)])
+    db.execute_query("INSERT INTO asset_transactions (batch_id, transaction_type, from_branch_id, to_branch_id, transaction_date, quantity) "
+                     "VALUES (1, 'Return', 2, 1, '2024-06-01', 1)")
+    types = db.fetch_all(queries.HISTORY[name]['types'])
+    assert types == db.fetch_all(distinct) and len(types) > 1
+
+def test_valuation_follows_issued_and_returned_stock_to_its_acquisition_cost(db):
+    seed(db, items=1, branches=1, years=())
+    db.execute_many("""INSERT INTO asset_batches (item_id, branch_id, acquisition_date, acquisition_method, quantity, cost, acquisition_year)
+                       VALUES (1, 1, ?, 'Purchase', 10, ?, '2023')""", [("2023-01-10", 2.0), ("2023-06-10", 3.0)])
+    allocation.issue_return(db, "Issue", 1, 2, "2023", 15, "2023-07-01")
+    allocation.issue_return(db, "Return", 1, 2, "2023", 12, "2023-08-01")
+    # Derived batches are valued at their root's cost, not the one copied onto them
+    db.execute_query("UPDATE asset_batches SET cost = 99 WHERE source_batch_id IS NOT NULL")
+    valuation = db.fetch_all(queries.VALUATION_BALANCES + " ORDER BY bb.branch_id")
+    # Store: 5 left of the second purchase, 10 + 2 returned; the branch keeps 3 of the second
+    assert valuation == [(1, 1, "2023", 17, 5 * 3.0 + 10 * 2.0 + 2 * 3.0), (1, 2, "2023", 3, 3 * 3.0)]
+    assert db.fetch_all(queries.CATEGORY_VALUATION) == [("IT", "Branch 0", 3, 9.0), ("IT", "Store", 17, 41.0)]
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import pytest
+import allocation
+import client
+import importer
+import masterdata
+import queries
+import server
+from db import Database
+from conftest import seed
+
+TOKEN = "test-token"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def url(db):
+    # python -m aims serve on the test database in its own process
+    seed(db, items=6, branches=2)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen([sys.executable, "aims.py", "--db", db.db_name, "serve", "--port", str(port)], cwd=ROOT,
+                               env=dict(os.environ, AIMS_TOKEN=TOKEN), stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            client.RemoteConnection(url, token="").call("GET", "/health")
+            break
+        except sqlite3.OperationalError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise
+            time.sleep(0.05)
+    yield url
+    process.terminate()
+    process.wait(10)
+
+@pytest.fixture
+def remote(url):
+    connection = client.RemoteConnection(url, token=TOKEN, page_size=4)
+    yield connection
+    connection.close()
+
+@pytest.fixture
+def client_db(url, monkeypatch):
+    # A Database in client mode, as the GUI runs with --server
+    monkeypatch.setenv("AIMS_TOKEN", TOKEN)
+    monkeypatch.setattr(Database, "server_url", url)
+    remote_db = Database("remote.db")
+    yield remote_db
+    remote_db.disconnect()
+
+def test_requests_need_the_token(url):
+    with pytest.raises(sqlite3.OperationalError, match="AIMS_TOKEN"):
+        client.RemoteConnection(url, token="wrong").execute("SELECT 1")
+    with pytest.raises(sqlite3.OperationalError, match="AIMS_TOKEN"):
+        client.RemoteConnection(url, token="").call("GET", "/data-version")
+
+@pytest.mark.parametrize("sql", [
+    "ATTACH DATABASE 'other.db' AS other",
+    "PRAGMA query_only = OFF",
+    "UPDATE sqlite_master SET sql = ''",
+    "DELETE FROM asset_batches",
+    "UPDATE items SET item_name = 'x'",
+    "CREATE TABLE stolen (x)",
+    "DROP TABLE items",
+    "BEGIN IMMEDIATE",
+    "WITH gone AS (SELECT 1) DELETE FROM items",
+])
+def test_query_runs_only_reads(db, remote, sql):
+    with pytest.raises(sqlite3.Error):
+        remote.execute(sql).fetchall()
+    assert db.fetch_one("SELECT COUNT(*) FROM items")[0] == 6
+    assert db.fetch_one("SELECT COUNT(*) FROM asset_batches")[0] > 0
+
+def test_query_rejects_several_statements(db, remote):
+    with pytest.raises(sqlite3.Error):
+        remote.execute("SELECT 1; DELETE FROM items")
+    assert db.fetch_one("SELECT COUNT(*) FROM items")[0] == 6
+
+def test_query_searches_items(remote):
+    rows = remote.execute(queries.ITEM_SEARCH, {'match': queries.item_match("GP3"), 'limit': 20}).fetchall()
+    assert [row[2] for row in rows] == ["GP3"]
+
+def test_query_pages_through_the_result(db, remote):
+    cursor = remote.execute("SELECT batch_id FROM asset_batches ORDER BY batch_id")
+    assert len(cursor.rows) == 4 and cursor.cursor is not None
+    assert cursor.fetchmany(6) + cursor.fetchall() == db.fetch_all("SELECT batch_id FROM asset_batches ORDER BY batch_id")
+    assert cursor.cursor is None
+    closed = remote.execute("SELECT batch_id FROM asset_batches")
+    cursor_id = closed.cursor
+    closed.close()
+    with pytest.raises(LookupError):
+        remote.call("POST", f"/query/{cursor_id}", {'size': 4})
+
+ACQUISITION = {'item_id': 1, 'branch_id': 1, 'acquisition_date': "2024-05-01", 'acquisition_method': "Purchase",
+               'quantity': 4, 'cost': 1.5, 'acquisition_year': "2024"}
+ISSUE = {'transaction_type': "Issue", 'item_id': 1, 'branch_id': 2, 'acquisition_year': "2023", 'quantity': 1,
+         'transaction_date': "2024-05-02"}
+
+@pytest.mark.parametrize("path, body, field", [
+    ("/acquisitions", dict(ACQUISITION, acquisition_date="yesterday"), "acquisition_date"),
+    ("/acquisitions", dict(ACQUISITION, acquisition_date="2024-5-1"), "acquisition_date"),
+    ("/acquisitions", dict(ACQUISITION, cost="abc"), "cost"),
+    ("/acquisitions", dict(ACQUISITION, cost=-1), "cost"),
+    ("/acquisitions", dict(ACQUISITION, quantity="4"), "quantity"),
+    ("/acquisitions", dict(ACQUISITION, quantity=0), "quantity"),
+    ("/acquisitions", dict(ACQUISITION, item_id="1"), "item_id"),
+    ("/acquisitions", [ACQUISITION, dict(ACQUISITION, quantity=2.5)], "quantity"),
+    ("/issue-return", dict(ISSUE, transaction_date="not a date"), "transaction_date"),
+    ("/issue-return", dict(ISSUE, quantity="1"), "quantity"),
+    ("/issue-return", dict(ISSUE, branch_id=None), "branch_id"),
+    ("/issue-return", dict(ISSUE, acquisition_year=2023), "acquisition_year"),
+    ("/vouchers", {'lines': [{'item_id': 1, 'branch_id': 2, 'quantity': 1}], 'transaction_date': "today"}, "transaction_date"),
+    ("/vouchers", {'lines': [{'item_id': 1, 'branch_id': 2, 'quantity': "1"}], 'transaction_date': "2024-05-02"}, "quantity"),
+    ("/disposals", {'lines': [{'item_id': 1, 'quantity': 1}], 'disposal_date': "2024/05/02", 'disposal_method': "Sale"},
+     "disposal_date"),
+    ("/disposals", {'lines': [{'item_id': 1, 'quantity': True}], 'disposal_date': "2024-05-02", 'disposal_method': "Sale"},
+     "quantity"),
+    ("/as-of", {'as_of': "2024-02-30"}, "as_of"),
+])
+def test_writes_reject_bad_values(db, remote, path, body, field):
+    before = db.fetch_all("SELECT COUNT(*) FROM asset_batches UNION ALL SELECT COUNT(*) FROM asset_transactions")
+    with pytest.raises(ValueError, match=field):
+        remote.call("POST", path, body)
+    assert db.fetch_all("SELECT COUNT(*) FROM asset_batches UNION ALL SELECT COUNT(*) FROM asset_transactions") == before
+
+def test_reports_reject_bad_dates(remote):
+    with pytest.raises(ValueError, match="from"):
+        remote.call("GET", "/reports/transactions?from=last-week")
+
+def test_query_connections_are_pooled(db, monkeypatch):
+    seed(db, items=3, branches=1)
+    monkeypatch.setattr(server, "MAX_QUERIES", 2)
+    async def run(app):
+        for _ in range(5):
+            assert (await app.dispatch("POST", "/query", {'sql': "SELECT item_id FROM items"}))['cursor'] is None
+        assert app.pool.opened == 1
+        held = [(await app.dispatch("POST", "/query", {'sql': "SELECT batch_id FROM asset_batches", 'size': 1}))['cursor']
+                for _ in range(3)]
+        assert app.pool.opened == 2 and list(app.queries) == held[1:]
+        with pytest.raises(server.HTTPError):
+            await app.dispatch("POST", f"/query/{held[0]}", {})
+        assert (await app.dispatch("POST", f"/query/{held[2]}", {'size': 100}))['cursor'] is None
+        assert app.pool.idle
+    app = server.Server(db.db_name, readers=2)
+    try:
+        asyncio.run(run(app))
+    finally:
+        for cursor in app.queries.values():
+            cursor.close()
+        app.readers.shutdown()
+        app.writer.shutdown()
+        app.pool.close()
+
+def test_client_mode_writes_through_named_operations(db, client_db):
+    category_id = masterdata.create(client_db, 'categories', {'category_name': "Furniture", 'remarks': None})
+    with pytest.raises(sqlite3.IntegrityError):
+        masterdata.delete(client_db, 'categories', 1)
+    importer.add_acquisitions(client_db, [(1, 1, "2024-05-01", "Purchase", "", 4, 1.5, "", "", "2024")])
+    lines = allocation.issue_voucher(client_db, [allocation.VoucherLine(1, "2024", 2, 3)], "2024-05-02")
+    assert sum(a.quantity for a in lines[0].allocations) == 3
+    with pytest.raises(allocation.VoucherError) as error:
+        allocation.issue_voucher(client_db, [allocation.VoucherLine(1, "2024", 2, 999)], "2024-05-02")
+    assert error.value.problems[0][0] == 0
+    with pytest.raises(sqlite3.Error):
+        client_db.execute_query("DELETE FROM asset_batches")
+    assert db.fetch_one("SELECT category_name FROM categories WHERE category_id = ?", (category_id,)) == ("Furniture",)
+    assert db.fetch_one("SELECT SUM(quantity) FROM asset_transactions WHERE transaction_date = '2024-05-02'")[0] == 3
+    assert client_db.fetch_all("SELECT item_id FROM items ORDER BY item_id") == db.fetch_all("SELECT item_id FROM items ORDER BY item_id")
+
+def test_client_mode_raises_the_local_errors(db, client_db):
+    with pytest.raises(LookupError):
+        masterdata.update(client_db, 'categories', 99, {'category_name': "Furniture"})
+    with pytest.raises(ValueError, match="Govt Property Code"):
+        masterdata.create(client_db, 'items', {'item_name': "Laptop", 'category_id': 1, 'subcategory_id': 1})
+    with pytest.raises(sqlite3.IntegrityError, match="Store"):
+        masterdata.delete(client_db, 'branches', 1)
+    assert db.fetch_one("SELECT COUNT(*) FROM branches WHERE branch_id = 1")[0] == 1
+
+def test_client_mode_data_version_moves_on_writes(client_db):
+    before = client_db.data_version()
+    masterdata.create(client_db, 'branches', {'branch_name': "East"})
+    assert client_db.data_version() != before
+
+def test_serve_needs_a_token_beyond_loopback(tmp_path):
+    with pytest.raises(ValueError, match="AIMS_TOKEN"):
+        server.serve(str(tmp_path / "aims.db"), "0.0.0.0", 0)
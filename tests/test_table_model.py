@@ -0,0 +1,59 @@
+import bisect
+import pytest
+
+pytest.importorskip("PySide6")
+
+import time
+from PySide6.QtCore import QCoreApplication
+from conftest import seed
+from gui_table_model import QueryTableModel, insertion_point
+from gui_workers import query_pool
+import queries
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+def settle(app, model):
+    deadline = time.monotonic() + 10
+    while (model.is_loading() or query_pool.activeThreadCount()) and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.005)
+    app.processEvents()
+
+def dashboard_model(app, db, chunk_size):
+    model = QueryTableModel(queries.REPORTS['dashboard']['headers'], chunk_size=chunk_size)
+    model.set_query(db, queries.DASHBOARD, (), queries.DASHBOARD_KEYS)
+    settle(app, model)
+    return model
+
+@pytest.mark.parametrize("value", [0, 1, 2, 3, 5, 8, 9])
+def test_insertion_point_matches_bisect(value):
+    rows = [("a", 1), ("b", 2), ("c", 2), ("d", 3), ("e", 8)]
+    assert insertion_point(rows, value, lambda row: row[1]) == bisect.bisect([row[1] for row in rows], value)
+
+def test_insertion_point_empty():
+    assert insertion_point([], ("x",), lambda row: row) == 0
+
+def test_model_pages_without_holding_a_pool_thread(app, db):
+    seed(db, items=8, branches=3)
+    model = dashboard_model(app, db, 10)
+    assert model.rowCount() == 10 and model.canFetchMore()
+    assert query_pool.activeThreadCount() == 0
+    while model.canFetchMore():
+        model.fetchMore()
+        settle(app, model)
+    assert model.is_complete()
+    assert [row[:8] for row in model.rows] == db.fetch_all(queries.DASHBOARD)
+
+def test_patch_rows_leaves_rows_past_the_loaded_pages(app, db):
+    seed(db, items=8, branches=3)
+    model = dashboard_model(app, db, 10)
+    full = db.fetch_all(*queries.keyset_page(queries.DASHBOARD, (), queries.DASHBOARD_KEYS))
+    key = lambda row: (row[6], row[7], row[4])
+    inside, outside = full[3], full[20]
+    changed = inside[:5] + (99,) + inside[6:]
+    model.patch_rows(key, {key(inside), key(outside)}, [changed, outside])
+    assert model.rowCount() == 10
+    assert model.rows[3] == changed
+    assert key(outside) not in {key(row) for row in model.rows}
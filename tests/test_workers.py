@@ -0,0 +1,60 @@
+import threading
+import time
+import pytest
+
+pytest.importorskip("PySide6")
+
+from PySide6.QtCore import QCoreApplication
+from conftest import seed
+from gui_workers import QueryWorker, fetch_in_background, query_pool
+import queries
+
+NUMBERS = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?) SELECT x FROM n"
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+def wait(app, done):
+    deadline = time.monotonic() + 10
+    while not done() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.005)
+    query_pool.waitForDone(10000)
+    app.processEvents()
+
+def test_fetch_in_background_collects_every_chunk_on_the_gui_thread(app, db):
+    results = []
+    fetch_in_background(db, NUMBERS, (1201,), lambda rows: results.append((list(rows), threading.current_thread())))
+    wait(app, lambda: results)
+    assert results == [([(x,) for x in range(1, 1202)], threading.main_thread())]
+
+def test_fetch_in_background_reads_the_report(app, db):
+    seed(db, items=6, branches=3)
+    results = []
+    fetch_in_background(db, queries.BRANCH_BALANCE, (), results.append)
+    wait(app, lambda: results)
+    assert results == [db.fetch_all(queries.BRANCH_BALANCE)]
+
+def test_fetch_in_background_reports_a_failed_query(app, db):
+    results, failures = [], []
+    fetch_in_background(db, "SELECT * FROM no_such_table", (), results.append, failures.append)
+    wait(app, lambda: failures)
+    assert results == [] and "no_such_table" in failures[0]
+
+def test_a_cancelled_worker_sends_nothing(app, db):
+    signals = []
+    worker = QueryWorker(7, db.db_name, NUMBERS, (10,), chunk_size=4)
+    worker.signals.chunk.connect(lambda generation, chunk: signals.append(('chunk', generation)))
+    worker.signals.done.connect(lambda generation: signals.append(('done', generation)))
+    worker.cancel()
+    worker.run()
+    assert signals == []
+
+def test_chunks_carry_the_generation_they_were_started_with(app, db):
+    signals = []
+    worker = QueryWorker(7, db.db_name, NUMBERS, (10,), chunk_size=4)
+    worker.signals.chunk.connect(lambda generation, chunk: signals.append((generation, len(chunk))))
+    worker.signals.done.connect(lambda generation: signals.append((generation, 'done')))
+    worker.run()
+    assert signals == [(7, 4), (7, 4), (7, 2), (7, 'done')]